@@ -0,0 +1,124 @@
+# Aggregates derived from a user's transactions.
+# Each one can be built from the full history or moved forward one record at a time, so the
+# storage layer keeps them current on insert and the pages never have to rescan the rows.
+import pandas as pd
+
+LEDGER_TYPES = ("Income", "Expense", "Loan", "EMI")
+
+# --- Balance Ledger ---
+
+def empty_ledger():
+    """Running totals per transaction type plus the number of rows they cover."""
+    ledger = {trans_type: 0.0 for trans_type in LEDGER_TYPES}
+    ledger["Rows"] = 0
+    return ledger
+
+def ledger_from_frame(df):
+    """Builds the running totals from a user's full transaction history."""
+    ledger = empty_ledger()
+    if df.empty:
+        return ledger
+    amounts = pd.to_numeric(df['Amount'], errors='coerce').fillna(0)
+    sums = amounts.groupby(df['Type'], observed=True).sum()
+    for trans_type in LEDGER_TYPES:
+        ledger[trans_type] = float(sums.get(trans_type, 0.0))
+    ledger["Rows"] = len(df)
+    return ledger
+
+def apply_to_ledger(ledger, record):
+    """Moves the running totals forward by one new transaction record."""
+    ledger = dict(ledger)
+    if record["Type"] in LEDGER_TYPES:
+        amount = pd.to_numeric(record["Amount"], errors='coerce')
+        ledger[record["Type"]] += 0.0 if pd.isna(amount) else float(amount)
+    ledger["Rows"] += 1
+    return ledger
+
+def merge_ledgers(ledger, other):
+    """Adds the totals of a batch of new rows to the running totals."""
+    return {key: ledger[key] + other[key] for key in ledger}
+
+def ledger_summary(ledger):
+    """The figures shown on the dashboard and wallet cards."""
+    return {
+        "total_income": ledger["Income"],
+        "total_expense": ledger["Expense"],
+        "total_loans_taken": ledger["Loan"],
+        "total_emi_paid": ledger["EMI"],
+        "total_balance": ledger["Income"] - ledger["Expense"] - ledger["EMI"] + ledger["Loan"],
+        "net_loans": ledger["Loan"] - ledger["EMI"],
+        "transaction_count": ledger["Rows"],
+    }
+
+# --- Period Rollup ---
+# rollup[granularity][(period start "YYYY-MM-DD", Type, Category)] = [summed Amount, row count]
+
+ROLLUP_GRANULARITIES = {"D": "D", "W": "W-SUN", "M": "M", "Y": "Y"} # Rollup granularity -> pandas period frequency (weeks start on Monday)
+
+def empty_rollup():
+    return {granularity: {} for granularity in ROLLUP_GRANULARITIES}
+
+def _period_start(date, granularity):
+    if granularity == "W":
+        return (date - pd.Timedelta(days=date.weekday())).normalize()
+    if granularity == "M":
+        return date.replace(day=1)
+    if granularity == "Y":
+        return date.replace(month=1, day=1)
+    return date
+
+def rollup_from_frame(df):
+    """Builds the per-period rollup from a user's full transaction history."""
+    rollup = empty_rollup()
+    if df.empty:
+        return rollup
+    dates = pd.to_datetime(df['Date'], errors='coerce')
+    valid = dates.notna()
+    dates = dates[valid]
+    amounts = pd.to_numeric(df['Amount'], errors='coerce').fillna(0)[valid]
+    for granularity, freq in ROLLUP_GRANULARITIES.items():
+        periods = dates.dt.to_period(freq).dt.start_time.dt.strftime('%Y-%m-%d')
+        grouped = amounts.groupby([periods, df['Type'][valid], df['Category'][valid]], observed=True).agg(['sum', 'count'])
+        rollup[granularity] = {key: [float(total), int(count)] for key, total, count in zip(grouped.index, grouped['sum'], grouped['count'])}
+    return rollup
+
+def apply_to_rollup(rollup, record):
+    """Adds one new transaction record to every granularity of the rollup in place."""
+    date = pd.to_datetime(record["Date"], errors='coerce')
+    if pd.isna(date):
+        return
+    amount = pd.to_numeric(record["Amount"], errors='coerce')
+    amount = 0.0 if pd.isna(amount) else float(amount)
+    for granularity in ROLLUP_GRANULARITIES:
+        key = (_period_start(date, granularity).strftime('%Y-%m-%d'), record["Type"], record["Category"])
+        cell = rollup[granularity].setdefault(key, [0.0, 0])
+        cell[0] += amount
+        cell[1] += 1
+
+def rollup_cells(rollup):
+    """Number of cells across every granularity of the rollup."""
+    return sum(len(cells) for cells in rollup.values())
+
+def merge_rollups(rollup, other):
+    """Adds a rollup built from a batch of new rows into rollup in place."""
+    for granularity, cells in other.items():
+        target = rollup[granularity]
+        for key, (amount, count) in cells.items():
+            cell = target.setdefault(key, [0.0, 0])
+            cell[0] += amount
+            cell[1] += count
+
+def rollup_frame(rollup, granularity, types=None):
+    """Returns one granularity of the rollup as a frame of Period, Type, Category, Amount and Count."""
+    cells = rollup[granularity]
+    if types is not None:
+        cells = {key: cell for key, cell in cells.items() if key[1] in types}
+    df = pd.DataFrame([(*key, *cell) for key, cell in cells.items()],
+                      columns=["Period", "Type", "Category", "Amount", "Count"])
+    df['Period'] = pd.to_datetime(df['Period'], format='%Y-%m-%d')
+    return df
+
+def category_totals(df, trans_type="Expense"):
+    """Amount per Category of one transaction type over a rollup frame, whatever its granularity."""
+    df = df[df['Type'] == trans_type]
+    return df.groupby('Category', as_index=False)['Amount'].sum()
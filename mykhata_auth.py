@@ -0,0 +1,118 @@
+# Password hashing for MyKhata.
+# Hashes are salted PBKDF2-SHA256, stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>" so the cost can
+# rise over time without invalidating old hashes. The cost is calibrated once per process to take about
+# KDF_TARGET_MS on this host. Hashing runs on the calling session's script thread; hashlib releases the GIL
+# while deriving, so other sessions keep running, and at most KDF_CONCURRENCY hashes run at once.
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor # Only for the benchmark's simulated sessions
+
+KDF_SCHEME = "pbkdf2_sha256"
+KDF_TARGET_MS = float(os.environ.get("MYKHATA_KDF_TARGET_MS", "100")) # Target time for one hash on this host
+KDF_MIN_ITERATIONS = 100_000 # Never go below this, however slow the host
+KDF_SALT_BYTES = 16
+KDF_CONCURRENCY = int(os.environ.get("MYKHATA_KDF_CONCURRENCY", "4")) # Concurrent hashes; bounds the CPU a login burst can take
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$") # Unsalted hashes written by earlier versions
+
+_calibration = {}
+_calibration_lock = threading.Lock()
+_kdf_slots = threading.BoundedSemaphore(KDF_CONCURRENCY)
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def _derive(password, salt, iterations):
+    with _kdf_slots: # A burst of logins queues here rather than taking every core
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+def calibrate(target_ms=KDF_TARGET_MS, probe_iterations=20_000):
+    """Returns a report of timing PBKDF2 on this host and the iteration count that meets target_ms.
+
+    The probe is repeated and the fastest run kept, so a busy moment during startup does not
+    leave the cost too low. The result is rounded to a multiple of 10,000 iterations.
+    """
+    salt = os.urandom(KDF_SALT_BYTES)
+    timings = []
+    for _ in range(3):
+        with _kdf_slots: # Timed inside the slot, so waiting behind queued logins does not count
+            start = time.perf_counter()
+            hashlib.pbkdf2_hmac("sha256", b"calibration", salt, probe_iterations)
+            timings.append((time.perf_counter() - start) * 1000)
+    per_iteration_ms = min(timings) / probe_iterations
+    iterations = max(KDF_MIN_ITERATIONS, int(target_ms / per_iteration_ms) // 10_000 * 10_000)
+    return {
+        "target_ms": target_ms,
+        "probe_iterations": probe_iterations,
+        "probe_ms": [round(ms, 2) for ms in timings],
+        "iterations": iterations,
+        "expected_ms": round(iterations * per_iteration_ms, 1),
+    }
+
+def iterations():
+    """The iteration count new hashes are made with, calibrated on first use."""
+    with _calibration_lock:
+        if not _calibration:
+            _calibration.update(calibrate())
+        return _calibration["iterations"]
+
+def hash_password(password, cost=None):
+    """Hashes a password with a fresh salt."""
+    cost = cost or iterations()
+    salt = os.urandom(KDF_SALT_BYTES)
+    return f"{KDF_SCHEME}${cost}${_b64(salt)}${_b64(_derive(password, salt, cost))}"
+
+def verify_password(password, stored_hash):
+    """Checks a password against a stored hash. Returns (matches, needs_rehash).
+
+    needs_rehash is True for legacy SHA-256 hashes and for hashes made with fewer iterations than
+    this host is calibrated to; the caller should store a fresh hash_password() once it matched.
+    """
+    if not isinstance(stored_hash, str):
+        return False, False
+    if _LEGACY_SHA256.match(stored_hash):
+        matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+        return matches, matches
+    try:
+        scheme, cost, salt, expected = stored_hash.split("$")
+        cost = int(cost)
+        salt, expected = _unb64(salt), _unb64(expected)
+    except ValueError:
+        return False, False
+    if scheme != KDF_SCHEME:
+        return False, False
+    matches = hmac.compare_digest(_derive(password, salt, cost), expected)
+    return matches, matches and cost < iterations()
+
+# --- Benchmark ---
+
+def benchmark(logins=32):
+    """Calibrates, then times a burst of logins verified serially and from concurrent sessions."""
+    report = calibrate()
+    stored = hash_password("Benchmark#1", report["iterations"])
+    start = time.perf_counter()
+    for _ in range(logins):
+        verify_password("Benchmark#1", stored)
+    report["serial_logins_per_s"] = round(logins / (time.perf_counter() - start), 1)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=logins) as sessions: # One script thread per logging-in session
+        list(sessions.map(lambda _: verify_password("Benchmark#1", stored), range(logins)))
+    report["concurrent_logins_per_s"] = round(logins / (time.perf_counter() - start), 1)
+    report["concurrency"] = KDF_CONCURRENCY
+    return report
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(f"PBKDF2-SHA256 calibration (target {result['target_ms']:.0f} ms per hash)")
+    print(f"  probe: {result['probe_iterations']:,} iterations in {', '.join(f'{ms} ms' for ms in result['probe_ms'])}")
+    print(f"  chosen cost: {result['iterations']:,} iterations (~{result['expected_ms']} ms per hash)")
+    print(f"  login verification: {result['serial_logins_per_s']}/s serial, "
+          f"{result['concurrent_logins_per_s']}/s from concurrent sessions, {result['concurrency']} hashing at once")
@@ -0,0 +1,162 @@
+# Micro-benchmarks for the MyKhata storage and aggregation paths.
+# Each size gets a fresh directory of synthetic data (mykhata_datagen); the operations the pages rely on
+# are then timed against the chosen backend. Results are written as JSON and checked against absolute
+# thresholds and, optionally, a previous run, so a slowdown fails the run instead of going unnoticed.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import mykhata_aggregates as aggregates
+import mykhata_datagen
+import mykhata_storage as storage
+
+SIZES = [10_000, 100_000, 1_000_000] # Total transaction rows
+BENCH_USERS = 10 # Main users the rows are spread over
+THRESHOLDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mykhata_bench_thresholds.json")
+
+# report() variants: report type -> transaction types it reads
+REPORT_VARIANTS = {
+    "income_vs_expense": ("Income", "Expense"),
+    "category_spending": ("Expense",),
+    "loan_emi_trends": ("Loan", "EMI"),
+}
+
+def _measure(fn, repeat, before=None):
+    """Runs fn repeat times (calling before() untimed ahead of each run) and returns the timings in ms."""
+    timings = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def bench_size(rows, backend, repeat):
+    """Generates `rows` transactions in a scratch directory and times each operation there."""
+    workdir = tempfile.mkdtemp(prefix="mykhata_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir) # Storage paths are relative to the working directory
+    storage.frame_cache = storage.FrameCache(storage.CACHE_MAX_BYTES) # Nothing cached from a previous size
+    try:
+        mains = mykhata_datagen.generate(".", users=BENCH_USERS, transactions=rows // BENCH_USERS)
+        owner = mains[0]
+        timings = {}
+        started = time.perf_counter()
+        store = storage.open_storage(backend)
+        timings["startup"] = [(time.perf_counter() - started) * 1000] # Migration or import of the generated files
+        writer = storage.WriteQueue(store)
+
+        timings["load_users"] = _measure(store.load_users, repeat)
+        timings["get_user"] = _measure(lambda: store.get_user(f"{owner}Sub1"), repeat)
+        timings["load_transactions_cold"] = _measure(
+            lambda: store.load_transactions(owner), repeat,
+            before=lambda: storage.frame_cache.invalidate((store.name, "transactions", owner)))
+        timings["load_transactions_warm"] = _measure(lambda: store.load_transactions(owner), repeat)
+
+        counter = iter(range(10**9))
+        record = lambda: {"Username": owner, "Date": "2024-12-31", "Type": "Expense", "Category": "Food",
+                          "Amount": 99.0, "Note": f"bench {next(counter)}"}
+        timings["save_transaction"] = _measure(lambda: writer.submit_transaction(record()).result(), repeat)
+        timings["save_category"] = _measure(
+            lambda: writer.submit_category(owner, "Expense", f"Bench {next(counter)}").result(), repeat)
+
+        timings["totals"] = _measure(lambda: aggregates.ledger_summary(store.ledger(owner)), repeat)
+        timings["totals_rebuild"] = _measure(
+            lambda: aggregates.ledger_from_frame(store.load_transactions(owner)), repeat)
+        def wallet_breakdown():
+            df = store.load_transactions(owner)
+            df[df['Type'] == 'Expense'].groupby('Category', observed=True)['Amount'].sum()
+        timings["wallet_breakdown"] = _measure(wallet_breakdown, repeat)
+
+        timings["report_rollup_build"] = _measure(
+            lambda: store.rollup_frame(owner, "M"), repeat, before=lambda: storage.frame_cache.invalidate((store.name, "rollup", owner)))
+        for variant, types in REPORT_VARIANTS.items():
+            for granularity in aggregates.ROLLUP_GRANULARITIES:
+                def report(types=types, granularity=granularity, variant=variant):
+                    df = store.rollup_frame(owner, granularity, types)
+                    if variant != "category_spending": # Line charts are drawn per Period and Type
+                        df.groupby(['Period', 'Type'], as_index=False)['Amount'].sum()
+                timings[f"report_{variant}_{granularity}"] = _measure(report, repeat)
+        writer.close()
+        return timings
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run(sizes=SIZES, backend="csv", repeat=5):
+    """Benchmarks every size and returns the results document."""
+    results = {}
+    for rows in sizes:
+        for name, timings in bench_size(rows, backend, repeat).items():
+            results[f"{name}@{rows}"] = {
+                "median_ms": round(statistics.median(timings), 3),
+                "min_ms": round(min(timings), 3),
+                "runs": len(timings),
+            }
+    return {
+        "meta": {
+            "backend": backend,
+            "repeat": repeat,
+            "bench_users": BENCH_USERS,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+def check(document, thresholds=None, baseline=None, tolerance=1.5):
+    """Returns a list of regressions: medians above their threshold, or above tolerance x the baseline median."""
+    failures = []
+    results = document["results"]
+    for key, limit_ms in (thresholds or {}).get(document["meta"]["backend"], {}).items():
+        if key in results and results[key]["median_ms"] > limit_ms:
+            failures.append(f"{key}: {results[key]['median_ms']:.1f} ms exceeds the {limit_ms} ms threshold")
+    if baseline is not None:
+        for key, result in results.items():
+            previous = baseline["results"].get(key)
+            if previous is not None and result["median_ms"] > previous["median_ms"] * tolerance:
+                failures.append(f"{key}: {result['median_ms']:.1f} ms vs {previous['median_ms']:.1f} ms in the baseline")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MyKhata storage and aggregation paths.")
+    parser.add_argument("--sizes", default=",".join(str(rows) for rows in SIZES), help="Comma-separated total row counts")
+    parser.add_argument("--backend", default=storage.STORAGE_BACKEND, choices=sorted(storage.BACKENDS))
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per operation")
+    parser.add_argument("-o", "--output", help="Write the JSON results here")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE, help="JSON of backend -> {name@rows: max median ms}")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slowdown factor against the baseline")
+    args = parser.parse_args()
+
+    document = run([int(rows) for rows in args.sizes.split(",")], args.backend, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+    for key, result in document["results"].items():
+        print(f"{key:<40} {result['median_ms']:>10.2f} ms (min {result['min_ms']:.2f})")
+
+    thresholds = None
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds, encoding="utf-8") as f:
+            thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = check(document, thresholds, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
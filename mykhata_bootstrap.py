@@ -0,0 +1,109 @@
+# One-time bootstrap for the MyKhata Streamlit script.
+# Streamlit re-executes the script on every interaction, but a module is imported once per server
+# process, so what runs at import time here runs on the first (cold) run only. It also times every
+# run and counts the bytes it sends to the browser, so a cold start, rerun or payload that grows shows up in the log.
+import argparse
+import importlib.util
+import logging
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+
+import mykhata_metrics as metrics
+
+PROCESS_STARTED = time.perf_counter() # The script imports this module first, so cold runs are timed from here
+
+REQUIRED_PACKAGES = ['streamlit', 'pandas', 'altair']
+
+logger = logging.getLogger(__name__)
+
+_timings = {"cold_ms": None, "warm_ms": deque(maxlen=500), "sent_bytes": deque(maxlen=500)}
+
+def install_packages():
+    """Installs any required package that is missing, e.g. on Google Colab. Packages that are present are
+    only located, not imported."""
+    for package in REQUIRED_PACKAGES:
+        if importlib.util.find_spec(package) is None:
+            print(f"Installing {package}...")
+            # Use --break-system-packages for environments like Colab if needed
+            subprocess.check_call([sys.executable, "-m", "pip", "install", package, "--break-system-packages"])
+            print(f"{package} installed successfully.")
+
+install_packages()
+
+def start_run():
+    """Returns the start time of this script run: the process start for the cold run."""
+    return PROCESS_STARTED if _timings["cold_ms"] is None else time.perf_counter()
+
+def count_sent_bytes():
+    """Counts the serialized size of every message this script run sends to the browser (elements, HTML,
+    chart specs, dataframes) as the bytes_sent counter of the thread's metrics run.
+
+    Streamlit has no public hook for this, so the run context's internal enqueue is wrapped, once per
+    context. Without a context (plain `python` runs) nothing is counted.
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    enqueue = getattr(ctx, "_enqueue", None)
+    if enqueue is None or getattr(enqueue, "counts_sent_bytes", False):
+        return
+    def counting_enqueue(msg):
+        metrics.count("bytes_sent", msg.ByteSize())
+        enqueue(msg)
+    counting_enqueue.counts_sent_bytes = True
+    ctx._enqueue = counting_enqueue
+
+def finish_run(started, sent_bytes=0):
+    """Records how long a script run took and how many bytes it sent to the browser."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _timings["sent_bytes"].append(sent_bytes)
+    if _timings["cold_ms"] is None:
+        _timings["cold_ms"] = elapsed_ms
+        logger.info("Cold start: %.1f ms, %d bytes sent", elapsed_ms, sent_bytes)
+    else:
+        _timings["warm_ms"].append(elapsed_ms)
+        logger.debug("Rerun: %.1f ms, %d bytes sent", elapsed_ms, sent_bytes)
+
+def timing_report():
+    """Cold-start time, warm-rerun statistics in ms and bytes sent per run, over the last 500 runs of this process."""
+    warm = sorted(_timings["warm_ms"])
+    sent_bytes = sorted(_timings["sent_bytes"])
+    return {
+        "cold_ms": _timings["cold_ms"],
+        "warm_runs": len(warm),
+        "warm_median_ms": statistics.median(warm) if warm else None,
+        "warm_p95_ms": warm[int(0.95 * (len(warm) - 1))] if warm else None,
+        "sent_bytes_median": statistics.median(sent_bytes) if sent_bytes else None,
+        "sent_bytes_max": sent_bytes[-1] if sent_bytes else None,
+    }
+
+if __name__ == "__main__":
+    # Measures a cold start and warm reruns of the app in a fresh process, without a browser
+    from streamlit.testing.v1 import AppTest
+
+    parser = argparse.ArgumentParser(description="Time a cold start and warm reruns of the MyKhata app.")
+    parser.add_argument("--script", default="mykhata_modern_expense_tracker_app.py")
+    parser.add_argument("--user", help="Run logged in as this (existing) user instead of on the login page")
+    parser.add_argument("--page", default="Home", help="Page to rerun when logged in")
+    parser.add_argument("--reruns", type=int, default=20)
+    args = parser.parse_args()
+
+    app = AppTest.from_file(args.script, default_timeout=120)
+    if args.user:
+        app.session_state["logged_in"] = True
+        app.session_state["username"] = args.user
+        app.query_params["nav"] = args.page
+    runs = []
+    for _ in range(args.reruns + 1):
+        started = time.perf_counter()
+        app.run()
+        runs.append((time.perf_counter() - started) * 1000)
+    # Run as a script this is __main__; the app recorded its runs in the imported mykhata_bootstrap
+    report = sys.modules["mykhata_bootstrap"].timing_report()
+    warm = sorted(runs[1:])
+    print(f"cold start: {runs[0]:.1f} ms (script run incl. first imports and storage startup)")
+    print(f"warm rerun: median {statistics.median(warm):.1f} ms, p95 {warm[int(0.95 * (len(warm) - 1))]:.1f} ms over {len(warm)} reruns")
+    if report["sent_bytes_median"] is not None:
+        print(f"sent per run: median {report['sent_bytes_median']:,.0f} bytes, max {report['sent_bytes_max']:,} bytes")
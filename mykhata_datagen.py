@@ -0,0 +1,86 @@
+# Synthetic MyKhata data for benchmarks and load tests.
+# Writes USERS_FILE, CATEGORY_FILE and the legacy DATA_FILE, the same files a real install starts from,
+# so the storage backends migrate and import them exactly as they would real data. The output depends
+# only on the arguments and the seed.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import mykhata_storage as storage
+
+# Share of transactions per type, and (median, spread) of their lognormal amounts in ₹
+TYPE_MIX = {"Expense": 0.72, "Income": 0.14, "EMI": 0.09, "Loan": 0.05}
+AMOUNT_MODEL = {"Expense": (450, 1.0), "Income": (25000, 0.6), "EMI": (8000, 0.5), "Loan": (150000, 0.8)}
+
+NOTES = ["", "", "", "UPI", "Card", "Cash", "Monthly", "Split with family", "Online order"]
+CUSTOM_CATEGORIES = {"Expense": ["Pets", "Groceries", "Fuel", "Mobile Recharge"], "Income": ["Rent Received", "Bonus"]}
+
+BENCH_PASSWORD = "Bench#1" # Every generated user has this password
+
+def generate(directory=".", users=10, sub_users=2, transactions=1000, seed=0, end="2024-12-31", days=3 * 365):
+    """Writes users, categories and transactions for `users` main users into directory.
+
+    Each main user gets `sub_users` linked sub-users, a few custom categories and `transactions`
+    transactions spread over the `days` days up to `end`. Sub-users share their parent's transactions.
+    Returns the list of main usernames.
+    """
+    import mykhata_auth # Only needed here; one hash is shared by every generated user
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    mains = [f"User{i:05d}" for i in range(users)]
+    password_hash = mykhata_auth.hash_password(BENCH_PASSWORD)
+
+    user_rows = []
+    for main in mains:
+        user_rows.append([main, password_hash, f"Bench {main}", f"9{rng.integers(10**8, 10**9)}", f"{main.lower()}@example.com", "Main", None])
+        for j in range(sub_users):
+            user_rows.append([f"{main}Sub{j}", password_hash, f"Bench {main} {j}", "", "", "Sub", main])
+    pd.DataFrame(user_rows, columns=storage.USER_COLUMNS).to_csv(os.path.join(directory, storage.USERS_FILE), index=False)
+
+    category_rows = []
+    for main in mains:
+        for category_type, names in CUSTOM_CATEGORIES.items():
+            for name in rng.choice(names, size=rng.integers(1, len(names) + 1), replace=False):
+                category_rows.append([main, category_type, name])
+    pd.DataFrame(category_rows, columns=storage.CATEGORY_COLUMNS).to_csv(os.path.join(directory, storage.CATEGORY_FILE), index=False)
+
+    types = np.array(list(TYPE_MIX))
+    first_day = pd.Timestamp(end) - pd.Timedelta(days=days - 1)
+    data_file = os.path.join(directory, storage.DATA_FILE)
+    pd.DataFrame(columns=storage.TRANSACTION_COLUMNS).to_csv(data_file, index=False)
+    for main in mains: # One user at a time keeps memory flat for large runs
+        trans_types = rng.choice(types, size=transactions, p=list(TYPE_MIX.values()))
+        categories = np.empty(transactions, dtype=object)
+        amounts = np.empty(transactions)
+        for trans_type in types:
+            mask = trans_types == trans_type
+            names = sorted(storage.DEFAULT_CATEGORIES[trans_type]) + CUSTOM_CATEGORIES.get(trans_type, [])
+            categories[mask] = rng.choice(names, size=mask.sum())
+            median, spread = AMOUNT_MODEL[trans_type]
+            amounts[mask] = np.round(rng.lognormal(np.log(median), spread, size=mask.sum()), 2)
+        dates = first_day + pd.to_timedelta(np.sort(rng.integers(0, days, size=transactions)), unit="D")
+        pd.DataFrame({
+            "Username": main,
+            "Date": dates.strftime('%Y-%m-%d'),
+            "Type": trans_types,
+            "Category": categories,
+            "Amount": amounts,
+            "Note": rng.choice(NOTES, size=transactions),
+        }).to_csv(data_file, mode="a", header=False, index=False)
+    return mains
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic MyKhata users, categories and transactions.")
+    parser.add_argument("--dir", default=".", help="Directory to write the CSV files into")
+    parser.add_argument("--users", type=int, default=10, help="Main users")
+    parser.add_argument("--sub-users", type=int, default=2, help="Sub-users per main user")
+    parser.add_argument("--transactions", type=int, default=1000, help="Transactions per main user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--end", default="2024-12-31", help="Date of the last possible transaction")
+    parser.add_argument("--days", type=int, default=3 * 365, help="Days of history")
+    args = parser.parse_args()
+    mains = generate(args.dir, args.users, args.sub_users, args.transactions, args.seed, args.end, args.days)
+    print(f"Wrote {len(mains):,} main users with {args.transactions:,} transactions each to {os.path.abspath(args.dir)}")
@@ -0,0 +1,268 @@
+# Bulk import and export of MyKhata transactions, usable from the app or the command line.
+# Both directions stream in chunks. Imports commit each chunk as one batched write, so a year of entries
+# costs a handful of writes instead of one per row. Exports yield encoded chunks, so memory stays flat
+# whatever the size of the history.
+import argparse
+import io
+import sys
+import tempfile
+
+import pandas as pd
+
+try: # Optional: only Parquet exports need pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from mykhata_aggregates import LEDGER_TYPES
+
+STATEMENT_CHUNK_ROWS = 50_000
+
+# Fields a statement column can be mapped to. Date and Amount are required.
+IMPORT_FIELDS = ["Date", "Type", "Category", "Amount", "Note"]
+
+# Common statement spellings of the transaction types, matched case-insensitively
+TYPE_ALIASES = {
+    "income": "Income", "credit": "Income", "cr": "Income",
+    "expense": "Expense", "debit": "Expense", "dr": "Expense",
+    "loan": "Loan", "emi": "EMI",
+}
+
+# Used when a statement row has no category
+FALLBACK_CATEGORIES = {"Income": "Other Income", "Expense": "Other Expense", "Loan": "Other Loan", "EMI": "Other EMI"}
+
+# The number in an amount cell such as "Rs.1,250", "INR 500.00" or "₹ 1,234.50 Dr"
+AMOUNT_PATTERN = r"(\d[\d,]*(?:\.\d+)?)"
+# A minus before the number ("-500", "Rs.-500") or a trailing Dr marks a debit
+DEBIT_PATTERN = r"^[^\d]*-|\bdr\.?\s*$"
+
+def parse_amounts(raw):
+    """Signed amounts from statement text; currency tokens (Rs., INR, ₹) and thousands separators are ignored."""
+    if not (raw.dtype == object or pd.api.types.is_string_dtype(raw)):
+        return pd.to_numeric(raw, errors='coerce')
+    text = raw.astype("object").where(raw.notna(), "").astype(str).str.strip()
+    amounts = pd.to_numeric(text.str.extract(AMOUNT_PATTERN, expand=False).str.replace(",", "", regex=False), errors='coerce')
+    return amounts.mask(text.str.contains(DEBIT_PATTERN, case=False, regex=True), -amounts)
+
+def parse_dates(raw, dayfirst=True):
+    """Statement dates, allowing formats to mix within a file.
+
+    ISO dates are taken first, since dayfirst would read 2024-03-05 as 3 May. The rest are parsed in
+    one pass with the format inferred from them, and any cells that misses one by one.
+    """
+    dates = pd.to_datetime(raw, format="ISO8601", errors='coerce')
+    for options in ({}, {"format": "mixed"}):
+        missed = dates.isna() & raw.notna()
+        if not missed.any():
+            break
+        dates[missed] = pd.to_datetime(raw[missed], dayfirst=dayfirst, errors='coerce', **options)
+    return dates
+
+def normalize_statement_chunk(chunk, column_map, dayfirst=True):
+    """Maps one chunk of statement rows onto transaction columns and validates it column-wise.
+
+    column_map maps each of IMPORT_FIELDS to a statement column (or None). Without a Type column,
+    the sign of Amount decides: negative rows are expenses, positive rows income.
+    Returns (valid rows with Date as 'YYYY-MM-DD' strings, number of rejected rows).
+    """
+    def column(field):
+        source = column_map.get(field)
+        return chunk[source] if source else pd.Series(pd.NA, index=chunk.index, dtype="object")
+
+    dates = parse_dates(column("Date"), dayfirst=dayfirst)
+    amounts = parse_amounts(column("Amount"))
+
+    if column_map.get("Type"):
+        types = column("Type").astype(str).str.strip().str.lower().map(TYPE_ALIASES)
+    else:
+        types = pd.Series(pd.NA, index=chunk.index, dtype="object").mask(amounts < 0, "Expense").mask(amounts > 0, "Income")
+    amounts = amounts.abs()
+
+    categories = column("Category").astype("object").where(column("Category").notna() & (column("Category").astype(str).str.strip() != ""))
+    categories = categories.fillna(types.map(FALLBACK_CATEGORIES))
+    notes = column("Note").astype("object").where(column("Note").notna(), "")
+
+    valid = dates.notna() & amounts.gt(0) & types.isin(LEDGER_TYPES)
+    rows = pd.DataFrame({
+        "Date": dates[valid].dt.strftime('%Y-%m-%d'),
+        "Type": types[valid],
+        "Category": categories[valid].astype(str).str.strip(),
+        "Amount": amounts[valid].round(2),
+        "Note": notes[valid].astype(str).str.slice(0, 200),
+    })
+    return rows, int((~valid).sum())
+
+def import_statement(writer, effective_username, source, column_map, chunksize=STATEMENT_CHUNK_ROWS,
+                     dayfirst=True, on_chunk=None):
+    """Streams a statement CSV (path or file-like) into effective_username's transactions.
+
+    Each chunk is queued on writer (a storage.WriteQueue) as one batched write, and the next chunk is
+    parsed while it commits; a failed write stops the import and is raised here. on_chunk(imported,
+    rejected) is called after every committed chunk with the running totals, e.g. to drive a progress display.
+    Returns {"imported": ..., "rejected": ..., "chunks": ...}.
+    """
+    missing = [field for field in ("Date", "Amount") if not column_map.get(field)]
+    if missing:
+        raise ValueError(f"Map a statement column to: {', '.join(missing)}")
+    usecols = sorted({col for col in column_map.values() if col})
+    result = {"imported": 0, "rejected": 0, "chunks": 0}
+    in_flight = None # (future, rows, rejected) of the chunk being committed
+
+    def settle():
+        future, rows, rejected = in_flight
+        future.result()
+        result["imported"] += rows
+        result["rejected"] += rejected
+        result["chunks"] += 1
+        if on_chunk is not None:
+            on_chunk(result["imported"], result["rejected"])
+
+    for chunk in pd.read_csv(source, usecols=usecols, chunksize=chunksize, dtype=str, skipinitialspace=True):
+        rows, rejected = normalize_statement_chunk(chunk, column_map, dayfirst=dayfirst)
+        future = writer.submit_transactions(effective_username, rows.assign(Username=effective_username))
+        if in_flight is not None:
+            settle()
+        in_flight = (future, len(rows), rejected)
+    if in_flight is not None:
+        settle()
+    return result
+
+# --- Export ---
+
+EXPORT_CHUNK_ROWS = 50_000
+
+# Same columns as IMPORT_FIELDS, so an export can be imported again as-is
+EXPORT_COLUMNS = ["Date", "Type", "Category", "Amount", "Note"]
+
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "jsonl": ("jsonl", "application/x-ndjson"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only stream that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position # Parquet records file offsets in its footer, so this must keep counting
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _plain(chunk):
+    """Turns a typed chunk back into plain values for text encodings."""
+    return chunk.assign(Date=chunk['Date'].dt.strftime('%Y-%m-%d'),
+                        Type=chunk['Type'].astype(str), Category=chunk['Category'].astype(str))
+
+def export_transactions(storage, effective_username, fmt="csv", start=None, end=None, types=None,
+                        chunk_rows=EXPORT_CHUNK_ROWS):
+    """Returns a generator of encoded byte chunks holding the user's transactions in fmt.
+
+    start/end bound the Date (inclusive) and types limits the transaction types. Rows are read with
+    storage.iter_transactions, so at most chunk_rows rows are held at a time.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Choose one of: {', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("Parquet export needs pyarrow. Install it with: pip install pyarrow")
+    chunks = storage.iter_transactions(effective_username, EXPORT_COLUMNS, start, end, types, chunk_rows)
+    encoders = {"csv": _encode_csv, "jsonl": _encode_jsonl, "parquet": _encode_parquet}
+    return encoders[fmt](chunks)
+
+def _encode_csv(chunks):
+    yield (",".join(EXPORT_COLUMNS) + "\n").encode()
+    for chunk in chunks:
+        yield _plain(chunk).to_csv(index=False, header=False, lineterminator="\n").encode()
+
+def _encode_jsonl(chunks):
+    for chunk in chunks:
+        text = _plain(chunk).to_json(orient="records", lines=True, force_ascii=False)
+        yield (text if text.endswith("\n") else text + "\n").encode()
+
+def _encode_parquet(chunks):
+    schema = pa.schema([("Date", pa.date32()), ("Type", pa.string()), ("Category", pa.string()),
+                        ("Amount", pa.float64()), ("Note", pa.string())])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for chunk in chunks:
+            chunk = chunk.assign(Type=chunk['Type'].astype(str), Category=chunk['Category'].astype(str),
+                                 Note=chunk['Note'].astype(object).where(chunk['Note'].notna(), None))
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain() # The footer
+
+def export_to_tempfile(chunks):
+    """Spools export chunks to an anonymous temporary file, rewound for reading."""
+    spool = tempfile.TemporaryFile()
+    for data in chunks:
+        spool.write(data)
+    spool.seek(0)
+    return spool
+
+# --- Command Line ---
+
+def main(argv=None):
+    import mykhata_storage as storage_module
+
+    parser = argparse.ArgumentParser(description="Import or export MyKhata transactions.")
+    parser.add_argument("--storage", default=None, help="Storage backend (defaults to MYKHATA_STORAGE or csv)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Stream a user's transactions to a file or stdout")
+    export_parser.add_argument("username", help="Effective username (a main user; sub-users share their parent's data)")
+    export_parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    export_parser.add_argument("--start", help="First date to include, YYYY-MM-DD")
+    export_parser.add_argument("--end", help="Last date to include, YYYY-MM-DD")
+    export_parser.add_argument("--types", help="Comma-separated transaction types, e.g. Expense,EMI")
+    export_parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+
+    import_parser = commands.add_parser("import", help="Import a bank/UPI statement CSV")
+    import_parser.add_argument("username", help="Effective username to import into")
+    import_parser.add_argument("statement", help="Statement CSV file")
+    for field in IMPORT_FIELDS:
+        import_parser.add_argument(f"--{field.lower()}-column", dest=field, help=f"Statement column holding {field}")
+    import_parser.add_argument("--monthfirst", action="store_true", help="Dates are MM/DD rather than DD/MM")
+
+    args = parser.parse_args(argv)
+    storage = storage_module.open_storage(args.storage)
+    if args.command == "export":
+        types = args.types.split(",") if args.types else None
+        chunks = export_transactions(storage, args.username, args.format, args.start, args.end, types)
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for data in chunks:
+                out.write(data)
+        finally:
+            if args.output:
+                out.close()
+    else:
+        column_map = {field: getattr(args, field) or (field if field in ("Date", "Amount") else None) for field in IMPORT_FIELDS}
+        writer = storage_module.WriteQueue(storage)
+        try:
+            result = import_statement(writer, args.username, args.statement, column_map, dayfirst=not args.monthfirst,
+                                      on_chunk=lambda imported, rejected: print(f"Imported {imported:,} rows...", file=sys.stderr))
+        finally:
+            writer.close()
+        print(f"Imported {result['imported']:,} transactions ({result['rejected']:,} rows skipped).")
+
+if __name__ == "__main__":
+    main()
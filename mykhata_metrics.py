@@ -0,0 +1,198 @@
+# Lightweight per-run instrumentation for MyKhata.
+# A run is one execution of the Streamlit script, one batch committed by the write queue, or one
+# recomputation by the aggregate worker. Spans time the hot paths inside it (pages, load/save helpers,
+# chart building) and counters tally the I/O it did.
+# Finished runs are kept in memory for the debug panel and, if MYKHATA_METRICS_LOG names a file, appended
+# to a JSON-lines log that can be aggregated offline. With MYKHATA_METRICS=0, spans and counters do nothing.
+import functools
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_ENABLED = os.environ.get("MYKHATA_METRICS", "1") != "0"
+METRICS_LOG = os.environ.get("MYKHATA_METRICS_LOG", "") # E.g. mykhata_metrics.jsonl; unset keeps runs in memory only
+RECENT_RUNS = 200 # Finished runs kept for the debug panel
+
+# bytes_read/bytes_written: file bytes (sqlite rows are counted, not their pages)
+# rows_read/rows_written: rows moved to or from storage; rows_scanned: rows an in-memory computation went through
+# bytes_sent: serialized messages a script run sent to the browser (see mykhata_bootstrap.count_sent_bytes)
+COUNTERS = ("bytes_read", "bytes_written", "rows_read", "rows_written", "rows_scanned", "bytes_sent")
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local() # The run in progress on this thread, if any
+_recent = deque(maxlen=RECENT_RUNS)
+_recent_lock = threading.Lock()
+_totals = Counter() # Counters over the life of the process, including work done outside any run
+_log_lock = threading.Lock()
+
+class _Run:
+    __slots__ = ("kind", "started", "fields", "spans", "counters", "path")
+
+    def __init__(self, kind, fields):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.fields = fields
+        self.spans = {} # "outer/inner" path -> [calls, total ms]
+        self.counters = Counter()
+        self.path = []
+
+def begin_run(kind, **fields):
+    """Starts collecting spans and counters for a run on this thread.
+
+    A run that was never ended on this thread (the script stopped early) is logged first, marked aborted.
+    """
+    if not METRICS_ENABLED:
+        return
+    if getattr(_local, "run", None) is not None:
+        end_run(aborted=True)
+    _local.run = _Run(kind, fields)
+
+def annotate(**fields):
+    """Adds fields (page, user, ...) to the run in progress on this thread."""
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.fields.update(fields)
+
+def end_run(**fields):
+    """Finishes this thread's run, stores and logs it, and returns its record (None if no run was started)."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    _local.run = None
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "kind": run.kind,
+        "ms": round((time.perf_counter() - run.started) * 1000, 3),
+        **run.fields,
+        **fields,
+        "spans": {path: {"calls": calls, "ms": round(ms, 3)} for path, (calls, ms) in run.spans.items()},
+        "counters": dict(run.counters),
+    }
+    with _recent_lock:
+        _recent.append(record)
+    if METRICS_LOG:
+        line = json.dumps(record, default=str) + "\n"
+        try:
+            with _log_lock, open(METRICS_LOG, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning("Could not append to %s: %s", METRICS_LOG, e)
+    return record
+
+@contextmanager
+def span(name):
+    """Times the enclosed block as `name`, nested under any span already open on this thread."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        yield
+        return
+    run.path.append(name)
+    path = "/".join(run.path)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = run.spans.setdefault(path, [0, 0.0])
+        entry[0] += 1
+        entry[1] += (time.perf_counter() - started) * 1000
+        run.path.pop()
+
+def timed(name=None):
+    """Decorator: runs the function inside span(name), the function's name by default."""
+    def decorate(fn):
+        span_name = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(counter, n=1):
+    """Adds n to a counter of this thread's run and to the process totals."""
+    if not METRICS_ENABLED or not n:
+        return
+    n = int(n)
+    _totals[counter] += n
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.counters[counter] += n
+
+def file_size(*paths):
+    """Total size in bytes of the paths that exist; what reading them in full costs."""
+    return sum(os.path.getsize(path) for path in paths if path and os.path.exists(path))
+
+def recent_runs(kind=None):
+    """The most recent finished runs, oldest first, optionally only those of one kind."""
+    with _recent_lock:
+        runs = list(_recent)
+    return [run for run in runs if kind is None or run["kind"] == kind]
+
+def _summarize(runs):
+    per_path = {}
+    for run in runs:
+        for path, entry in run["spans"].items():
+            stats = per_path.setdefault(path, {"runs": 0, "calls": 0, "ms": []})
+            stats["runs"] += 1
+            stats["calls"] += entry["calls"]
+            stats["ms"].append(entry["ms"])
+    summary = []
+    for path, stats in sorted(per_path.items()):
+        ms = sorted(stats["ms"])
+        summary.append({
+            "span": path,
+            "runs": stats["runs"],
+            "calls": stats["calls"],
+            "median_ms": round(statistics.median(ms), 3),
+            "p95_ms": ms[math.ceil(0.95 * len(ms)) - 1], # Nearest rank
+            "max_ms": ms[-1],
+        })
+    return summary
+
+def span_summary(kind=None):
+    """Per span path over the recent runs: runs it appeared in, calls, and median / p95 / max ms per run."""
+    return _summarize(recent_runs(kind))
+
+def totals():
+    """Counters accumulated by this process, whether or not a run was in progress."""
+    return {counter: _totals.get(counter, 0) for counter in COUNTERS}
+
+def read_log(path, kind=None):
+    """Yields the runs recorded in a metrics log, optionally only those of one kind."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                run = json.loads(line)
+                if kind is None or run["kind"] == kind:
+                    yield run
+
+if __name__ == "__main__":
+    # Aggregates a metrics log offline: span timings per path, and counters and run time per page
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise a MyKhata metrics log.")
+    parser.add_argument("log", nargs="?", default=METRICS_LOG or "mykhata_metrics.jsonl")
+    parser.add_argument("--kind", default="script", help="Run kind to summarise (script, write, aggregate); empty for all")
+    args = parser.parse_args()
+
+    runs = list(read_log(args.log, args.kind or None))
+    print(f"{len(runs):,} runs in {args.log}")
+    print(f"{'span':<60} {'runs':>6} {'calls':>7} {'median':>9} {'p95':>9} {'max':>9}")
+    for row in _summarize(runs):
+        print(f"{row['span']:<60} {row['runs']:>6} {row['calls']:>7} {row['median_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['max_ms']:>9.2f}")
+    pages = {}
+    for run in runs:
+        pages.setdefault(run.get("page") or "-", []).append(run)
+    print(f"\n{'page':<12} {'runs':>6} {'median ms':>10} " + " ".join(f"{counter:>14}" for counter in COUNTERS))
+    for page, page_runs in sorted(pages.items()):
+        medians = [statistics.median(run["counters"].get(counter, 0) for run in page_runs) for counter in COUNTERS]
+        print(f"{page:<12} {len(page_runs):>6} {statistics.median(run['ms'] for run in page_runs):>10.1f} "
+              + " ".join(f"{value:>14,.0f}" for value in medians))
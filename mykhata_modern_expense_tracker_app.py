@@ -1,468 +1,218 @@
-# Install necessary libraries if running in an environment like Google Colab
-# If you are running this locally and have these installed, you can comment these lines out.
-import subprocess
-import sys
-
-def install_packages():
-    required_packages = ['streamlit', 'pandas', 'altair']
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            print(f"Installing {package}...")
-            # Use --break-system-packages for environments like Colab if needed
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package, "--break-system-packages"])
-            print(f"{package} installed successfully.")
-
-# Call the installation function at the very beginning
-install_packages()
+# Install necessary libraries if running in an environment like Google Colab, once per server process
+# (see mykhata_bootstrap); the import is cached, so reruns skip it.
+import mykhata_bootstrap
+run_started = mykhata_bootstrap.start_run()
+import mykhata_metrics as metrics # Per-run spans and I/O counters
+metrics.begin_run("script")
+mykhata_bootstrap.count_sent_bytes()
 
 import streamlit as st
 import pandas as pd
 import os
 import re
+import html
+import hashlib
 from datetime import datetime
-import hashlib # For password hashing
-import altair as alt # For charts
+import mykhata_storage as storage # Storage backends, shared by every session in the process
+import mykhata_aggregates as aggregates
+import mykhata_io # Statement import
+import mykhata_auth # Password hashing
+# Charts (mykhata_reports, and altair with it) are imported by the Wallet and Reports pages when first shown
 
 # --- App Config ---
 st.set_page_config(page_title="MyKhata Modern", layout="wide")
 
 # --- Custom CSS for Mobile Optimization and Styling ---
-st.markdown("""
-    <style>
-    /* Hide Streamlit branding and footer */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-
-    /* General body styling for mobile */
-    body {
-        font-family: 'Inter', sans-serif;
-        background-color: #f0f2f6;
-        margin: 0;
-        padding: 0;
-    }
-
-    /* Streamlit specific elements adjustments */
-    .stApp {
-        padding-bottom: 80px; /* Space for bottom nav */
-    }
-    .block-container {
-        padding-top: 1rem;
-        padding-bottom: 1rem;
-        padding-left: 1rem;
-        padding-right: 1rem;
-    }
-
-    /* Custom Card Styling */
-    .stCard {
-        background-color: #e3f2fd; /* Light blue */
-        border-radius: 15px;
-        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-        padding: 20px;
-        margin-bottom: 15px;
-        border: none;
-    }
-    .stCard > div {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        text-align: center;
-    }
-    .stCard h3 {
-        color: #1976D2; /* Darker blue for headings */
-        margin-bottom: 5px;
-    }
-    .stCard p {
-        font-size: 1.5em;
-        font-weight: bold;
-        color: #424242;
-    }
-
-    /* Dashboard Main Balance Card - New Styling for Gradient and Layout */
-    .main-balance-card {
-        background: linear-gradient(135deg, #6a82fb, #fc5c7d); /* Gradient as in image */
-        border-radius: 20px;
-        box-shadow: 0 8px 20px rgba(0, 0, 0, 0.2);
-        padding: 25px;
-        margin-bottom: 25px;
-        color: white;
-        text-align: center;
-    }
-    .main-balance-card h4 {
-        color: rgba(255, 255, 255, 0.8);
-        margin-bottom: 5px;
-        font-weight: normal;
-    }
-    .main-balance-card .balance-amount {
-        font-size: 2.8em;
-        font-weight: bold;
-        margin-bottom: 20px;
-    }
-    .main-balance-card .income-expense-row {
-        display: flex;
-        justify-content: space-around;
-        width: 100%;
-        margin-top: 15px;
-    }
-    .main-balance-card .income-expense-item {
-        display: flex;
-        align-items: center;
-        font-size: 1.1em;
-        font-weight: 600;
-    }
-    .main-balance-card .income-expense-item .icon {
-        font-size: 1.5em;
-        margin-right: 8px;
-        border-radius: 50%;
-        width: 35px;
-        height: 35px;
-        display: flex;
-        justify-content: center;
-        align-items: center;
-    }
-    .main-balance-card .income-expense-item .income-icon {
-        background-color: rgba(76, 175, 80, 0.3); /* Green with transparency */
-        color: #4CAF50;
-    }
-    .main-balance-card .income-expense-item .expense-icon {
-        background-color: rgba(244, 67, 54, 0.3); /* Red with transparency */
-        color: #F44336;
-    }
-    .main-balance-card .income-expense-item .amount {
-        color: white;
-    }
-
-
-    /* Transaction List Item Styling */
-    .transaction-item {
-        background-color: white;
-        border-radius: 15px;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.08);
-        padding: 15px 20px;
-        margin-bottom: 12px;
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-    }
-    .transaction-item .icon-circle {
-        width: 50px;
-        height: 50px;
-        border-radius: 50%;
-        background-color: #e3f2fd; /* Light blue background for icon */
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        font-size: 24px;
-        margin-right: 15px;
-    }
-    .transaction-item .details {
-        flex-grow: 1;
-    }
-    .transaction-item .category-name {
-        font-weight: bold;
-        font-size: 1.1em;
-        color: #333;
-    }
-    .transaction-item .note-date {
-        font-size: 0.85em;
-        color: #777;
-    }
-    .transaction-item .amount-display {
-        font-weight: bold;
-        font-size: 1.2em;
-        margin-left: 10px;
-        text-align: right;
-    }
-    .transaction-item .amount-income {
-        color: #4CAF50; /* Green */
-    }
-    .transaction-item .amount-expense {
-        color: #F44336; /* Red */
-    }
-    .transaction-item .amount-loan {
-        color: #FFC107; /* Amber */
-    }
-    .transaction-item .amount-emi {
-        color: #2196F3; /* Blue */
-    }
-
-    /* Top bar for dashboard (non-functional, visual only) */
-    .top-bar-placeholder {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        padding: 10px 0;
-        font-size: 0.9em;
-        color: #555;
-    }
-    .top-bar-placeholder .time {
-        font-weight: bold;
-    }
-    .top-bar-placeholder .status-icons span {
-        margin-left: 8px;
-    }
-
-    /* Header for sections like "Transaction" with filter icon */
-    .section-header {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        margin-top: 25px;
-        margin-bottom: 15px;
-    }
-    .section-header h3 {
-        margin: 0;
-        color: #333;
-    }
-    /* Removed filter-icon styling as it's removed from HTML */
-
-
-    /* Bottom Navigation Bar Styling */
-    .bottom-bar {
-        position: fixed;
-        bottom: 0;
-        left: 0;
-        width: 100%;
-        display: flex;
-        justify-content: space-around;
-        align-items: center;
-        background: #e3f2fd; /* Light blue */
-        padding: 8px 0;
-        box-shadow: 0 -4px 12px rgba(0, 0, 0, 0.15);
-        z-index: 1000;
-        border-top-left-radius: 20px;
-        border-top-right-radius: 20px;
-    }
-    .nav-button-container {
-        display: flex;
-        justify-content: space-around;
-        width: 100%;
-    }
-    .nav-button-wrapper {
-        flex: 1;
-        display: flex;
-        justify-content: center;
-        align-items: center;
-    }
-    .nav-button-wrapper button {
-        background: none !important;
-        border: none !important;
-        padding: 0 !important;
-        margin: 0 !important;
-        box-shadow: none !important;
-        color: #555 !important;
-        font-size: 0.8em !important;
-        font-weight: 600 !important;
-        transition: color 0.3s ease !important;
-        height: auto !important;
-        width: auto !important;
-        display: flex !important;
-        flex-direction: column !important;
-        align-items: center !important;
-        cursor: pointer !important;
-    }
-    .nav-button-wrapper button:hover {
-        color: #2196F3 !important;
-    }
-    .nav-button-wrapper button > div { /* Target the inner div containing icon and text */
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-    }
-    .nav-button-wrapper button .icon {
-        font-size: 24px !important;
-        margin-bottom: 3px !important;
-    }
-    .nav-button-wrapper button.active-nav-item {
-        color: #2196F3 !important; /* Active state color */
-    }
+# Served from static/ when server.enableStaticServing is on (see .streamlit/config.toml)
+STYLESHEET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "mykhata.css")
+STYLESHEET_URL = "app/static/mykhata.css" # Relative, so it also resolves under a server.baseUrlPath
 
-    .plus-btn-wrapper {
-        flex: 0 0 auto; /* Don't grow or shrink */
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        margin-top: -30px; /* Pull up to float */
-        z-index: 1001; /* Ensure it's above other nav items */
-    }
-    .plus-btn-wrapper button {
-        font-size: 32px !important; /* Larger plus icon */
-        color: white !important;
-        background: #2196F3 !important; /* Bright blue for add button */
-        border-radius: 50% !important;
-        width: 60px !important; /* Larger circle */
-        height: 60px !important;
-        line-height: 60px !important;
-        text-align: center !important;
-        box-shadow: 0 4px 10px rgba(0, 0, 0, 0.2) !important;
-        transition: background 0.3s ease !important;
-        display: flex !important;
-        justify-content: center !important;
-        align-items: center !important;
-    }
-    .plus-btn-wrapper button:hover {
-        background: #1976D2 !important;
-    }
+# Users who see the performance panel (MYKHATA_ADMINS, comma-separated usernames)
+ADMIN_USERS = {name.strip() for name in os.environ.get("MYKHATA_ADMINS", "").split(",") if name.strip()}
 
+@metrics.timed()
+def render_html(markup):
+    """Emits raw HTML."""
+    st.markdown(markup, unsafe_allow_html=True)
 
-    /* Hide hamburger menu (sidebar toggle) */
-    .css-1lcbmhc {
-        visibility: hidden;
-    }
+@st.cache_resource
+def load_stylesheet():
+    """The stylesheet's tag, built once per server process.
 
-    /* Adjust Streamlit columns for mobile responsiveness */
-    div[data-testid="stVerticalBlock"] > div {
-        gap: 1rem; /* Adjust vertical spacing */
-    }
-    div[data-testid="stHorizontalBlock"] > div {
-        gap: 1rem; /* Adjust horizontal spacing */
-    }
+    With static serving on, each run sends only an @import of the served file, versioned by its content,
+    which the browser fetches once and caches (st.html strips <link> tags, so @import it is).
+    Otherwise the whole stylesheet is inlined on every run.
+    """
+    with open(STYLESHEET_FILE, "rb") as f:
+        css = f.read()
+    if st.get_option("server.enableStaticServing"):
+        return f'<style>@import url("{STYLESHEET_URL}?v={hashlib.sha256(css).hexdigest()[:12]}");</style>'
+    return f"<style>\n{css.decode('utf-8')}</style>"
 
-    /* Chart specific styling */
-    .stPlotlyChart {
-        border-radius: 15px;
-        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-        padding: 10px;
-        background-color: white;
-    }
-
-    /* Form input styling */
-    .stTextInput>div>div>input, .stSelectbox>div>div>select, .stDateInput>div>div>input {
-        border-radius: 8px;
-        border: 1px solid #ccc;
-        padding: 8px 12px;
-    }
-    .stButton>button {
-        background-color: #2196F3;
-        color: white;
-        border-radius: 8px;
-        padding: 10px 20px;
-        border: none;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        transition: background-color 0.3s ease;
-    }
-    .stButton>button:hover {
-        background-color: #1976D2;
-    }
-
-    /* Message box styling */
-    .st-emotion-cache-1c7y2kd { /* This class might change, but targets success/error messages */
-        border-radius: 8px;
-    }
-
-    /* Profile Page image upload */
-    .stFileUploader {
-        border: 2px dashed #2196F3;
-        border-radius: 10px;
-        padding: 20px;
-        text-align: center;
-        background-color: #e3f2fd;
-    }
-    </style>
-""", unsafe_allow_html=True)
+st.html(load_stylesheet()) # Style-only HTML goes to the event container and takes no room on the page
 
 
 # --- Session State Setup ---
-for key in ["logged_in", "username", "user_role", "parent_username", "show_signup", "account_created", "active_page", "current_user_data", "transaction_df", "category_df"]:
-    if key not in st.session_state:
-        if key == "logged_in": st.session_state[key] = False
-        elif key == "show_signup": st.session_state[key] = False
-        elif key == "account_created": st.session_state[key] = False
-        elif key == "active_page": st.session_state[key] = "Home"
-        elif key == "user_role": st.session_state[key] = "Main" # Default role
-        else: st.session_state[key] = None
-
-# --- File Paths ---
-DATA_FILE = "mykhata_data.csv"
-USERS_FILE = "users_public_details.csv"
-CATEGORY_FILE = "category_memory.csv"
+# Sessions hold handles, not frames: effective_username and username name the shared, cached frames
+# and history_days the window loaded (see session_transactions), so a household's tabs share one copy
+# and an idle tab pins nothing.
+SESSION_DEFAULTS = {
+    "logged_in": False, "username": None, "user_role": "Main", "parent_username": None, "show_signup": False,
+    "account_created": False, "active_page": "Home", "current_user_data": None, "effective_username": None,
+}
+if "session_initialized" not in st.session_state: # Once per browser session, not on every rerun
+    for key, value in SESSION_DEFAULTS.items():
+        st.session_state.setdefault(key, value)
+    st.session_state.session_initialized = True
+
+# --- Storage ---
+@st.cache_resource
+def get_storage():
+    """Opens the configured storage backend once per server process; it is shared by every session."""
+    return storage.open_storage()
+
+@st.cache_resource
+def get_writer():
+    """The process-wide write-behind queue: every session's saves are committed by its one writer thread."""
+    return storage.WriteQueue(get_storage())
+
+@st.cache_resource
+def get_aggregator():
+    """The process-wide aggregate worker: the save helpers notify it, and the pages read what it published."""
+    worker = storage.AggregateWorker(get_storage(), get_writer())
+    if storage.SHARED_STORAGE: # Other replicas' writes are found by polling; their users' aggregates are recomputed here too
+        get_storage().watch_versions(worker.notify)
+    return worker
 
 # --- Utility Functions ---
 
+@metrics.timed()
 def hash_password(password):
-    """Hashes a password using SHA256."""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def load_users():
-    """Loads user data from CSV or creates an empty DataFrame."""
-    if os.path.exists(USERS_FILE):
-        return pd.read_csv(USERS_FILE)
-    else:
-        # Added 'ParentUsername' column for sub-users
-        df = pd.DataFrame(columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-        df.to_csv(USERS_FILE, index=False)
-        return df
-
-def save_users(df):
-    """Saves user data to CSV."""
-    df.to_csv(USERS_FILE, index=False)
-
+    """Hashes a password with the salted, calibrated KDF (see mykhata_auth)."""
+    return mykhata_auth.hash_password(password)
+
+@metrics.timed()
+def verify_password(user, password):
+    """Checks a login against the stored hash, upgrading legacy or under-cost hashes once it matches."""
+    matches, needs_rehash = mykhata_auth.verify_password(password, user["PasswordHash"])
+    if needs_rehash:
+        get_writer().submit_user_update(user["Username"], {"PasswordHash": hash_password(password)})
+    return matches
+
+@metrics.timed()
+def get_user(username):
+    """Returns a user's row as a dict, or None."""
+    get_writer().wait("users")
+    return get_storage().get_user(username)
+
+@metrics.timed()
+def sub_users(parent_username):
+    """Lists the usernames of the sub-users linked to a main user."""
+    get_writer().wait("users")
+    return get_storage().sub_users(parent_username)
+
+@metrics.timed()
+def add_user(user):
+    """Queues a new user row; the future resolves to False if the username was taken in the meantime."""
+    return get_writer().submit_user(user)
+
+def resolve_effective_username(username):
+    """Resolves sub-users to their parent so the whole household shares one set of transactions."""
+    user = get_user(username)
+    return username if user is None else storage.effective_username_of(user)
+
+@metrics.timed()
 def load_transactions(effective_username):
-    """Loads transaction data for a specific effective_username or creates an empty DataFrame."""
-    if os.path.exists(DATA_FILE):
-        df = pd.read_csv(DATA_FILE)
-        # Ensure 'Username' column exists and filter by effective_username
-        if 'Username' not in df.columns:
-            df['Username'] = '' # Add it if missing
-        return df[df['Username'] == effective_username].copy()
-    else:
-        df = pd.DataFrame(columns=["Username", "Date", "Type", "Category", "Amount", "Note"])
-        df.to_csv(DATA_FILE, index=False)
-        return df[df['Username'] == effective_username].copy()
+    """Loads typed transaction data (see storage.apply_transaction_schema) for a specific effective_username
+    from the process-wide cache; treat it as read-only."""
+    get_writer().wait("transactions", effective_username)
+    return get_storage().load_transactions(effective_username)
 
+@metrics.timed()
 def save_transaction(effective_username, date, trans_type, category, amount, note):
-    """Saves a single transaction to the main data file."""
-    if not os.path.exists(DATA_FILE):
-        df = pd.DataFrame(columns=["Username", "Date", "Type", "Category", "Amount", "Note"])
-        df.to_csv(DATA_FILE, index=False)
-
-    df = pd.read_csv(DATA_FILE)
-    new_transaction = pd.DataFrame([{
+    """Queues a single transaction for the writer thread and returns its future without waiting for the disk."""
+    record = {
         "Username": effective_username,
         "Date": date.strftime('%Y-%m-%d'),
         "Type": trans_type,
         "Category": category,
         "Amount": amount,
         "Note": note
-    }])
-    df = pd.concat([df, new_transaction], ignore_index=True)
-    df.to_csv(DATA_FILE, index=False)
-    st.session_state.transaction_df = load_transactions(effective_username) # Refresh session state data
-
-def load_categories(username):
-    """Loads custom categories for a user or creates an empty DataFrame."""
-    if os.path.exists(CATEGORY_FILE):
-        df = pd.read_csv(CATEGORY_FILE)
-        # Filter categories specific to the user or global (if any)
-        return df[df['Username'] == username].copy()
-    else:
-        df = pd.DataFrame(columns=["Username", "CategoryType", "CategoryName"])
-        df.to_csv(CATEGORY_FILE, index=False)
-        return df[df['Username'] == username].copy()
-
+    }
+    future = get_writer().submit_transaction(record) # Readers wait for it, so the next run sees the new row
+    get_aggregator().notify(effective_username) # Totals and rollups are recomputed in the background
+    return future
+
+@metrics.timed()
+def load_recent_transactions(effective_username, days):
+    """Loads the last `days` days of an effective_username's transactions from the process-wide cache;
+    treat it as read-only."""
+    get_writer().wait("transactions", effective_username)
+    since = pd.Timestamp.now().normalize() - pd.Timedelta(days=days - 1)
+    return get_storage().load_recent_transactions(effective_username, since)
+
+def session_transactions(min_rows=0):
+    """This session's most recent transactions, resolved from its handle through the shared cache on every access.
+
+    Only the last history_days days are loaded (HISTORY_WINDOW_DAYS at first). When that holds fewer than
+    min_rows rows and older ones exist, the window is widened, and stays wide for the session; past
+    HISTORY_MAX_DAYS the whole history is loaded. Nothing is held between runs, so a frame evicted for
+    idleness or the memory cap simply reloads here.
+    """
+    owner = st.session_state.effective_username
+    total = load_ledger(owner)["transaction_count"]
+    days = st.session_state.get("history_days", HISTORY_WINDOW_DAYS)
+    while days is not None:
+        window = load_recent_transactions(owner, days)
+        if len(window) >= min(min_rows, total):
+            return window
+        days = days * HISTORY_WIDEN_FACTOR if days * HISTORY_WIDEN_FACTOR <= HISTORY_MAX_DAYS else None
+        st.session_state.history_days = days
+    return load_transactions(owner)
+
+@metrics.timed()
+def load_ledger(effective_username):
+    """Returns the summary-card figures from the user's incrementally maintained ledger."""
+    get_writer().wait("transactions", effective_username)
+    published = get_aggregator().published(effective_username)
+    if published is not None:
+        return published["totals"]
+    return aggregates.ledger_summary(get_storage().ledger(effective_username)) # The worker is behind
+
+@metrics.timed()
+def load_category_index(username):
+    """Returns the user's categories by type, defaults included, as {"names": set, "sorted": dropdown tuple};
+    shared by every session and kept current by save_category."""
+    get_writer().wait("categories", username)
+    return get_storage().category_index(username)
+
+@metrics.timed()
 def save_category(username, category_type, category_name):
-    """Saves a custom category for a user."""
-    if not os.path.exists(CATEGORY_FILE):
-        df = pd.DataFrame(columns=["Username", "CategoryType", "CategoryName"])
-        df.to_csv(CATEGORY_FILE, index=False)
-
-    df = pd.read_csv(CATEGORY_FILE) # Read from CATEGORY_FILE to check existing categories
-    if not ((df['Username'] == username) & (df['CategoryName'] == category_name)).any():
-        new_category = pd.DataFrame([{
-            "Username": username,
-            "CategoryType": category_type,
-            "CategoryName": category_name
-        }])
-        df = pd.concat([df, new_category], ignore_index=True)
-        df.to_csv(CATEGORY_FILE, index=False)
-        st.session_state.category_df = load_categories(username) # Refresh session state data
+    """Queues a custom category for a user; returns a future resolving to False if it already existed."""
+    return get_writer().submit_category(username, category_type, category_name)
+
+def track_write(future, description):
+    """Keeps a queued write's future in the session, so a failure is reported on a later run (see show_failed_writes)."""
+    st.session_state.setdefault("pending_writes", []).append((description, future))
+
+def show_failed_writes():
+    """Shows an error for each of this session's queued writes that failed, and forgets the settled ones."""
+    pending = st.session_state.get("pending_writes")
+    if not pending:
+        return
+    unsettled = []
+    for description, future in pending:
+        if not future.done():
+            unsettled.append((description, future))
+        elif future.exception() is not None:
+            st.error(f"⚠️ {description} could not be saved: {future.exception()}")
+    st.session_state.pending_writes = unsettled
 
 # --- Authentication Pages ---
 
+@metrics.timed()
 def login_page():
-    st.markdown("<h2 style='text-align: center; color: #1976D2;'>🎉 Welcome to MyKhata – Manage your money smartly.</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='text-align: center; color: #1976D2;'>🎉 Welcome to MyKhata – Manage your money smartly.</h2>")
 
     with st.form("login_form"):
         username = st.text_input("Username", key="login_username")
@@ -474,20 +224,15 @@ def login_page():
             create_account_button = st.form_submit_button("Create a new account")
 
     if login_button:
-        users = load_users()
-        hashed_password = hash_password(password)
-        match = users[(users["Username"] == username) & (users["PasswordHash"] == hashed_password)]
-        if not match.empty:
+        user = get_user(username)
+        if user is not None and verify_password(user, password):
             st.session_state.logged_in = True
             st.session_state.username = username
-            st.session_state.user_role = match.iloc[0]["Role"]
-            st.session_state.parent_username = match.iloc[0]["ParentUsername"] if pd.notna(match.iloc[0]["ParentUsername"]) else None
-            
-            # Determine the effective username for data storage
-            st.session_state.effective_username = st.session_state.parent_username if st.session_state.user_role == "Sub" else st.session_state.username
+            st.session_state.user_role = user["Role"]
+            st.session_state.parent_username = user["ParentUsername"] if pd.notna(user["ParentUsername"]) else None
             
-            st.session_state.transaction_df = load_transactions(st.session_state.effective_username)
-            st.session_state.category_df = load_categories(st.session_state.username) # Categories are per actual user
+            # Determine the effective username for data storage; sub-users share their parent's data
+            st.session_state.effective_username = storage.effective_username_of(user)
             st.success("✅ Login Successful!")
             st.experimental_rerun()
         else:
@@ -497,8 +242,9 @@ def login_page():
         st.session_state.show_signup = True
         st.experimental_rerun()
 
+@metrics.timed()
 def signup_page():
-    st.markdown("<h2 style='text-align: center; color: #1976D2;'>📝 Create New Account</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='text-align: center; color: #1976D2;'>📝 Create New Account</h2>")
 
     with st.form("signup_form"):
         name = st.text_input("Your Name")
@@ -523,15 +269,18 @@ def signup_page():
             st.error("Password must start with an uppercase letter and include at least one special character.")
             return
 
-        users = load_users()
-        if username in users["Username"].values:
+        if get_user(username) is not None:
             st.error("Username already exists. Please choose a different one.")
         else:
             hashed_password = hash_password(password)
-            new_user = pd.DataFrame([[username, hashed_password, name, mobile, email, "Main", None]],
-                                    columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-            users = pd.concat([users, new_user], ignore_index=True)
-            save_users(users)
+            try:
+                created = add_user(dict(zip(storage.USER_COLUMNS, [username, hashed_password, name, mobile, email, "Main", None]))).result()
+            except Exception as e:
+                st.error(f"Could not create the account: {e}")
+                return
+            if not created: # Taken by another signup while this one was being hashed
+                st.error("Username already exists. Please choose a different one.")
+                return
             st.success("Account created successfully! Please log in.")
             st.session_state.show_signup = False
             st.session_state.account_created = True # Indicate successful creation for login page
@@ -542,110 +291,77 @@ def signup_page():
         st.experimental_rerun()
 
 # --- Navigation Bar ---
+NAV_ITEMS = [
+    ("Home", "🏠"),
+    ("Wallet", "📈"),
+    ("Add", "+"), # Plus button is special
+    ("Report", "📊"),
+    ("Profile", "👤")
+]
+
+def navigate(page):
+    """Button callback: runs before the rerun, so the new page renders without a second run."""
+    st.query_params["nav"] = page
+    st.session_state.active_page = page
+
 def bottom_navbar():
-    # Use st.columns for horizontal layout of buttons
-    st.markdown('<div class="bottom-bar">', unsafe_allow_html=True)
-    cols = st.columns([1, 1, 1, 1, 1]) # 5 columns for 5 buttons
-
-    nav_items = [
-        ("Home", "🏠"),
-        ("Wallet", "📈"),
-        ("Add", "+"), # Plus button is special
-        ("Report", "📊"),
-        ("Profile", "👤")
-    ]
-
-    for i, (page, icon) in enumerate(nav_items):
-        with cols[i]:
-            if page == "Add":
-                # Special styling for the Add button
-                if st.button(icon, key=f"nav_btn_{page}", help=page):
-                    st.session_state.active_page = page
-                    st.experimental_rerun()
-                # Applying CSS for the plus button
-                st.markdown(f"""
-                    <style>
-                        div[data-testid="stColumn"]:nth-child({i+1}) button[data-testid="stButton"] {{
-                            font-size: 32px !important;
-                            color: white !important;
-                            background: #2196F3 !important;
-                            border-radius: 50% !important;
-                            width: 60px !important;
-                            height: 60px !important;
-                            line-height: 60px !important;
-                            text-align: center !important;
-                            box-shadow: 0 4px 10px rgba(0, 0, 0, 0.2) !important;
-                            transition: background 0.3s ease !important;
-                            display: flex !important;
-                            justify-content: center !important;
-                            align-items: center !important;
-                            margin-top: -30px !important; /* Pull up to float */
-                        }}
-                        div[data-testid="stColumn"]:nth-child({i+1}) button[data-testid="stButton"]:hover {{
-                            background: #1976D2 !important;
-                        }}
-                    </style>
-                """, unsafe_allow_html=True)
-            else:
-                # Regular navigation buttons
-                # The text and icon are passed together in the button label
-                # The active state is handled by setting the color dynamically in the CSS
-                if st.button(f"<span class='icon'>{icon}</span> {page}", key=f"nav_btn_{page}", help=page, unsafe_allow_html=True):
-                    st.session_state.active_page = page
-                    st.experimental_rerun()
-                
-                # Apply CSS for the regular nav items
-                st.markdown(f"""
-                    <style>
-                        div[data-testid="stColumn"]:nth-child({i+1}) button {{
-                            background: none !important;
-                            border: none !important;
-                            padding: 0 !important;
-                            margin: 0 !important;
-                            box-shadow: none !important;
-                            color: {'#2196F3' if st.session_state.active_page == page else '#555'} !important; /* Dynamic color based on active_page */
-                            font-size: 0.8em !important;
-                            font-weight: 600 !important;
-                            transition: color 0.3s ease !important;
-                            height: auto !important;
-                            width: auto !important;
-                            display: flex !important;
-                            flex-direction: column !important;
-                            align-items: center !important;
-                            cursor: pointer !important;
-                        }}
-                        div[data-testid="stColumn"]:nth-child({i+1}) button:hover {{
-                            color: #2196F3 !important;
-                        }}
-                        div[data-testid="stColumn"]:nth-child({i+1}) button > div {{ /* Target the inner div containing icon and text */
-                            display: flex;
-                            flex-direction: column;
-                            align-items: center;
-                        }}
-                        div[data-testid="stColumn"]:nth-child({i+1}) button .icon {{
-                            font-size: 24px !important;
-                            margin-bottom: 3px !important;
-                        }}
-                    </style>
-                """, unsafe_allow_html=True)
-
-    st.markdown('</div>', unsafe_allow_html=True)
+    # All styling is in the stylesheet, keyed on the st-key-bottom_nav and st-key-nav_btn_<page> classes;
+    # the active page is marked by rendering its button as primary
+    with st.container(key="bottom_nav"):
+        for col, (page, icon) in zip(st.columns(len(NAV_ITEMS)), NAV_ITEMS):
+            with col:
+                label = icon if page == "Add" else f"{icon} {page}"
+                st.button(label, key=f"nav_btn_{page}", help=page, on_click=navigate, args=(page,),
+                          type="primary" if st.session_state.active_page == page else "secondary")
+
+
+# --- Transaction List ---
+TRANSACTION_PAGE_SIZE = 20 # Rows rendered per "Load more" step on the dashboard
+HISTORY_WINDOW_DAYS = 90 # Days of history a session loads up front
+HISTORY_WIDEN_FACTOR = 4 # The window grows by this factor when a page needs older rows
+HISTORY_MAX_DAYS = 3650 # Beyond this, the whole history is loaded
+
+# Basic icon mapping for categories (can be expanded)
+CATEGORY_ICONS = {
+    "Food": "🍔", "Transport": "🚗", "Rent": "🏠", "Utilities": "💡",
+    "Shopping": "🛍️", "Entertainment": "🎬", "Health": "🏥", "Education": "📚",
+    "Salary": "💰", "Freelance": "💼", "Investment": "📈", "Gift": "🎁",
+    "Personal Loan": "💳", "Home Loan": "🏡", "Car Loan": "🚗", "Student Loan": "🎓",
+    "Loan Repayment": "💸", "Credit Card Bill": "💳",
+    "Other Income": "➕", "Other Expense": "➖", "Other Loan": "🤝", "Other EMI": "🔄"
+}
+AMOUNT_CLASSES = {"Income": "amount-income", "Expense": "amount-expense", "Loan": "amount-loan", "EMI": "amount-emi"}
+
+def render_transaction_rows(transactions):
+    """Builds the HTML for a page of transactions in one payload, formatting every column as a whole."""
+    icons = transactions['Category'].astype(str).map(CATEGORY_ICONS).fillna("📝") # Default icon
+    amount_classes = transactions['Type'].astype(str).map(AMOUNT_CLASSES).fillna("")
+    categories = transactions['Category'].astype(str).map(html.escape)
+    dates = transactions['Date'].dt.strftime('%d %b').fillna("")
+    notes = transactions['Note'].fillna("").astype(str).map(html.escape)
+    amounts = transactions['Amount'].map("{:,.2f}".format)
+    rows = ('<div class="transaction-item"><div class="icon-circle">' + icons + '</div>'
+            '<div class="details"><div class="category-name">' + categories + '</div>'
+            '<div class="note-date">' + dates + ' - ' + notes + '</div></div>'
+            '<div class="amount-display ' + amount_classes + '">₹ ' + amounts + '</div></div>')
+    return "".join(rows)
 
 
 # --- Pages ---
 
+@metrics.timed()
 def dashboard():
     # Top bar placeholder (non-functional, for visual resemblance)
-    st.markdown("""
+    render_html("""
     <div class="top-bar-placeholder">
         <span class="time">09:00</span>
         <div class="status-icons">
             <span>📶</span><span>🔋</span>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """)
 
-    st.markdown(f"""
+    render_html(f"""
     <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px;">
         <div style="display: flex; align-items: center;">
             <img src="https://placehold.co/60x60/e0e0e0/ffffff?text=👨‍💻" style="border-radius: 50%; margin-right: 15px;">
@@ -653,29 +369,18 @@ def dashboard():
         </div>
         <div style="font-size: 28px; cursor: pointer; color: #555;">🔔</div>
     </div>
-    """, unsafe_allow_html=True)
+    """)
 
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
-    
-    if user_transactions.empty:
-        total_balance = 0
-        total_income = 0
-        total_expense = 0
-    else:
-        # Ensure 'Amount' column is numeric
-        user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
 
-        total_income = user_transactions[user_transactions['Type'] == 'Income']['Amount'].sum()
-        total_expense = user_transactions[user_transactions['Type'] == 'Expense']['Amount'].sum()
-        total_loans_taken = user_transactions[user_transactions['Type'] == 'Loan']['Amount'].sum()
-        total_emi_paid = user_transactions[user_transactions['Type'] == 'EMI']['Amount'].sum()
-        
-        total_balance = total_income - total_expense - total_emi_paid + total_loans_taken
+    totals = load_ledger(effective_username)
+    total_balance = totals["total_balance"]
+    total_income = totals["total_income"]
+    total_expense = totals["total_expense"]
     
     # Main Balance Card
-    st.markdown(f"""
+    render_html(f"""
     <div class="main-balance-card">
         <h4>Total Balance</h4>
         <div class="balance-amount">₹ {total_balance:,.2f}</div>
@@ -696,93 +401,53 @@ def dashboard():
             </div>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """)
 
-    st.markdown("""
+    render_html("""
     <div class="section-header">
         <h3>Transaction</h3>
     </div>
-    """, unsafe_allow_html=True) # Removed filter icon as it was not functional
-
-    if not user_transactions.empty:
-        # Sort by date descending for latest transactions first
-        display_transactions = user_transactions.sort_values(by='Date', ascending=False)
-
-        # Basic icon mapping for categories (can be expanded)
-        category_icons = {
-            "Food": "🍔", "Transport": "🚗", "Rent": "🏠", "Utilities": "💡",
-            "Shopping": "🛍️", "Entertainment": "🎬", "Health": "🏥", "Education": "📚",
-            "Salary": "💰", "Freelance": "💼", "Investment": "📈", "Gift": "🎁",
-            "Personal Loan": "💳", "Home Loan": "🏡", "Car Loan": "🚗", "Student Loan": "🎓",
-            "Loan Repayment": "💸", "Credit Card Bill": "💳",
-            "Other Income": "➕", "Other Expense": "➖", "Other Loan": "🤝", "Other EMI": "🔄"
-        }
-
-        for index, row in display_transactions.iterrows():
-            icon = category_icons.get(row['Category'], "📝") # Default icon
-            amount_class = ""
-            if row['Type'] == 'Income':
-                amount_class = "amount-income"
-            elif row['Type'] == 'Expense':
-                amount_class = "amount-expense"
-            elif row['Type'] == 'Loan':
-                amount_class = "amount-loan"
-            elif row['Type'] == 'EMI':
-                amount_class = "amount-emi"
-
-            st.markdown(f"""
-            <div class="transaction-item">
-                <div class="icon-circle">{icon}</div>
-                <div class="details">
-                    <div class="category-name">{row['Category']}</div>
-                    <div class="note-date">{pd.to_datetime(row['Date']).strftime('%d %b')} - {row['Note']}</div>
-                </div>
-                <div class="amount-display {amount_class}">
-                    ₹ {row['Amount']:,.2f}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+    """) # Removed filter icon as it was not functional
+
+    transaction_count = totals["transaction_count"]
+    if transaction_count:
+        limit = st.session_state.get("transaction_limit", TRANSACTION_PAGE_SIZE)
+        # Only recent history is loaded; it is widened when the rows shown reach past it
+        recent_transactions = session_transactions(limit)
+        metrics.count("rows_scanned", len(recent_transactions))
+        # Sort by date descending for latest transactions first; only the visible window is rendered
+        display_transactions = recent_transactions.sort_values(by='Date', ascending=False, kind='stable').head(limit)
+        render_html(render_transaction_rows(display_transactions))
+
+        remaining = transaction_count - len(display_transactions)
+        if remaining > 0:
+            st.caption(f"Showing {len(display_transactions)} of {transaction_count} transactions")
+            st.button(f"Load more ({min(remaining, TRANSACTION_PAGE_SIZE)})", key="load_more_transactions",
+                      on_click=show_more_transactions, args=(limit,))
     else:
         st.info("No transactions to display.")
 
 
+def show_more_transactions(limit):
+    """Button callback: the next run renders one more page, loading older history if it needs to."""
+    st.session_state.transaction_limit = limit + TRANSACTION_PAGE_SIZE
+
+@metrics.timed()
 def add_transaction():
-    st.markdown("<h2 style='color: #1976D2;'>➕ Add Transaction</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='color: #1976D2;'>➕ Add Transaction</h2>")
 
     effective_username = st.session_state.effective_username
     current_username = st.session_state.username # For category management
 
-    # Load categories for the current user
-    user_categories_df = st.session_state.category_df
-    
-    # Default categories
-    default_income_categories = ["Salary", "Freelance", "Investment", "Gift", "Other Income"]
-    default_expense_categories = ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Health", "Education", "Other Expense"]
-    default_loan_categories = ["Personal Loan", "Home Loan", "Car Loan", "Student Loan", "Other Loan"]
-    default_emi_categories = ["Loan Repayment", "Credit Card Bill", "Other EMI"]
-
-    # Combine default and user-defined categories
-    all_income_categories = sorted(list(set(default_income_categories + user_categories_df[user_categories_df['CategoryType'] == 'Income']['CategoryName'].tolist())))
-    all_expense_categories = sorted(list(set(default_expense_categories + user_categories_df[user_categories_df['CategoryType'] == 'Expense']['CategoryName'].tolist())))
-    all_loan_categories = sorted(list(set(default_loan_categories + user_categories_df[user_categories_df['CategoryType'] == 'Loan']['CategoryName'].tolist())))
-    all_emi_categories = sorted(list(set(default_emi_categories + user_categories_df[user_categories_df['CategoryType'] == 'EMI']['CategoryName'].tolist())))
+    # Default and user-defined categories, pre-sorted per type
+    category_index = load_category_index(current_username)
 
     with st.form("transaction_form", clear_on_submit=True):
         date = st.date_input("Date", datetime.now().date())
         trans_type = st.selectbox("Type", ["Expense", "Income", "Loan", "EMI"], key="trans_type")
 
-        category_options = []
-        if trans_type == "Income":
-            category_options = all_income_categories
-        elif trans_type == "Expense":
-            category_options = all_expense_categories
-        elif trans_type == "Loan":
-            category_options = all_loan_categories
-        elif trans_type == "EMI":
-            category_options = all_emi_categories
-        
         # Add a "Add New Category" option
-        category_options.append("➕ Add New Category...")
+        category_options = [*category_index[trans_type]["sorted"], "➕ Add New Category..."]
         
         category = st.selectbox("Category", category_options, key="category_select")
 
@@ -791,7 +456,7 @@ def add_transaction():
             new_category_name = st.text_input("Enter New Category Name", key="new_category_input")
             if new_category_name:
                 # Save new category to memory
-                save_category(current_username, trans_type, new_category_name)
+                track_write(save_category(current_username, trans_type, new_category_name), f"Category '{new_category_name}'")
                 category = new_category_name # Use the new category for the current transaction
                 st.success(f"Category '{new_category_name}' added!")
                 # Re-run to update category dropdown with new option
@@ -811,212 +476,228 @@ def add_transaction():
             elif amount <= 0:
                 st.error("Amount must be greater than 0.")
             else:
-                save_transaction(effective_username, date, trans_type, category, amount, note)
-                st.success("✅ Transaction saved successfully!")
+                # Committed in the background; a failure is shown on the session's next run
+                track_write(save_transaction(effective_username, date, trans_type, category, amount, note),
+                            f"{trans_type} of ₹{amount:,.2f} ({category})")
+                st.success("✅ Transaction added!")
                 # No explicit rerun here, form clear_on_submit handles it
 
+    st.markdown("---")
+    with st.expander("📥 Import Bank/UPI Statement (CSV)"):
+        statement_import(effective_username)
+
+def statement_import(effective_username):
+    """Maps the columns of an uploaded statement and streams it into the user's transactions."""
+    statement = st.file_uploader("Statement file", type=["csv"], key="statement_uploader")
+    if statement is None:
+        return
+    statement_columns = pd.read_csv(statement, nrows=0).columns.tolist()
+    statement.seek(0)
+
+    options = ["(none)"] + statement_columns
+    lowered = [col.lower() for col in statement_columns]
+    column_map = {}
+    for field, col in zip(mykhata_io.IMPORT_FIELDS, st.columns(len(mykhata_io.IMPORT_FIELDS))):
+        with col:
+            # Preselect a statement column with the same name, if there is one
+            default = lowered.index(field.lower()) + 1 if field.lower() in lowered else 0
+            choice = st.selectbox(field, options, index=default, key=f"import_map_{field}")
+            column_map[field] = None if choice == "(none)" else choice
+    st.caption("Without a Type column, negative amounts are imported as expenses and positive ones as income.")
+    dayfirst = st.checkbox("Dates are day-first (DD/MM/YYYY)", value=True, key="import_dayfirst")
+
+    if st.button("Import Statement", key="import_statement_button"):
+        progress = st.empty()
+        imported_so_far = [0]
+        def on_chunk(imported, rejected):
+            imported_so_far[0] = imported
+            progress.info(f"Imported {imported:,} rows so far...")
+        try: # Chunks go through the write queue, after anything this session already queued
+            result = mykhata_io.import_statement(get_writer(), effective_username, statement, column_map,
+                                                 dayfirst=dayfirst, on_chunk=on_chunk)
+        except ValueError as e:
+            progress.empty()
+            st.error(f"Could not import statement: {e}")
+            return
+        except Exception as e: # A chunk failed to commit; the ones before it are saved
+            progress.empty()
+            get_aggregator().notify(effective_username)
+            st.error(f"Import stopped after {imported_so_far[0]:,} rows: {e}")
+            return
+        progress.empty()
+        get_aggregator().notify(effective_username)
+        st.success(f"✅ Imported {result['imported']:,} transactions ({result['rejected']:,} rows skipped).")
+
+def cached_chart(effective_username, kind, time_filter, data_version, build):
+    """Returns build(), a chart's spec and whatever the page shows with it, built once per
+    (user, chart kind, time filter, data version) and shared by every rerun and session.
+
+    Specs are kept in the storage frame cache, under its memory cap and idle sweep. A new transaction
+    changes the data version, so the next view builds afresh and replaces the older spec.
+    """
+    key = (get_storage().name, "chart", effective_username, kind, time_filter)
+    return storage.frame_cache.get(key, lambda: data_version, build)
+
+@metrics.timed()
+def transactions_version(effective_username):
+    """The user's transaction data version, once their queued writes have landed."""
+    get_writer().wait("transactions", effective_username)
+    return get_storage().data_version("transactions", effective_username)
+
+def show_chart(spec):
+    """Emits a cached Vega-Lite spec; Streamlit serialises its data here, so this span covers what is sent to the browser."""
+    with metrics.span("vega_lite_chart"):
+        st.vega_lite_chart(spec, width="stretch")
+
+@metrics.timed()
 def wallet():
-    st.markdown("<h2 style='color: #1976D2;'>💼 Wallet Overview</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='color: #1976D2;'>💼 Wallet Overview</h2>")
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
 
-    if user_transactions.empty:
+    totals = load_ledger(effective_username)
+    if totals["transaction_count"] == 0:
         st.info("No transactions recorded yet to display wallet overview.")
-        total_balance = 0
-        total_income = 0
-        total_expense = 0
-        net_loans = 0
-    else:
-        user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
-
-        total_income = user_transactions[user_transactions['Type'] == 'Income']['Amount'].sum()
-        total_expense = user_transactions[user_transactions['Type'] == 'Expense']['Amount'].sum()
-        total_loans_taken = user_transactions[user_transactions['Type'] == 'Loan']['Amount'].sum()
-        total_emi_paid = user_transactions[user_transactions['Type'] == 'EMI']['Amount'].sum()
-        
-        total_balance = total_income - total_expense - total_emi_paid + total_loans_taken
-        net_loans = total_loans_taken - total_emi_paid
+    total_balance = totals["total_balance"]
+    total_income = totals["total_income"]
+    total_expense = totals["total_expense"]
+    net_loans = totals["net_loans"]
 
     # Display summary cards
     col1, col2 = st.columns(2)
     with col1:
-        st.markdown(f"""
+        render_html(f"""
         <div class="stCard">
             <h3>Current Balance</h3>
             <p>₹ {total_balance:,.2f}</p>
         </div>
-        """, unsafe_allow_html=True)
+        """)
     with col2:
-        st.markdown(f"""
+        render_html(f"""
         <div class="stCard">
             <h3>Total Income</h3>
             <p>₹ {total_income:,.2f}</p>
         </div>
-        """, unsafe_allow_html=True)
+        """)
     
     col3, col4 = st.columns(2)
     with col3:
-        st.markdown(f"""
+        render_html(f"""
         <div class="stCard">
             <h3>Total Expense</h3>
             <p>₹ {total_expense:,.2f}</p>
         </div>
-        """, unsafe_allow_html=True)
+        """)
     with col4:
-        st.markdown(f"""
+        render_html(f"""
         <div class="stCard">
             <h3>Net Loans</h3>
             <p>₹ {net_loans:,.2f}</p>
         </div>
-        """, unsafe_allow_html=True)
+        """)
 
     st.markdown("---")
     st.subheader("Expense Breakdown by Category")
 
-    if not user_transactions.empty and not user_transactions[user_transactions['Type'] == 'Expense'].empty:
-        expense_by_category = user_transactions[user_transactions['Type'] == 'Expense'].groupby('Category')['Amount'].sum().reset_index()
-        
-        chart = alt.Chart(expense_by_category).mark_arc(outerRadius=120).encode(
-            theta=alt.Theta(field="Amount", type="quantitative"),
-            color=alt.Color(field="Category", type="nominal", title="Category"),
-            order=alt.Order("Amount", sort="descending"),
-            tooltip=["Category", alt.Tooltip("Amount", format=",.2f")]
-        ).properties(
-            title="Expense Distribution"
-        ).interactive()
-        
-        text = alt.Chart(expense_by_category).mark_text(radius=140).encode(
-            theta=alt.Theta(field="Amount", type="quantitative"),
-            text=alt.Text("Amount", format=",.2f"),
-            order=alt.Order("Amount", sort="descending"),
-            color=alt.value("black") # Set the color of the labels to black
-        )
-        
-        st.altair_chart(chart + text, use_container_width=True)
+    def build():
+        # All-time totals per category are published by the aggregate worker or read off the yearly rollup,
+        # so the wallet never loads the full history
+        expense_by_category = load_expense_by_category(effective_username)
+        if expense_by_category.empty:
+            return None
+        import mykhata_reports as reports
+        return reports.chart_spec(reports.expense_breakdown_chart(expense_by_category))
+
+    spec = cached_chart(effective_username, "expense_breakdown", None, transactions_version(effective_username), build)
+    if spec is not None:
+        show_chart(spec)
     else:
         st.info("No expense transactions to display a breakdown.")
 
 
+@metrics.timed()
+def load_rollup(effective_username, granularity, types=None):
+    """Returns per-period totals (Period, Type, Category, Amount, Count) from the user's materialised rollup."""
+    get_writer().wait("transactions", effective_username)
+    published = get_aggregator().published(effective_username)
+    if published is None: # The worker is behind
+        return get_storage().rollup_frame(effective_username, granularity, types)
+    df = published["rollups"][granularity] # Shared with other sessions: filtered into a copy, never changed
+    return df if types is None else df[df['Type'].isin(types)].reset_index(drop=True)
+
+@metrics.timed()
+def load_expense_by_category(effective_username):
+    """Returns the user's all-time expense per Category, as published by the aggregate worker or from the yearly rollup."""
+    get_writer().wait("transactions", effective_username)
+    published = get_aggregator().published(effective_username)
+    if published is not None:
+        return published["expense_by_category"]
+    return aggregates.category_totals(load_rollup(effective_username, "Y", ("Expense",)), "Expense")
+
+# Report type -> (subheader, message when there is nothing to draw)
+REPORT_TEXT = {
+    "Income vs. Expense": ("Income vs. Expense Over Time", "No income or expense data for this period."),
+    "Category Spending": ("Spending by Category Over Time", "No expense data to display category spending."),
+    "Loan/EMI Trends": ("Loan and EMI Trends Over Time", "No loan or EMI data for this period."),
+}
+
+@metrics.timed()
 def report():
-    st.markdown("<h2 style='color: #1976D2;'>📊 Reports</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='color: #1976D2;'>📊 Reports</h2>")
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
 
-    if user_transactions.empty:
+    if load_ledger(effective_username)["transaction_count"] == 0:
         st.info("No transactions to generate reports.")
         return
 
-    user_transactions['Date'] = pd.to_datetime(user_transactions['Date'])
-    user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
-
-    report_type = st.selectbox("Select Report Type:", ["Income vs. Expense", "Category Spending", "Loan/EMI Trends"], key="report_type_select")
-    time_filter = st.selectbox("Filter by:", ["Daily", "Monthly", "Yearly"], key="report_time_filter")
-
-    # Determine grouping period
-    if time_filter == "Daily":
-        period_format = '%Y-%m-%d'
-        period_title = 'Date'
-        group_by_period = user_transactions['Date'].dt.date
-    elif time_filter == "Monthly":
-        period_format = '%Y-%m'
-        period_title = 'Month'
-        group_by_period = user_transactions['Date'].dt.to_period('M')
-    else: # Yearly
-        period_format = '%Y'
-        period_title = 'Year'
-        group_by_period = user_transactions['Date'].dt.to_period('Y')
-
-    if report_type == "Income vs. Expense":
-        st.subheader("Income vs. Expense Over Time")
-        income_data = user_transactions[user_transactions['Type'] == 'Income'].groupby(group_by_period)['Amount'].sum().reset_index()
-        expense_data = user_transactions[user_transactions['Type'] == 'Expense'].groupby(group_by_period)['Amount'].sum().reset_index()
-
-        income_data['Type'] = 'Income'
-        expense_data['Type'] = 'Expense'
-
-        # Rename the period column for Altair
-        income_data.rename(columns={income_data.columns[0]: 'Period'}, inplace=True)
-        expense_data.rename(columns={expense_data.columns[0]: 'Period'}, inplace=True)
-
-        combined_data = pd.concat([income_data, expense_data])
-        
-        if not combined_data.empty:
-            # Convert Period to timestamp for Altair
-            combined_data['Period'] = combined_data['Period'].astype(str).apply(lambda x: datetime.strptime(x, period_format))
-
-            chart = alt.Chart(combined_data).mark_line(point=True).encode(
-                x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
-                y=alt.Y('Amount', title='Amount (₹)'),
-                color=alt.Color('Type', legend=alt.Legend(title="Transaction Type")),
-                tooltip=[alt.Tooltip('Period', format=period_format), 'Type', alt.Tooltip('Amount', format=",.2f")]
-            ).properties(
-                title=f'Income vs. Expense ({time_filter})'
-            ).interactive()
-            st.altair_chart(chart, use_container_width=True)
+    import mykhata_reports as reports
+
+    report_type = st.selectbox("Select Report Type:", list(REPORT_TEXT), key="report_type_select")
+    time_filter = st.selectbox("Filter by:", list(reports.TIME_FILTERS), key="report_time_filter")
+    requested = reports.TIME_FILTERS[time_filter] # Determine grouping period
+
+    def type_totals(types):
+        # Chart data at one granularity: Amount per Period and Type
+        return lambda granularity: load_rollup(effective_username, granularity, types).groupby(['Period', 'Type'], as_index=False)['Amount'].sum()
+
+    def build():
+        # Runs only when this report has no cached spec for the user's current data version
+        if report_type == "Income vs. Expense":
+            granularity, data = reports.fit_to_budget(type_totals(("Income", "Expense")), requested, coarsest="M")
+            chart = lambda: reports.trend_chart(data, granularity, 'Income vs. Expense')
+        elif report_type == "Category Spending":
+            granularity, data = reports.fit_to_budget(
+                lambda granularity: load_rollup(effective_username, granularity, ("Expense",)), requested, marks=reports.bar_marks)
+            chart = lambda: reports.category_spending_chart(data, granularity)
         else:
-            st.info("No income or expense data for this period.")
-
-    elif report_type == "Category Spending":
-        st.subheader("Spending by Category Over Time")
-        expense_data = user_transactions[user_transactions['Type'] == 'Expense'].copy()
-        
-        if not expense_data.empty:
-            expense_data['Period'] = group_by_period.astype(str) # Convert to string for grouping
-            
-            # Group by Period and Category
-            grouped_expense = expense_data.groupby(['Period', 'Category'])['Amount'].sum().reset_index()
-            
-            # Convert Period back to datetime for Altair
-            grouped_expense['Period'] = grouped_expense['Period'].apply(lambda x: datetime.strptime(x, period_format))
-
-            chart = alt.Chart(grouped_expense).mark_bar().encode(
-                x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
-                y=alt.Y('Amount', title='Total Spending (₹)'),
-                color=alt.Color('Category', title="Category"),
-                tooltip=[alt.Tooltip('Period', format=period_format), 'Category', alt.Tooltip('Amount', format=",.2f")]
-            ).properties(
-                title=f'Spending by Category ({time_filter})'
-            ).interactive()
-            st.altair_chart(chart, use_container_width=True)
-        else:
-            st.info("No expense data to display category spending.")
-
-    elif report_type == "Loan/EMI Trends":
-        st.subheader("Loan and EMI Trends Over Time")
-        loan_data = user_transactions[user_transactions['Type'] == 'Loan'].groupby(group_by_period)['Amount'].sum().reset_index()
-        emi_data = user_transactions[user_transactions['Type'] == 'EMI'].groupby(group_by_period)['Amount'].sum().reset_index()
-
-        loan_data['Type'] = 'Loan Taken'
-        emi_data['Type'] = 'EMI Paid'
-
-        loan_data.rename(columns={loan_data.columns[0]: 'Period'}, inplace=True)
-        emi_data.rename(columns={emi_data.columns[0]: 'Period'}, inplace=True)
-
-        combined_data = pd.concat([loan_data, emi_data])
-
-        if not combined_data.empty:
-            combined_data['Period'] = combined_data['Period'].astype(str).apply(lambda x: datetime.strptime(x, period_format))
+            granularity, data = reports.fit_to_budget(type_totals(("Loan", "EMI")), requested, coarsest="M")
+            data['Type'] = data['Type'].map({"Loan": "Loan Taken", "EMI": "EMI Paid"})
+            chart = lambda: reports.trend_chart(data, granularity, 'Loan and EMI Trends')
+        return granularity, (None if data.empty else reports.chart_spec(chart()))
+
+    subheader, empty_message = REPORT_TEXT[report_type]
+    st.subheader(subheader)
+    granularity, spec = cached_chart(effective_username, report_type, time_filter, transactions_version(effective_username), build)
+    if spec is not None:
+        coarsened_caption(requested, granularity)
+        show_chart(spec)
+    else:
+        st.info(empty_message)
 
-            chart = alt.Chart(combined_data).mark_line(point=True).encode(
-                x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
-                y=alt.Y('Amount', title='Amount (₹)'),
-                color=alt.Color('Type', legend=alt.Legend(title="Transaction Type")),
-                tooltip=[alt.Tooltip('Period', format=period_format), 'Type', alt.Tooltip('Amount', format=",.2f")]
-            ).properties(
-                title=f'Loan and EMI Trends ({time_filter})'
-            ).interactive()
-            st.altair_chart(chart, use_container_width=True)
-        else:
-            st.info("No loan or EMI data for this period.")
+def coarsened_caption(requested, granularity):
+    """Says so when a report was drawn at a coarser period than the one picked, to stay within the point budget."""
+    import mykhata_reports as reports
+    if granularity != requested:
+        st.caption(f"Showing {reports.PERIOD_AXES[granularity][0].lower()} totals: "
+                   f"{reports.PERIOD_AXES[requested][0].lower()} would draw more than {reports.POINT_BUDGET:,} points.")
 
 
+@metrics.timed()
 def profile():
-    st.markdown("<h2 style='color: #1976D2;'>👤 Profile Settings</h2>", unsafe_allow_html=True)
+    render_html("<h2 style='color: #1976D2;'>👤 Profile Settings</h2>")
 
-    users_df = load_users()
-    current_user_row = users_df[users_df['Username'] == st.session_state.username].iloc[0]
+    current_user_row = get_user(st.session_state.username)
 
     st.subheader("Your Profile Information")
     col_img, col_details = st.columns([1, 2])
@@ -1024,7 +705,7 @@ def profile():
         # Placeholder for profile photo upload
         st.image("https://placehold.co/150x150/e0e0e0/ffffff?text=Profile", width=150, caption="Profile Photo")
         # st.file_uploader("Upload Photo", type=["png", "jpg", "jpeg"], key="profile_photo_uploader")
-        st.markdown("<small><i>(Photo upload is for display only; persistence requires backend storage)</i></small>", unsafe_allow_html=True)
+        render_html("<small><i>(Photo upload is for display only; persistence requires backend storage)</i></small>")
     
     with col_details:
         st.write(f"**Name:** {current_user_row['Name']}")
@@ -1034,6 +715,9 @@ def profile():
         st.write(f"**Role:** {current_user_row['Role']}")
         if current_user_row['Role'] == "Sub" and pd.notna(current_user_row['ParentUsername']):
             st.write(f"**Linked to Main Account:** {current_user_row['ParentUsername']}")
+        linked_sub_users = sub_users(current_user_row['Username'])
+        if linked_sub_users:
+            st.write(f"**Sub-Users:** {', '.join(linked_sub_users)}")
 
     st.markdown("---")
 
@@ -1059,23 +743,31 @@ def profile():
                     st.error("Sub-User Password must start with an uppercase letter and include at least one special character.")
                     return
 
-                if sub_user_username in users_df["Username"].values:
+                if get_user(sub_user_username) is not None:
                     st.error("Sub-User Username already exists. Please choose a different one.")
                 else:
                     hashed_sub_password = hash_password(sub_user_password)
-                    new_sub_user = pd.DataFrame([[sub_user_username, hashed_sub_password, sub_user_name, sub_user_mobile, sub_user_email, "Sub", st.session_state.username]],
-                                                columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-                    users_df = pd.concat([users_df, new_sub_user], ignore_index=True)
-                    save_users(users_df)
+                    try:
+                        created = add_user(dict(zip(storage.USER_COLUMNS, [sub_user_username, hashed_sub_password, sub_user_name, sub_user_mobile, sub_user_email, "Sub", st.session_state.username]))).result()
+                    except Exception as e:
+                        st.error(f"Could not create the sub-user: {e}")
+                        return
+                    if not created:
+                        st.error("Sub-User Username already exists. Please choose a different one.")
+                        return
                     st.success(f"Sub-user '{sub_user_username}' created successfully and linked to your account!")
                     st.experimental_rerun()
     else:
         st.info(f"You are a 'Sub' user linked to '{st.session_state.parent_username}' account. Only the main user can add new sub-users.")
 
+    st.markdown("---")
+    st.subheader("Export Transactions")
+    transaction_export(st.session_state.effective_username)
+
     st.markdown("---")
     st.subheader("Payment Reminders (Upcoming)")
     st.info("This section will display upcoming loan or EMI due dates.")
-    st.markdown("<small><i>(Feature placeholder)</i></small>", unsafe_allow_html=True)
+    render_html("<small><i>(Feature placeholder)</i></small>")
 
     st.markdown("---")
     if st.button("Logout", key="logout_button"):
@@ -1083,24 +775,47 @@ def profile():
         st.session_state.username = ""
         st.session_state.user_role = ""
         st.session_state.parent_username = None
-        st.session_state.effective_username = ""
-        st.session_state.transaction_df = pd.DataFrame() # Clear dataframes
-        st.session_state.category_df = pd.DataFrame()
+        st.session_state.effective_username = None # Drops this session's handles; the shared frames stay cached for others
+        st.session_state.pop("history_days", None)
+        st.session_state.pop("transaction_limit", None)
         st.success("You have been logged out.")
         st.experimental_rerun()
 
+def transaction_export(effective_username):
+    """Offers the user's transactions for download, encoded only when the download is clicked."""
+    col_start, col_end = st.columns(2)
+    with col_start:
+        start_date = st.date_input("From", value=None, key="export_start")
+    with col_end:
+        end_date = st.date_input("To", value=None, key="export_end")
+    col_types, col_format = st.columns(2)
+    with col_types:
+        export_types = st.multiselect("Types", ["Income", "Expense", "Loan", "EMI"], key="export_types")
+    with col_format:
+        export_format = st.selectbox("Format", list(mykhata_io.EXPORT_FORMATS), format_func=str.upper, key="export_format")
+
+    extension, mime = mykhata_io.EXPORT_FORMATS[export_format]
+    def export_file():
+        # Runs on click, off the script thread. Encoding spools chunks to disk, but Streamlit's media file
+        # manager then reads the whole file into memory to serve it; the mykhata_io command line streams instead
+        get_writer().wait("transactions", effective_username)
+        return mykhata_io.export_to_tempfile(mykhata_io.export_transactions(
+            get_storage(), effective_username, export_format, start_date, end_date, export_types or None))
+
+    st.download_button("⬇️ Download Transactions", data=export_file, file_name=f"mykhata_{effective_username}.{extension}",
+                       mime=mime, on_click="ignore", key="export_download_button")
+
 # --- Main App Logic ---
 def main_app():
     # Get navigation parameter from URL query string
     nav = st.query_params.get("nav", "Home") # Default to Home if not present
     st.session_state.active_page = nav
+    metrics.annotate(page=nav, user=st.session_state.username)
 
-    # Ensure data is loaded when app starts or after login
-    if st.session_state.logged_in and (st.session_state.transaction_df is None or st.session_state.category_df is None or st.session_state.transaction_df.empty):
-        st.session_state.effective_username = st.session_state.parent_username if st.session_state.user_role == "Sub" else st.session_state.username
-        st.session_state.transaction_df = load_transactions(st.session_state.effective_username)
-        st.session_state.category_df = load_categories(st.session_state.username)
-
+    # Resolve the session's handle once after login; the frames themselves are loaded by the pages that need them
+    if st.session_state.logged_in and not st.session_state.get("effective_username"):
+        st.session_state.effective_username = resolve_effective_username(st.session_state.username)
+    show_failed_writes()
 
     if st.session_state.active_page == "Home":
         dashboard()
@@ -1112,14 +827,44 @@ def main_app():
         report()
     elif st.session_state.active_page == "Profile":
         profile()
+
+    if st.session_state.username in ADMIN_USERS:
+        debug_panel()
     
     bottom_navbar()
 
+def debug_panel():
+    """Timings and I/O of this session's previous run, and span statistics over the recent runs of the process."""
+    with st.expander("🛠️ Performance"):
+        last_run = st.session_state.get("last_run_metrics")
+        if last_run is not None:
+            st.caption(f"Previous run ({last_run.get('page', '-')}): {last_run['ms']:,.1f} ms, "
+                       f"{last_run['counters'].get('bytes_sent', 0):,} bytes sent")
+            st.dataframe(pd.DataFrame({"Counter": list(metrics.COUNTERS),
+                                       "Value": [last_run["counters"].get(counter, 0) for counter in metrics.COUNTERS]}),
+                         hide_index=True)
+            st.dataframe(pd.DataFrame([{"Span": path, **entry} for path, entry in last_run["spans"].items()]), hide_index=True)
+        st.caption("Spans over the recent script runs of this process")
+        st.dataframe(pd.DataFrame(metrics.span_summary("script")), hide_index=True)
+        # Walks every cached row, so it is only measured on request
+        if st.button("Measure typed-schema memory savings", key="debug_schema_report"):
+            st.dataframe(pd.DataFrame.from_dict(storage.schema_memory_report(), orient="index"))
+        st.json({"process_io": metrics.totals(), "frame_cache": storage.frame_cache.stats(),
+                 "aggregates": get_aggregator().stats(), "runs": mykhata_bootstrap.timing_report()}, expanded=False)
+
 # --- Launch App ---
+get_storage()
+
 if not st.session_state.logged_in:
     if st.session_state.show_signup:
+        metrics.annotate(page="Signup")
         signup_page()
     else:
+        metrics.annotate(page="Login")
         login_page()
 else:
     main_app()
+
+run_record = metrics.end_run()
+mykhata_bootstrap.finish_run(run_started, run_record["counters"].get("bytes_sent", 0) if run_record else 0)
+st.session_state.last_run_metrics = run_record
@@ -0,0 +1,140 @@
+# Two-replica check of the shared storage mode.
+# Two processes run the storage layer with MYKHATA_SHARED_STORAGE=1 against one scratch directory of
+# synthetic data, as two Streamlit replicas behind a load balancer would. Both warm every cache the
+# pages use, then write to the same users at once: transactions, custom categories and new users.
+# Afterwards each replica's cached view must match a fresh read of the shared files and no write may
+# be lost; finally one replica writes again and the other must find it by polling the versions.
+# Exits non-zero if anything disagrees.
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+os.environ["MYKHATA_SHARED_STORAGE"] = "1" # Read when mykhata_storage is imported, here and in each replica
+
+import mykhata_aggregates as aggregates
+import mykhata_datagen
+import mykhata_storage as storage
+
+REPLICAS = 2
+BARRIER_TIMEOUT = 120 # Seconds a replica waits for the other before giving up
+
+def _writes_for(owners, writes, owner):
+    """Transactions one replica writes for owner: its steps go round the owners in turn."""
+    return sum(1 for step in range(writes) if owners[step % len(owners)] == owner)
+
+def _check_view(store, owners, writes, base_rows):
+    """Compares what this replica serves for each owner with a fresh read; returns the mismatches."""
+    problems = []
+    for owner in owners:
+        fresh = store.scan_transactions(owner) # Straight from storage, past every cache
+        cached = store.load_transactions(owner)
+        expected = base_rows[owner] + REPLICAS * _writes_for(owners, writes, owner)
+        if len(fresh) != expected:
+            problems.append(f"{owner}: {len(fresh)} rows stored, expected {expected} (lost writes)")
+        if len(cached) != len(fresh) or round(cached['Amount'].sum(), 2) != round(fresh['Amount'].sum(), 2):
+            problems.append(f"{owner}: cached frame has {len(cached)} rows, storage has {len(fresh)}")
+        ledger, rebuilt = store.ledger(owner), aggregates.ledger_from_frame(fresh)
+        if any(abs(ledger[key] - rebuilt[key]) > 0.005 for key in rebuilt):
+            problems.append(f"{owner}: ledger {ledger} differs from the rows' totals {rebuilt}")
+        rollup = store.rollup_frame(owner, "Y")
+        if int(rollup['Count'].sum()) != len(fresh):
+            problems.append(f"{owner}: yearly rollup counts {int(rollup['Count'].sum())} rows, storage has {len(fresh)}")
+        names = store.category_index(owner).get("Expense", {"names": frozenset()})["names"]
+        missing = [f"Replica{index}-{step}" for index in range(REPLICAS) for step in range(0, writes, 10)
+                   if owners[step % len(owners)] == owner and f"Replica{index}-{step}" not in names]
+        if missing:
+            problems.append(f"{owner}: categories missing from the index: {', '.join(missing)}")
+    for index in range(REPLICAS):
+        for step in range(0, writes, 10):
+            if store.get_user(f"Replica{index}User{step}") is None:
+                problems.append(f"user Replica{index}User{step} is missing")
+    return problems
+
+def replica(index, directory, backend, owners, writes, base_rows, barrier, results):
+    """One replica: warm up, write concurrently with the other, then check its view of the shared data."""
+    os.chdir(directory) # Storage paths are relative to the working directory
+    store = storage.open_storage(backend)
+    writer = storage.WriteQueue(store)
+    for owner in owners:
+        store.load_transactions(owner)
+        store.ledger(owner)
+        store.rollup_frame(owner, "M")
+        store.category_index(owner)
+        store.get_user(owner)
+    barrier.wait(BARRIER_TIMEOUT)
+
+    futures = []
+    for step in range(writes):
+        owner = owners[step % len(owners)]
+        futures.append(writer.submit_transaction({"Username": owner, "Date": "2024-12-31", "Type": "Expense", "Category": "Food",
+                                                  "Amount": float(index * 100_000 + step + 1), "Note": f"replica {index} write {step}"}))
+        if step % 10 == 0:
+            futures.append(writer.submit_category(owner, "Expense", f"Replica{index}-{step}"))
+            futures.append(writer.submit_user({"Username": f"Replica{index}User{step}", "PasswordHash": "", "Name": f"Replica {index}",
+                                               "Mobile": "", "Email": "", "Role": "Main", "ParentUsername": None}))
+    for future in futures:
+        future.result()
+    barrier.wait(BARRIER_TIMEOUT) # Both replicas' writes are durable
+
+    problems = _check_view(store, owners, writes, base_rows)
+    barrier.wait(BARRIER_TIMEOUT)
+
+    # Polling: a write by replica 0 must show up in replica 1's drop_stale, and in what it serves
+    owner = owners[0]
+    rows_before = len(store.load_transactions(owner))
+    if index == 0:
+        writer.submit_transaction({"Username": owner, "Date": "2024-12-31", "Type": "Income", "Category": "Salary",
+                                   "Amount": 1.0, "Note": "poll check"}).result()
+    barrier.wait(BARRIER_TIMEOUT)
+    if index == 1:
+        changed = store.drop_stale()
+        if owner not in changed:
+            problems.append(f"polling did not report {owner}, changed by the other replica (got {sorted(changed)})")
+        if len(store.load_transactions(owner)) != rows_before + 1:
+            problems.append(f"{owner}: the other replica's last write is not served after polling")
+    writer.close()
+    results.put({"replica": index, "problems": problems})
+
+def run(backend="csv", users=3, transactions=2000, writes=100):
+    """Generates data, runs the replicas and returns their reports."""
+    directory = tempfile.mkdtemp(prefix="mykhata_replicas_")
+    try:
+        owners = mykhata_datagen.generate(directory, users=users, transactions=transactions)
+        base_rows = {owner: transactions for owner in owners}
+        context = multiprocessing.get_context("spawn") # Fresh interpreters: no state shared but the files
+        barrier, results = context.Barrier(REPLICAS), context.Queue()
+        processes = [context.Process(target=replica, args=(index, directory, backend, owners, writes, base_rows, barrier, results),
+                                     name=f"mykhata-replica-{index}") for index in range(REPLICAS)]
+        for process in processes:
+            process.start()
+        reports = []
+        for process in processes:
+            process.join(BARRIER_TIMEOUT * 4)
+        while not results.empty() and len(reports) < REPLICAS:
+            reports.append(results.get())
+        for process in processes:
+            if process.exitcode != 0:
+                reports.append({"replica": process.name, "problems": [f"exited with code {process.exitcode}"]})
+        return sorted(reports, key=lambda report: str(report["replica"]))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run two MyKhata replicas against one data directory and check they agree.")
+    parser.add_argument("--backend", default=storage.STORAGE_BACKEND, choices=sorted(storage.BACKENDS))
+    parser.add_argument("--users", type=int, default=3, help="Main users both replicas write to")
+    parser.add_argument("--transactions", type=int, default=2000, help="Generated transactions per user")
+    parser.add_argument("--writes", type=int, default=100, help="Transactions each replica writes")
+    args = parser.parse_args()
+
+    reports = run(args.backend, args.users, args.transactions, args.writes)
+    failed = len(reports) < REPLICAS or any(report["problems"] for report in reports)
+    for report in reports:
+        status = f"{len(report['problems'])} problem(s)" if report["problems"] else "ok"
+        print(f"replica {report['replica']}: {status}")
+        for problem in report["problems"]:
+            print(f"  {problem}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,153 @@
+# Charts for the Wallet and Reports pages.
+# Imported only when one of those pages is first shown, so altair stays out of the cold start and
+# out of every rerun of the other pages. Report charts are held to a point budget: the period is
+# coarsened first, then line series are thinned with LTTB and minor bar categories folded together,
+# so the spec sent to the browser stays bounded however long the history is. The app caches the
+# built specs (chart_spec), so a chart is only rebuilt when its data changes.
+import os
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import mykhata_metrics as metrics
+
+# Report time filter -> rollup granularity
+TIME_FILTERS = {"Daily": "D", "Weekly": "W", "Monthly": "M", "Yearly": "Y"}
+
+# Rollup granularity -> (label, axis date format, axis title)
+PERIOD_AXES = {
+    "D": ("Daily", '%Y-%m-%d', 'Date'),
+    "W": ("Weekly", '%Y-%m-%d', 'Week of'),
+    "M": ("Monthly", '%Y-%m', 'Month'),
+    "Y": ("Yearly", '%Y', 'Year'),
+}
+
+POINT_BUDGET = int(os.environ.get("MYKHATA_CHART_POINT_BUDGET", "500")) # Most marks one report chart may draw
+ESCALATION = ["D", "W", "M", "Y"] # Granularities a chart is coarsened through, in order, to meet the budget
+BAR_MIN_CATEGORIES = 8 # Categories a stacked bar chart keeps apart, at least, when minor ones are folded
+
+# Streamlit themes the charts itself; the default altair theme would only pin a 300px view into every
+# spec (st.altair_chart switches to "none" while converting, for the same reason)
+alt.theme.enable("none")
+
+def fit_to_budget(load, granularity, budget=POINT_BUDGET, coarsest="Y", marks=len):
+    """Returns (granularity, data) for the requested granularity, or the first coarser one in ESCALATION,
+    up to coarsest, whose data fits the budget. load(granularity) returns a chart's data and marks(data)
+    how many marks the chart must draw for it (one per row by default).
+
+    Line charts stop at monthly (coarsest="M") and are thinned by LTTB past it; bars, which cannot be
+    thinned, go on to yearly and fold minor categories (see bar_marks).
+    """
+    start = ESCALATION.index(granularity)
+    steps = ESCALATION[start:max(start, ESCALATION.index(coarsest)) + 1]
+    for step in steps:
+        data = load(step)
+        if marks(data) <= budget:
+            break
+    return step, data
+
+def bar_marks(data, period='Period', category='Category'):
+    """Bar segments a stacked bar chart still draws once fold_categories keeps only BAR_MIN_CATEGORIES apart."""
+    return data[period].nunique() * min(data[category].nunique(), BAR_MIN_CATEGORIES + 1)
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: the indices of `threshold` points of (x, y) that best keep the line's shape.
+
+    x must be sorted. The first and last points are always kept; from each bucket in between, the point
+    forming the largest triangle with the point kept before it and the average of the next bucket wins.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64) # threshold - 2 buckets between the end points
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return kept
+
+def downsample_lines(data, budget=POINT_BUDGET, x='Period', y='Amount', series='Type'):
+    """Thins each series of a line chart with LTTB so together they draw at most budget points."""
+    if len(data) <= budget:
+        return data
+    share = max(3, budget // data[series].nunique())
+    parts = []
+    for _, line in data.sort_values(x, kind='stable').groupby(series, sort=False, observed=True):
+        kept = lttb(line[x].to_numpy(dtype='datetime64[ns]').astype(np.int64), line[y].to_numpy(), share)
+        parts.append(line.iloc[kept])
+    return pd.concat(parts, ignore_index=True)
+
+def fold_categories(data, budget=POINT_BUDGET, period='Period', category='Category', amount='Amount'):
+    """Keeps the largest categories of a stacked bar chart and sums the rest into "Other", so at most
+    budget bar segments are drawn. At least BAR_MIN_CATEGORIES are kept apart, as bar_marks assumes:
+    past that, fit_to_budget has already coarsened the periods as far as it could."""
+    if len(data) <= budget:
+        return data
+    periods = data[period].nunique()
+    keep = max(BAR_MIN_CATEGORIES, budget // periods - 1) # One segment per period is left for "Other"
+    if data[category].nunique() <= keep + 1: # Folding would only rename the last category
+        return data
+    ranked = data.groupby(category, observed=True)[amount].sum().sort_values(ascending=False).index[:keep]
+    data = data.assign(**{category: data[category].where(data[category].isin(ranked), "Other")})
+    return data.groupby([period, category], as_index=False, observed=True)[amount].sum()
+
+@metrics.timed()
+def expense_breakdown_chart(expense_by_category):
+    """Pie of expense Amount per Category, labelled with the amounts."""
+    chart = alt.Chart(expense_by_category).mark_arc(outerRadius=120).encode(
+        theta=alt.Theta(field="Amount", type="quantitative"),
+        color=alt.Color(field="Category", type="nominal", title="Category"),
+        order=alt.Order("Amount", sort="descending"),
+        tooltip=["Category", alt.Tooltip("Amount", format=",.2f")]
+    ).properties(
+        title="Expense Distribution"
+    ).interactive()
+
+    text = alt.Chart(expense_by_category).mark_text(radius=140).encode(
+        theta=alt.Theta(field="Amount", type="quantitative"),
+        text=alt.Text("Amount", format=",.2f"),
+        order=alt.Order("Amount", sort="descending"),
+        color=alt.value("black") # Set the color of the labels to black
+    )
+    return chart + text
+
+@metrics.timed()
+def trend_chart(data, granularity, title, budget=POINT_BUDGET):
+    """Line per Type of Amount over Period, thinned to the point budget."""
+    label, period_format, period_title = PERIOD_AXES[granularity]
+    return alt.Chart(downsample_lines(data, budget)).mark_line(point=True).encode(
+        x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
+        y=alt.Y('Amount', title='Amount (₹)'),
+        color=alt.Color('Type', legend=alt.Legend(title="Transaction Type")),
+        tooltip=[alt.Tooltip('Period', format=period_format), 'Type', alt.Tooltip('Amount', format=",.2f")]
+    ).properties(
+        title=f'{title} ({label})'
+    ).interactive()
+
+@metrics.timed()
+def category_spending_chart(data, granularity, budget=POINT_BUDGET):
+    """Bars of spending per Period, stacked by Category, with minor categories folded to fit the point budget."""
+    label, period_format, period_title = PERIOD_AXES[granularity]
+    return alt.Chart(fold_categories(data, budget)).mark_bar().encode(
+        x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
+        y=alt.Y('Amount', title='Total Spending (₹)'),
+        color=alt.Color('Category', title="Category"),
+        tooltip=[alt.Tooltip('Period', format=period_format), 'Category', alt.Tooltip('Amount', format=",.2f")]
+    ).properties(
+        title=f'Spending by Category ({label})'
+    ).interactive()
+
+@metrics.timed()
+def chart_spec(chart):
+    """The chart's Vega-Lite spec with its data inline: what st.vega_lite_chart draws, and what the app caches."""
+    return chart.to_dict()
@@ -0,0 +1,1759 @@
+# Storage layer for MyKhata.
+# The Streamlit script re-executes on every interaction, but this module is imported once per
+# server process, so anything kept at module level here is shared by every session.
+import atexit
+import bisect
+import csv
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+try: # Optional: only the parquet backend needs pyarrow
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs as pafs
+except ImportError:
+    pa = None
+
+try: # POSIX only: the shared storage mode locks files with it
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import mykhata_aggregates as aggregates
+import mykhata_metrics as metrics # I/O counters for the run in progress
+
+# --- File Paths ---
+DATA_FILE = "mykhata_data.csv" # Legacy single-file layout, migrated into DATA_DIR on startup
+DATA_DIR = "mykhata_data" # One shard per effective username: <key>.csv, its <key>.journal, <key>.ledger.json and <key>.index.json
+DATA_JOURNAL_FILE = "mykhata_data.journal" # Legacy journal of DATA_FILE, folded in before migration
+USERS_FILE = "users_public_details.csv"
+CATEGORY_FILE = "category_memory.csv"
+SQLITE_FILE = "mykhata.db"
+PARQUET_DIR = "mykhata_parquet" # <user>/Year=<yyyy or __null__>/data.parquet, plus <user>.journal and <user>.ledger.json
+LOCK_DIR = "mykhata_locks" # Shared storage mode: <name>.lock files taken with fcntl around writes
+VERSION_DIR = "mykhata_versions" # Shared storage mode: <kind>.<key> files holding a write counter
+
+TRANSACTION_COLUMNS = ["Username", "Date", "Type", "Category", "Amount", "Note"]
+USER_COLUMNS = ["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"]
+CATEGORY_COLUMNS = ["Username", "CategoryType", "CategoryName"]
+
+# --- Storage Settings ---
+# "csv" keeps the plain files above (fine for small installs); "sqlite" stores everything in SQLITE_FILE;
+# "parquet" keeps transactions in columnar files under PARQUET_DIR (needs pyarrow).
+STORAGE_BACKEND = os.environ.get("MYKHATA_STORAGE", "csv")
+
+# Upper bound on memory held by the process-wide frame cache
+CACHE_MAX_BYTES = int(os.environ.get("MYKHATA_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Frames no session has read for this many seconds are dropped, and reloaded if asked for again; 0 keeps them
+CACHE_IDLE_TTL = float(os.environ.get("MYKHATA_CACHE_IDLE_TTL", "900"))
+
+# "always" fsyncs every append, "interval" fsyncs at most once per JOURNAL_FSYNC_INTERVAL seconds,
+# "never" leaves flushing to the OS.
+JOURNAL_FSYNC = os.environ.get("MYKHATA_JOURNAL_FSYNC", "always")
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("MYKHATA_JOURNAL_FSYNC_INTERVAL", "1.0"))
+
+# Rows per block of a CSV shard's date index: a date-range read parses only the blocks that can hold its dates
+CSV_INDEX_BLOCK_ROWS = int(os.environ.get("MYKHATA_CSV_INDEX_BLOCK_ROWS", "2000"))
+
+# With MYKHATA_SHARED_STORAGE=1, several server processes (replicas behind a load balancer on one host)
+# can serve one data directory; every one of them must run in this mode. See "Shared Storage" below.
+SHARED_STORAGE = os.environ.get("MYKHATA_SHARED_STORAGE", "0") == "1"
+SHARED_POLL_INTERVAL = float(os.environ.get("MYKHATA_SHARED_POLL_INTERVAL", "2.0")) # Seconds between version polls
+
+_journal_state = {"last_fsync": 0.0}
+
+logger = logging.getLogger(__name__)
+
+# --- Shared Storage ---
+# Replicas serialise their writes with fcntl locks under LOCK_DIR: one per owner's transactions, one for
+# the users file, one for the category file, one for startup (migration and journal folds). The file
+# backends also keep a monotonically increasing version per (kind, key) under VERSION_DIR, bumped after
+# every write while its lock is held; data_version reads it, so a replica learns of another's writes
+# with one small read and, since every cache is validated against data_version, drops only what went
+# stale. SQLite keeps the same counters in its data_versions table.
+
+_held_locks = threading.local() # Names of the interprocess locks this thread holds; taking one again is a no-op
+
+@contextmanager
+def interprocess_lock(name):
+    """Holds the exclusive lock LOCK_DIR/<name>.lock in shared storage mode; does nothing otherwise.
+
+    Reentrant per thread. Threads of one process exclude each other too, since each opens its own handle.
+    """
+    held = _held_locks.__dict__.setdefault("names", set())
+    if not SHARED_STORAGE or name in held:
+        yield
+        return
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LOCK_DIR, f"{name}.lock"), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        held.add(name)
+        try:
+            yield
+        finally:
+            held.discard(name)
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def read_version(kind, key):
+    """The write counter of (kind, key) under VERSION_DIR; 0 before the first write."""
+    try:
+        with open(os.path.join(VERSION_DIR, f"{kind}.{key}"), encoding="utf-8") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def bump_version(kind, key):
+    """Moves the write counter of (kind, key) forward by one. Call with the lock guarding that data held."""
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    path = os.path.join(VERSION_DIR, f"{kind}.{key}")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(str(read_version(kind, key) + 1))
+    os.replace(f"{path}.tmp", path) # Readers see the old count or the new one, never a partial write
+
+def _file_version(path):
+    """Version token of a file every user shares (USERS_FILE, CATEGORY_FILE): its stat, plus its write
+    counter in shared mode, since another replica's rewrite can keep the size within one mtime tick."""
+    version = _stat_version(path)
+    return version + (read_version("file", os.path.basename(path)),) if SHARED_STORAGE else version
+
+# --- Journal Helpers ---
+
+def _sync_journal(f):
+    """Flushes a journal append to disk according to JOURNAL_FSYNC."""
+    f.flush()
+    if JOURNAL_FSYNC == "always":
+        os.fsync(f.fileno())
+    elif JOURNAL_FSYNC == "interval":
+        now = time.monotonic()
+        if now - _journal_state["last_fsync"] >= JOURNAL_FSYNC_INTERVAL:
+            os.fsync(f.fileno())
+            _journal_state["last_fsync"] = now
+
+def append_journal(record, journal_file):
+    """Appends a single transaction record to a journal without touching existing rows."""
+    with open(journal_file, "a", newline="", encoding="utf-8") as f:
+        start = f.tell()
+        csv.writer(f, lineterminator="\n").writerow(["" if pd.isna(record[col]) else record[col] for col in TRANSACTION_COLUMNS])
+        _sync_journal(f)
+        metrics.count("bytes_written", f.tell() - start)
+
+def append_journal_rows(rows, journal_file):
+    """Appends a batch of transaction rows to a journal in one write and one sync."""
+    with open(journal_file, "a", newline="", encoding="utf-8") as f:
+        start = f.tell()
+        rows.reindex(columns=TRANSACTION_COLUMNS).to_csv(f, header=False, index=False, lineterminator="\n")
+        _sync_journal(f)
+        metrics.count("bytes_written", f.tell() - start)
+
+def read_journal(journal_file):
+    """Replays complete records from a journal file, skipping a record torn by a crash mid-append."""
+    if not os.path.exists(journal_file):
+        return pd.DataFrame(columns=TRANSACTION_COLUMNS)
+    with open(journal_file, "r", newline="", encoding="utf-8") as f:
+        text = f.read()
+    metrics.count("bytes_read", len(text.encode("utf-8")))
+    if text and not text.endswith("\n"):
+        text = text[:text.rfind("\n") + 1]
+    rows = [row for row in csv.reader(io.StringIO(text)) if len(row) == len(TRANSACTION_COLUMNS)]
+    df = pd.DataFrame(rows, columns=TRANSACTION_COLUMNS)
+    df = df.mask(df == "") # Empty fields read back as missing, as pd.read_csv does
+    df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
+    return df
+
+def _apply_checkpoint(data_file, checkpoint_file):
+    """Appends a frozen journal to its data file. Safe to repeat: the data file is first cut back to its pre-checkpoint size."""
+    base_size = int(checkpoint_file.rsplit(".", 2)[1])
+    journal = read_journal(checkpoint_file)
+    header = pd.read_csv(data_file, nrows=0).columns
+    with open(data_file, "r+", newline="", encoding="utf-8") as f:
+        f.truncate(base_size)
+        f.seek(base_size)
+        journal.reindex(columns=header).to_csv(f, header=False, index=False, lineterminator="\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(checkpoint_file)
+
+def replay_journal(data_file, journal_file):
+    """Folds a journal into its data file so each process starts from a compact base file.
+
+    Returns True if any rows were moved.
+    """
+    if not os.path.exists(data_file):
+        pd.DataFrame(columns=TRANSACTION_COLUMNS).to_csv(data_file, index=False)
+    # Finish any checkpoint that was interrupted by a crash before starting a new one
+    checkpoints = glob.glob(f"{glob.escape(journal_file)}.*.ckpt")
+    for checkpoint_file in checkpoints:
+        _apply_checkpoint(data_file, checkpoint_file)
+    if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+        # Freezing the journal under a name that records the base size makes the fold idempotent
+        checkpoint_file = f"{journal_file}.{os.path.getsize(data_file)}.ckpt"
+        os.replace(journal_file, checkpoint_file)
+        _apply_checkpoint(data_file, checkpoint_file)
+        return True
+    return bool(checkpoints)
+
+# --- Sharding ---
+
+def shard_key(effective_username):
+    """Maps an effective username to a filesystem-safe shard name."""
+    if re.fullmatch(r"[A-Za-z0-9_-]+", str(effective_username)):
+        return str(effective_username)
+    return "u_" + hashlib.sha1(str(effective_username).encode()).hexdigest()[:16]
+
+def shard_paths(effective_username):
+    """Returns the (data file, journal file) pair holding an effective username's transactions."""
+    base = os.path.join(DATA_DIR, shard_key(effective_username))
+    return f"{base}.csv", f"{base}.journal"
+
+def _ledger_path(effective_username):
+    """The running-totals file kept next to an effective username's shard."""
+    return os.path.join(DATA_DIR, f"{shard_key(effective_username)}.ledger.json")
+
+# --- CSV Shard Date Index ---
+# A shard's data file only ever grows by appended rows (the journal fold), so <key>.index.json can map
+# blocks of CSV_INDEX_BLOCK_ROWS rows to their byte range and date range. A date-range read parses only
+# the blocks that can hold its dates; rows appended since are indexed on the next read. The index
+# records the bytes it ends with, so a file rewritten or cut back is indexed afresh.
+
+_INDEX_TAIL_BYTES = 64
+
+def _index_path(effective_username):
+    """The date index kept next to an effective username's shard."""
+    return os.path.join(DATA_DIR, f"{shard_key(effective_username)}.index.json")
+
+def _index_blocks(f, offset, header):
+    """Indexes the complete rows of an open binary data file from offset on.
+
+    Returns ([[start, end, min date, max date], ...], offset after the last complete row). A block's
+    dates are None when one of them does not parse, so it is always read.
+    """
+    f.seek(offset)
+    bounds, rows, start, in_quotes = [], 0, offset, False
+    end = offset
+    for line in f:
+        if line.count(b'"') % 2: # A quoted field spans lines: the row ends where the quotes close
+            in_quotes = not in_quotes
+        if not line.endswith(b"\n"): # Torn last line, still being written
+            break
+        end += len(line)
+        if in_quotes or not line.strip():
+            continue
+        rows += 1
+        if rows == CSV_INDEX_BLOCK_ROWS:
+            bounds.append((start, end))
+            start, rows = end, 0
+    if rows:
+        bounds.append((start, end))
+    if not bounds:
+        return [], end
+    f.seek(offset)
+    data = f.read(end - offset)
+    metrics.count("bytes_read", len(data))
+    dates = pd.read_csv(io.BytesIO(data), names=header, header=None, usecols=['Date'], dtype=str)['Date']
+    dates = pd.to_datetime(dates, format='ISO8601', errors='coerce')
+    blocks, first = [], 0
+    for block_start, block_end in bounds:
+        count = CSV_INDEX_BLOCK_ROWS if block_end != end else len(dates) - first
+        block = dates.iloc[first:first + count]
+        first += count
+        usable = not block.isna().any()
+        blocks.append([block_start, block_end, block.min().strftime('%Y-%m-%d') if usable else None,
+                       block.max().strftime('%Y-%m-%d') if usable else None])
+    return blocks, end
+
+def _tail_of(f, end):
+    f.seek(max(0, end - _INDEX_TAIL_BYTES))
+    return f.read(min(end, _INDEX_TAIL_BYTES)).hex()
+
+def read_date_index(data_file, index_file):
+    """Returns the shard's date index, brought up to date with the data file (and saved if it changed).
+
+    {"header": column names, "blocks": [[start, end, min date, max date], ...], "size": bytes indexed, "tail": ...}
+    """
+    try:
+        with open(index_file, encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = None
+    with open(data_file, "rb") as f:
+        if index is not None and (index["size"] > os.fstat(f.fileno()).st_size or _tail_of(f, index["size"]) != index["tail"]):
+            index = None # Rewritten or cut back since it was indexed
+        if index is None:
+            f.seek(0)
+            header_line = f.readline()
+            header = next(csv.reader([header_line.decode("utf-8")]), [])
+            index = {"header": header, "blocks": [], "size": len(header_line)}
+        if os.fstat(f.fileno()).st_size == index["size"]:
+            return index
+        blocks, end = _index_blocks(f, index["size"], index["header"])
+        if end == index["size"]:
+            return index
+        index["blocks"] += blocks
+        index["size"], index["tail"] = end, _tail_of(f, end)
+    temp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(temp_file, index_file)
+    return index
+
+def read_indexed_range(data_file, index, usecols, start=None, end=None):
+    """Parses only the data file's blocks whose dates may fall in [start, end], plus rows not yet indexed."""
+    start = None if start is None else start.strftime('%Y-%m-%d')
+    end = None if end is None else end.strftime('%Y-%m-%d')
+    ranges = []
+    for block_start, block_end, first, last in index["blocks"]:
+        if first is not None and ((start is not None and last < start) or (end is not None and first > end)):
+            continue
+        if ranges and ranges[-1][1] == block_start: # Adjacent blocks are read as one range
+            ranges[-1][1] = block_end
+        else:
+            ranges.append([block_start, block_end])
+    frames = []
+    with open(data_file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > index["size"]:
+            ranges.append([index["size"], size])
+        for range_start, range_end in ranges:
+            f.seek(range_start)
+            data = f.read(range_end - range_start)
+            metrics.count("bytes_read", len(data))
+            frames.append(pd.read_csv(io.BytesIO(data), names=index["header"], header=None, usecols=usecols))
+    if not frames:
+        return pd.DataFrame(columns=[col for col in index["header"] if usecols(col)])
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def migrate_to_shards():
+    """One-shot split of the legacy DATA_FILE into per-user shards under DATA_DIR."""
+    if not os.path.exists(DATA_FILE):
+        return
+    replay_journal(DATA_FILE, DATA_JOURNAL_FILE)
+    df = pd.read_csv(DATA_FILE)
+    if 'Username' not in df.columns:
+        df['Username'] = ''
+    staging_dir = f"{DATA_DIR}.migrating"
+    os.makedirs(staging_dir, exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for effective_username, rows in df.groupby('Username', sort=False):
+        data_file, _ = shard_paths(effective_username)
+        staged_file = os.path.join(staging_dir, os.path.basename(data_file))
+        rows.reindex(columns=TRANSACTION_COLUMNS).to_csv(staged_file, index=False)
+        # A shard already in place was moved there by an earlier, interrupted run of this migration
+        if not os.path.exists(data_file):
+            os.replace(staged_file, data_file)
+    for leftover in glob.glob(os.path.join(glob.escape(staging_dir), "*")):
+        os.remove(leftover)
+    os.rmdir(staging_dir)
+    os.replace(DATA_FILE, f"{DATA_FILE}.migrated")
+
+def effective_username_of(user):
+    """Resolves a user row to the username owning its data; sub-users share their parent's shard."""
+    if user["Role"] == "Sub" and pd.notna(user["ParentUsername"]):
+        return user["ParentUsername"]
+    return user["Username"]
+
+# --- Transaction Schema ---
+# Applied once when a frame is loaded, so pages never re-coerce columns on a rerun.
+CATEGORICAL_COLUMNS = ["Username", "Type", "Category"]
+
+def apply_transaction_schema(df, columns=TRANSACTION_COLUMNS):
+    """Returns df's columns with Date as datetime64, Amount as float64 and the low-cardinality text columns as categoricals."""
+    df = df.reindex(columns=columns)
+    typed = {}
+    if "Date" in df.columns:
+        typed["Date"] = pd.to_datetime(df['Date'], format='ISO8601', errors='coerce')
+    if "Amount" in df.columns:
+        typed["Amount"] = pd.to_numeric(df['Amount'], errors='coerce').fillna(0).astype('float64')
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            typed[col] = df[col].astype('category')
+    return df.assign(**typed)
+
+def append_typed_rows(frame, rows):
+    """Appends written rows to a typed frame: only the new rows are typed, and categoricals keep their codes."""
+    rows = apply_transaction_schema(rows, list(frame.columns))
+    frame_cols, row_cols = {}, {}
+    for col in CATEGORICAL_COLUMNS:
+        if col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype):
+            # concat only stays categorical when both sides share the categories; adding the new
+            # ones to the cached frame extends its categories without re-encoding its values
+            new = rows[col].cat.categories.difference(frame[col].cat.categories)
+            frame_cols[col] = frame[col].cat.add_categories(new) if len(new) else frame[col]
+            row_cols[col] = rows[col].astype(frame_cols[col].dtype)
+    return pd.concat([frame.assign(**frame_cols), rows.assign(**row_cols)], ignore_index=True)
+
+def _append_to_window(since, frame, rows):
+    """append_typed_rows for a date window: rows dated before since are left out."""
+    return append_typed_rows(frame, rows[pd.to_datetime(rows['Date'], format='ISO8601', errors='coerce') >= since])
+
+def _typed_transactions(owner, raw):
+    """Applies the schema to a freshly read frame."""
+    typed = apply_transaction_schema(raw)
+    logger.info("Typed %d transactions for %s", len(typed), owner)
+    return typed
+
+def _untyped(frame):
+    """A typed frame with its dates and categoricals back as text, as it was read from storage."""
+    text = {col: frame[col].astype(str) for col in CATEGORICAL_COLUMNS if col in frame.columns}
+    if "Date" in frame.columns:
+        text["Date"] = frame['Date'].dt.strftime('%Y-%m-%d')
+    return frame.assign(**text)
+
+def schema_memory_report():
+    """Memory held by each cached transaction frame (a full history, or a window "owner since date"),
+    typed and as it would be untyped.
+
+    Every session of a household references the same cached frame, so this is also what each
+    session saves. Measured when asked for, since it walks every cached row.
+    """
+    report = {}
+    for key, version in frame_cache.entries():
+        frame = frame_cache.peek(key, version) if key[1:2] == ("transactions",) else None
+        if frame is None:
+            continue
+        typed_bytes = int(frame.memory_usage(deep=True).sum())
+        raw_bytes = int(_untyped(frame).memory_usage(deep=True).sum())
+        saved = raw_bytes - typed_bytes
+        report[key[2] if len(key) == 3 else f"{key[2]} since {key[3]}"] = {"raw_bytes": raw_bytes, "typed_bytes": typed_bytes, "saved_bytes": saved,
+                          "saved_pct": round(100.0 * saved / raw_bytes, 1) if raw_bytes else 0.0}
+    return report
+
+# --- Parquet Layout ---
+PARQUET_ROW_GROUP_ROWS = 16384 # Smaller groups let date filters skip more of a year file
+PARQUET_NULL_YEAR = "__null__" # Partition for rows whose date does not parse; only unbounded reads see them
+
+if pa is not None:
+    # Username is implied by the directory and Year by the partition, so neither is stored per row
+    PARQUET_SCHEMA = pa.schema([
+        ("Date", pa.date32()),
+        ("Type", pa.dictionary(pa.int32(), pa.string())),
+        ("Category", pa.dictionary(pa.int32(), pa.string())),
+        ("Amount", pa.float64()),
+        ("Note", pa.string()),
+    ])
+
+# --- Category Index ---
+# Built-in categories every user has, frozen at import. A user's index adds their custom categories:
+# index[CategoryType] = {"names": frozenset of names, "sorted": tuple of names in dropdown order}.
+# Entries are replaced, never mutated, so a session can keep using the one it was handed.
+
+DEFAULT_CATEGORIES = {
+    "Income": frozenset(["Salary", "Freelance", "Investment", "Gift", "Other Income"]),
+    "Expense": frozenset(["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Health", "Education", "Other Expense"]),
+    "Loan": frozenset(["Personal Loan", "Home Loan", "Car Loan", "Student Loan", "Other Loan"]),
+    "EMI": frozenset(["Loan Repayment", "Credit Card Bill", "Other EMI"]),
+}
+
+_DEFAULT_INDEX = {category_type: {"names": names, "sorted": tuple(sorted(names))}
+                  for category_type, names in DEFAULT_CATEGORIES.items()}
+
+def category_index_from_frame(df):
+    """Builds a user's category index from their custom categories (CATEGORY_COLUMNS)."""
+    index = dict(_DEFAULT_INDEX)
+    for category_type, names in df.groupby('CategoryType')['CategoryName']:
+        merged = index.get(category_type, {"names": frozenset()})["names"] | set(names.dropna().astype(str))
+        index[category_type] = {"names": merged, "sorted": tuple(sorted(merged))}
+    return index
+
+def add_to_category_index(index, category_type, category_name):
+    """Returns a copy of index with one more category, keeping the dropdown order without a re-sort."""
+    entry = index.get(category_type, {"names": frozenset(), "sorted": ()})
+    if category_name in entry["names"]:
+        return index
+    ordered = list(entry["sorted"])
+    bisect.insort(ordered, category_name)
+    index = dict(index)
+    index[category_type] = {"names": entry["names"] | {category_name}, "sorted": tuple(ordered)}
+    return index
+
+# --- Shared Frame Cache ---
+
+NBYTES_SAMPLE = 20 # Items measured per container by _nbytes; the size of larger ones is extrapolated from them
+
+def _nbytes(value):
+    """Memory held by a cached value: exact for frames; for the dicts, lists, tuples and sets that derived
+    aggregates are kept in, sys.getsizeof over the first NBYTES_SAMPLE items of each container, scaled up
+    to its length. Shared strings are counted each time they appear, so it errs high."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        sample = [_nbytes(key) + _nbytes(item) for key, item in itertools.islice(value.items(), NBYTES_SAMPLE)]
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        sample = [_nbytes(item) for item in itertools.islice(value, NBYTES_SAMPLE)]
+    else:
+        return size
+    return size + (sum(sample) * len(value) // len(sample) if sample else 0)
+
+_MISS = object() # Returned by FrameCache.hit for a miss where a cached None must count as a hit
+
+def _shared(value):
+    """What a caller receives of a cached value: frames as shallow copies, anything else as is (read-only)."""
+    return value.copy(deep=False) if isinstance(value, pd.DataFrame) else value
+
+class FrameCache:
+    """Process-wide LRU of loaded frames, and of what is derived from them, keyed by (backend, kind, owner, ...)
+    and validated against a data version.
+
+    Callers receive frames as shallow copies, so assigning a column in one session never leaks into another,
+    while the underlying column buffers stay shared; derived values (rollups, category indexes, aggregate
+    snapshots, chart specs) are shared as they are and must be treated as read-only. Sessions hold none of
+    these, only the owner to ask for, so max_bytes bounds what the process keeps however many tabs are open.
+    Entries not read for idle_ttl seconds are dropped by a background sweep and rebuilt on the next get.
+    """
+
+    def __init__(self, max_bytes, idle_ttl=0):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict() # key -> (version, frame or derived value, nbytes, last read)
+        self._bytes = 0
+        self._evictions = {"lru": 0, "idle": 0}
+        self._lock = threading.Lock()
+        if idle_ttl > 0:
+            threading.Thread(target=self._sweep, name="mykhata-cache-sweep", daemon=True).start()
+
+    def get(self, key, version, loader, lock=None):
+        """Returns the cached value for key if it is still at version(), loading and caching it otherwise.
+
+        On a miss, version() is read again and the frame loaded with lock held. Writers extend cached
+        frames under the same lock, so a write can never land between the version read and the load:
+        that would tag a frame already holding the new rows with the old version, and extend() would
+        then append them a second time.
+        """
+        value = self.hit(key, version(), _MISS)
+        if value is not _MISS:
+            return value
+        with lock or nullcontext():
+            current = version()
+            value = self.hit(key, current, _MISS) # Loaded by another session while this one waited
+            if value is not _MISS:
+                return value
+            value = loader()
+            self.put(key, current, value)
+        return _shared(value)
+
+    def hit(self, key, version, default=None):
+        """Like peek, but counts as a read: the entry becomes the most recently used and its idle clock restarts.
+
+        Returns default on a miss, so a caller that caches None can tell the two apart.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return default
+            self._entries[key] = (*entry[:3], time.monotonic())
+            self._entries.move_to_end(key)
+            return _shared(entry[1])
+
+    def put(self, key, version, frame, nbytes=None):
+        """Stores a frame or derived value, evicting least recently used entries past the memory cap.
+
+        nbytes is measured (see _nbytes) unless the caller already knows it.
+        """
+        nbytes = _nbytes(frame) if nbytes is None else nbytes
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (version, frame, nbytes, time.monotonic())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+                self._evictions["lru"] += 1
+
+    def extend(self, key, old_version, new_version, rows, combine=None):
+        """Appends freshly written rows to a cached frame, if it was current before the write.
+
+        combine(frame, rows) builds the extended frame; by default the two are simply concatenated.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != old_version:
+            self.invalidate(key)
+            return
+        frame = pd.concat([entry[1], rows], ignore_index=True) if combine is None else combine(entry[1], rows)
+        self.put(key, new_version, frame)
+
+    def windows(self, key):
+        """Keys of the cached windows of key, i.e. (*key, start) entries."""
+        with self._lock:
+            return [cached for cached in self._entries if len(cached) == len(key) + 1 and cached[:len(key)] == key]
+
+    def peek(self, key, version):
+        """Returns the cached value for key if it is at version, without loading anything."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return _shared(entry[1]) if entry is not None and entry[0] == version else None
+
+    def take(self, key, version):
+        """Removes key's entry and returns (value, nbytes) if it was at version, else None: for a caller
+        that updates the value in place and puts it back at the new version."""
+        with self._lock:
+            entry = self._entries.get(key)
+            self._discard(key)
+            return (entry[1], entry[2]) if entry is not None and entry[0] == version else None
+
+    def invalidate(self, key, version=None):
+        """Drops key's entry; given a version, only if the entry is still at it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (version is None or entry[0] == version):
+                self._discard(key)
+
+    def entries(self, backend=None):
+        """(key, version) of every entry, or of those loaded by the named backend."""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items() if backend is None or key[0] == backend]
+
+    def evict_idle(self, idle_ttl=None):
+        """Drops entries not read within idle_ttl seconds (the cache's own TTL by default); returns how many."""
+        idle_ttl = self.idle_ttl if idle_ttl is None else idle_ttl
+        cutoff = time.monotonic() - idle_ttl
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry[3] <= cutoff]
+            for key in idle:
+                self._discard(key)
+            self._evictions["idle"] += len(idle)
+        if idle:
+            logger.info("Dropped %d frame(s) idle for over %.0f s", len(idle), idle_ttl)
+        return len(idle)
+
+    def _sweep(self):
+        # Runs even when no session is active, which is when idle frames are worth releasing
+        while True:
+            time.sleep(max(1.0, min(self.idle_ttl / 4, 60.0)))
+            self.evict_idle()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "idle_ttl": self.idle_ttl, "evictions": dict(self._evictions)}
+
+frame_cache = FrameCache(CACHE_MAX_BYTES, CACHE_IDLE_TTL)
+
+# Kinds of cache entry derived from an owner's data, and the kind of data whose version tags them
+DERIVED_KINDS = {"rollup": "transactions", "aggregates": "transactions", "chart": "transactions", "category_index": "categories"}
+
+# --- Backends ---
+
+SCAN_CHUNK_ROWS = 50_000
+
+def _scan_arguments(columns, start, end, types=None):
+    """Validates scan arguments and adds the columns needed to filter on them."""
+    columns = list(columns or TRANSACTION_COLUMNS)
+    unknown = set(columns) - set(TRANSACTION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown transaction columns: {', '.join(sorted(unknown))}")
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    read_columns = list(columns)
+    if (start is not None or end is not None) and "Date" not in read_columns:
+        read_columns.append("Date")
+    if types is not None and "Type" not in read_columns:
+        read_columns.append("Type")
+    return columns, read_columns, start, end
+
+def _finish_scan(raw, columns, read_columns, start, end, types=None):
+    """Types a scanned frame and applies the filters a backend may not have pushed down."""
+    df = apply_transaction_schema(raw, read_columns)
+    if start is not None:
+        df = df[df['Date'] >= start]
+    if end is not None:
+        df = df[df['Date'] <= end]
+    if types is not None:
+        df = df[df['Type'].isin(types)]
+    return df[columns].reset_index(drop=True)
+
+class Storage:
+    """Shared read path of every backend: loads go through frame_cache, checked against data_version."""
+
+    name = None
+
+    def __init__(self):
+        self._owner_locks = {}
+        self._owner_locks_guard = threading.Lock()
+        # Rollups and category indexes are kept in frame_cache, as (name, "rollup", owner) and
+        # (name, "category_index", username), under the same memory cap and idle sweep as the frames
+        self._category_index_lock = threading.Lock()
+
+    @contextmanager
+    def _owner_lock(self, owner, shared=True):
+        """Serialises writes per owner so a ledger update always matches the rows it was applied to.
+
+        In shared storage mode other replicas are excluded too, unless shared is False (for state that
+        only this process keeps).
+        """
+        with self._owner_locks_guard:
+            lock = self._owner_locks.setdefault(owner, threading.Lock())
+        with lock:
+            if not shared:
+                yield
+                return
+            with interprocess_lock(f"transactions.{shard_key(owner)}"):
+                yield
+
+    def data_version(self, kind, owner):
+        """Returns a cheap token that changes whenever owner's rows of kind ("transactions"/"categories") change."""
+        raise NotImplementedError
+
+    def load_transactions(self, effective_username):
+        """Loads transaction data for a specific effective_username."""
+        key = (self.name, "transactions", effective_username)
+        return frame_cache.get(key, lambda: self.data_version("transactions", effective_username),
+                               lambda: _typed_transactions(effective_username, self._counted(self._read_transactions(effective_username))),
+                               self._owner_lock(effective_username, shared=False))
+
+    def load_recent_transactions(self, effective_username, since):
+        """Loads the transactions dated on or after since, cached like load_transactions.
+
+        A current cached full history is sliced rather than re-read; otherwise only the window is scanned,
+        which the sqlite and parquet backends push down to disk and CSV narrows to the blocks its shard's
+        date index allows.
+        """
+        since = pd.Timestamp(since).normalize()
+        key = (self.name, "transactions", effective_username, since.strftime('%Y-%m-%d'))
+        version = lambda: self.data_version("transactions", effective_username)
+        def load():
+            full = frame_cache.peek((self.name, "transactions", effective_username), version())
+            if full is None:
+                return self.scan_transactions(effective_username, start=since)
+            metrics.count("rows_scanned", len(full))
+            return full[full['Date'] >= since].reset_index(drop=True)
+        return frame_cache.get(key, version, load, self._owner_lock(effective_username, shared=False))
+
+    def scan_transactions(self, owner, columns=None, start=None, end=None):
+        """Reads owner's typed transactions straight from storage, bypassing the cache.
+
+        Only the requested columns and the [start, end] date range are returned; backends that can
+        skip the rest on disk do so.
+        """
+        columns, read_columns, start, end = _scan_arguments(columns, start, end)
+        raw = self._counted(self._read_transactions(owner, read_columns, start, end))
+        return _finish_scan(raw, columns, read_columns, start, end)
+
+    def iter_transactions(self, owner, columns=None, start=None, end=None, types=None, chunk_rows=SCAN_CHUNK_ROWS):
+        """Yields owner's typed transactions in chunks of at most chunk_rows rows, optionally limited to some types.
+
+        Memory stays flat however long the history is, which is what exports rely on.
+        """
+        columns, read_columns, start, end = _scan_arguments(columns, start, end, types)
+        for raw in self._iter_transactions(owner, read_columns, start, end, types, chunk_rows):
+            self._counted(raw)
+            chunk = _finish_scan(raw, columns, read_columns, start, end, types)
+            if not chunk.empty:
+                yield chunk
+
+    @staticmethod
+    def _counted(raw):
+        """Counts the rows of a frame read from storage toward the run in progress."""
+        metrics.count("rows_read", len(raw))
+        return raw
+
+    def _history(self, owner, columns):
+        """The owner's full history for rebuilding an aggregate: the cached frame if current, else a column-pruned scan."""
+        cached = frame_cache.peek((self.name, "transactions", owner), self.data_version("transactions", owner))
+        history = cached[columns] if cached is not None else self.scan_transactions(owner, columns)
+        metrics.count("rows_scanned", len(history))
+        return history
+
+    def append_transaction(self, record):
+        """Appends a single transaction; existing rows are never rewritten."""
+        self.append_transactions(record["Username"], pd.DataFrame([record], columns=TRANSACTION_COLUMNS))
+
+    def append_transactions(self, owner, rows):
+        """Appends a batch of owner's transactions in one write, then moves the ledger, rollup and cache forward once.
+
+        rows holds TRANSACTION_COLUMNS with Date as 'YYYY-MM-DD' strings, as written to storage.
+        """
+        if rows.empty:
+            return
+        rows = rows.reindex(columns=TRANSACTION_COLUMNS).assign(Username=owner).reset_index(drop=True)
+        with self._owner_lock(owner):
+            old_version = self.data_version("transactions", owner)
+            ledger = self._read_ledger(owner)
+            self._append_transactions(owner, rows)
+            metrics.count("rows_written", len(rows))
+            new_version = self.data_version("transactions", owner)
+            key = (self.name, "transactions", owner)
+            frame_cache.extend(key, old_version, new_version, rows, append_typed_rows)
+            for window in frame_cache.windows(key):
+                frame_cache.extend(window, old_version, new_version, rows, functools.partial(_append_to_window, pd.Timestamp(window[-1])))
+            single = rows.iloc[0].to_dict() if len(rows) == 1 else None
+            if ledger is not None and ledger["Checksum"] == _checksum(old_version):
+                totals = (aggregates.apply_to_ledger(ledger["Totals"], single) if single is not None
+                          else aggregates.merge_ledgers(ledger["Totals"], aggregates.ledger_from_frame(rows)))
+                self._write_ledger(owner, totals, _checksum(new_version))
+            taken = frame_cache.take((self.name, "rollup", owner), old_version)
+            if taken is not None:
+                rollup, nbytes = taken
+                cells = aggregates.rollup_cells(rollup)
+                if single is not None:
+                    aggregates.apply_to_rollup(rollup, single)
+                else:
+                    aggregates.merge_rollups(rollup, aggregates.rollup_from_frame(rows))
+                # Scaled by the cells added rather than measured again, which would walk the whole rollup
+                frame_cache.put((self.name, "rollup", owner), new_version, rollup,
+                                nbytes * aggregates.rollup_cells(rollup) // max(cells, 1))
+
+    def ledger(self, owner):
+        """Returns the owner's running totals, rebuilding them from history only if their checksum is stale."""
+        checksum = _checksum(self.data_version("transactions", owner))
+        ledger = self._read_ledger(owner)
+        if ledger is not None and ledger["Checksum"] == checksum:
+            return ledger["Totals"]
+        with self._owner_lock(owner):
+            checksum = _checksum(self.data_version("transactions", owner))
+            totals = aggregates.ledger_from_frame(self._history(owner, ["Type", "Amount"]))
+            self._write_ledger(owner, totals, checksum)
+        return totals
+
+    def rollup_frame(self, owner, granularity, types=None):
+        """Answers a report from the owner's materialised period rollup, building it from history only when stale."""
+        with self._owner_lock(owner, shared=False): # The rollup lives in this process only
+            rollup = frame_cache.get((self.name, "rollup", owner), lambda: self.data_version("transactions", owner),
+                                     lambda: aggregates.rollup_from_frame(self._history(owner, ["Date", "Type", "Category", "Amount"])))
+            return aggregates.rollup_frame(rollup, granularity, types)
+
+    def load_categories(self, username):
+        """Loads custom categories for a user."""
+        key = (self.name, "categories", username)
+        return frame_cache.get(key, lambda: self.data_version("categories", username), lambda: self._counted(self._read_categories(username)))
+
+    def add_category(self, username, category_type, category_name):
+        """Saves a custom category for a user. Returns False if the user already has it."""
+        return self.add_categories([(username, category_type, category_name)])[0]
+
+    def category_index(self, username):
+        """Returns the user's category index (see category_index_from_frame), defaults included.
+
+        It is shared by every session and only rebuilt when the user's categories changed outside add_categories.
+        """
+        with self._category_index_lock:
+            return frame_cache.get((self.name, "category_index", username), lambda: self.data_version("categories", username),
+                                   lambda: category_index_from_frame(self.load_categories(username)))
+
+    def add_categories(self, entries):
+        """Saves a batch of (username, category_type, category_name) in one write, moving cached indexes forward.
+
+        Returns one flag per entry: False where the user already had that category.
+        """
+        with self._category_index_lock, interprocess_lock("categories"):
+            old_versions = {entry[0]: self.data_version("categories", entry[0]) for entry in entries}
+            added = self._add_categories(entries)
+            for username in {entry[0] for entry, new in zip(entries, added) if new}:
+                frame_cache.invalidate((self.name, "categories", username))
+                taken = frame_cache.take((self.name, "category_index", username), old_versions[username])
+                if taken is None:
+                    continue
+                index = taken[0]
+                for (owner, category_type, category_name), new in zip(entries, added):
+                    if new and owner == username:
+                        index = add_to_category_index(index, category_type, category_name)
+                frame_cache.put((self.name, "category_index", username), self.data_version("categories", username), index)
+        return added
+
+    def drop_stale(self):
+        """Drops what this process caches for owners whose data moved on: frames and what is derived from them
+        (see DERIVED_KINDS). Returns the owners whose transactions changed, as found by one version read per owner."""
+        versions = {}
+        def current(kind, owner):
+            if (kind, owner) not in versions:
+                versions[(kind, owner)] = self.data_version(kind, owner)
+            return versions[(kind, owner)]
+        changed = set()
+        for key, version in frame_cache.entries(self.name):
+            kind, owner = DERIVED_KINDS.get(key[1], key[1]), key[2]
+            if version != current(kind, owner):
+                frame_cache.invalidate(key, version) # Only if still at version: a local write may have moved it on
+                if kind == "transactions":
+                    changed.add(owner)
+        return changed
+
+    def watch_versions(self, on_change=None, interval=SHARED_POLL_INTERVAL):
+        """Starts a thread that runs drop_stale every interval seconds and calls on_change(owner) for each
+        owner whose transactions another replica changed, e.g. to recompute their aggregates."""
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    changed = self.drop_stale()
+                    for owner in changed if on_change is not None else ():
+                        on_change(owner)
+                except Exception:
+                    logger.exception("Polling data versions failed")
+        threading.Thread(target=poll, name="mykhata-version-watch", daemon=True).start()
+
+    def add_user(self, user):
+        """Adds one user row. Returns False if the username is taken."""
+        return self.add_users([user])[0]
+
+
+def _checksum(version):
+    """Stable string form of a data version, stored alongside derived data such as the ledger."""
+    return hashlib.sha1(repr(version).encode()).hexdigest()
+
+def _stat_version(*paths):
+    """Version token built from file mtimes and sizes; missing files count as (0, 0)."""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            version.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            version.append((0, 0))
+    return tuple(version)
+
+
+class CsvStorage(Storage):
+    """Plain CSV files: sharded, journalled transactions plus the users and category files."""
+
+    name = "csv"
+
+    def __init__(self):
+        # CATEGORY_FILE is shared by every user, so its stat alone cannot say whose categories changed.
+        # Writes made here bump a per-user counter; a change made outside this process bumps the epoch.
+        self._category_lock = threading.Lock()
+        self._users_lock = threading.Lock()
+        self._users_stat = None # Stat of USERS_FILE the user directory was built from
+        self._users_by_name = {}
+        self._sub_users = {}
+        self._category_pairs = set() # (Username, CategoryName) already in CATEGORY_FILE, for duplicate checks
+        self._category_pairs_stat = None
+        self._category_stat = None
+        self._category_epoch = 0
+        self._category_counters = {}
+        super().__init__()
+        with interprocess_lock("startup"): # A replica starting up never migrates or folds alongside another
+            self.startup()
+
+    def startup(self):
+        """Migrates legacy data and replays every shard journal."""
+        migrate_to_shards()
+        os.makedirs(DATA_DIR, exist_ok=True)
+        journals = glob.glob(os.path.join(glob.escape(DATA_DIR), "*.journal"))
+        journals += [path.rsplit(".", 2)[0] for path in glob.glob(os.path.join(glob.escape(DATA_DIR), "*.journal.*.ckpt"))]
+        for journal_file in set(journals):
+            key = os.path.basename(journal_file)[:-len(".journal")]
+            with interprocess_lock(f"transactions.{key}"):
+                # Other replicas may be serving this shard: moving rows between files counts as a change
+                if replay_journal(journal_file[:-len(".journal")] + ".csv", journal_file) and SHARED_STORAGE:
+                    bump_version("transactions", key)
+
+    def data_version(self, kind, owner):
+        if SHARED_STORAGE:
+            return read_version(kind, shard_key(owner))
+        if kind == "transactions":
+            return _stat_version(*shard_paths(owner))
+        with self._category_lock:
+            stat = _stat_version(CATEGORY_FILE)
+            if stat != self._category_stat:
+                self._category_stat = stat
+                self._category_epoch += 1
+            return (self._category_epoch, self._category_counters.get(owner, 0))
+
+    def load_users(self):
+        """Loads user data from CSV or creates an empty DataFrame."""
+        if os.path.exists(USERS_FILE):
+            metrics.count("bytes_read", metrics.file_size(USERS_FILE))
+            return self._counted(pd.read_csv(USERS_FILE, dtype=str)) # As text, so rewriting the file never reformats a field
+        df = pd.DataFrame(columns=USER_COLUMNS)
+        df.to_csv(USERS_FILE, index=False)
+        return df
+
+    def _user_directory(self):
+        """Returns (users by Username, sub-usernames by parent), re-parsing USERS_FILE only when its stat changed.
+
+        Call with _users_lock held.
+        """
+        if _file_version(USERS_FILE) != self._users_stat:
+            self._users_by_name, self._sub_users = {}, {}
+            for user in self.load_users().to_dict("records"):
+                self._index_user(user)
+            self._users_stat = _file_version(USERS_FILE)
+        return self._users_by_name, self._sub_users
+
+    def _index_user(self, user):
+        self._users_by_name[user["Username"]] = user
+        if pd.notna(user.get("ParentUsername")):
+            self._sub_users.setdefault(user["ParentUsername"], []).append(user["Username"])
+
+    def get_user(self, username):
+        """Returns a user's row as a dict, or None."""
+        with self._users_lock:
+            user = self._user_directory()[0].get(username)
+            return None if user is None else dict(user)
+
+    def sub_users(self, parent_username):
+        """Lists the usernames of the sub-users linked to a main user."""
+        with self._users_lock:
+            return list(self._user_directory()[1].get(parent_username, []))
+
+    def save_users(self, df):
+        """Saves user data to CSV."""
+        with self._users_lock, interprocess_lock("users"):
+            _replace_csv(df, USERS_FILE)
+            self._bump_file_version(USERS_FILE)
+            self._users_stat = None # Rebuilt from the file on the next lookup
+
+    def add_users(self, users):
+        """Appends a batch of user rows to the users file. Returns one flag per row: False if the username is taken."""
+        with self._users_lock, interprocess_lock("users"):
+            by_name = self._user_directory()[0]
+            added, seen = [], set()
+            for user in users:
+                added.append(user["Username"] not in by_name and user["Username"] not in seen)
+                seen.add(user["Username"])
+            new_users = [user for user, new in zip(users, added) if new]
+            if new_users:
+                _append_csv(pd.DataFrame(new_users, columns=USER_COLUMNS), USERS_FILE)
+                for user in new_users:
+                    self._index_user({col: user.get(col) for col in USER_COLUMNS})
+                self._bump_file_version(USERS_FILE)
+                self._users_stat = _file_version(USERS_FILE)
+            return added
+
+    def update_user(self, username, changes):
+        """Updates fields of one user row. Returns False if there is no such user."""
+        with self._users_lock, interprocess_lock("users"):
+            by_name = self._user_directory()[0]
+            if username not in by_name:
+                return False
+            by_name[username].update(changes)
+            _replace_csv(pd.DataFrame(list(by_name.values()), columns=USER_COLUMNS), USERS_FILE)
+            self._bump_file_version(USERS_FILE)
+            self._users_stat = _file_version(USERS_FILE)
+            return True
+
+    @staticmethod
+    def _bump_file_version(path):
+        if SHARED_STORAGE:
+            bump_version("file", os.path.basename(path))
+
+    def _read_transactions(self, effective_username, columns=None, start=None, end=None):
+        # A date range only parses the blocks of the shard its date index allows; the caller still filters the rows
+        columns = list(columns or TRANSACTION_COLUMNS)
+        usecols = lambda col: col in columns or col == 'Username'
+        data_file, journal_file = shard_paths(effective_username)
+        if os.path.exists(data_file) and (start is not None or end is not None):
+            df = read_indexed_range(data_file, read_date_index(data_file, _index_path(effective_username)), usecols, start, end)
+        elif os.path.exists(data_file):
+            metrics.count("bytes_read", metrics.file_size(data_file))
+            df = pd.read_csv(data_file, usecols=usecols)
+        else:
+            df = pd.DataFrame(columns=TRANSACTION_COLUMNS)
+        journal = read_journal(journal_file)
+        if not journal.empty:
+            df = pd.concat([df, journal], ignore_index=True)
+        # Shard names can collide on case-insensitive filesystems, so still filter on the owner
+        return df[df['Username'] == effective_username].reindex(columns=columns).reset_index(drop=True)
+
+    def _iter_transactions(self, effective_username, columns, start, end, types, chunk_rows):
+        data_file, journal_file = shard_paths(effective_username)
+        if os.path.exists(data_file):
+            metrics.count("bytes_read", metrics.file_size(data_file))
+            for chunk in pd.read_csv(data_file, usecols=lambda col: col in columns or col == 'Username', chunksize=chunk_rows):
+                yield chunk[chunk['Username'] == effective_username].reindex(columns=columns)
+        # The journal only holds rows added since the last startup fold, so it is read whole
+        journal = read_journal(journal_file)
+        journal = journal[journal['Username'] == effective_username].reindex(columns=columns)
+        for offset in range(0, len(journal), chunk_rows):
+            yield journal.iloc[offset:offset + chunk_rows]
+
+    def _append_transactions(self, owner, rows):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        _, journal_file = shard_paths(owner)
+        if len(rows) == 1:
+            append_journal(rows.iloc[0].to_dict(), journal_file)
+        else:
+            append_journal_rows(rows, journal_file)
+        if SHARED_STORAGE:
+            bump_version("transactions", shard_key(owner))
+
+    def _read_ledger(self, owner):
+        try:
+            with open(_ledger_path(owner), encoding="utf-8") as f:
+                text = f.read()
+            metrics.count("bytes_read", len(text))
+            return json.loads(text)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_ledger(self, owner, totals, checksum):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        path = _ledger_path(owner)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            metrics.count("bytes_written", f.write(json.dumps({"Checksum": checksum, "Totals": totals})))
+        os.replace(f"{path}.tmp", path)
+
+    def _read_categories(self, username):
+        if os.path.exists(CATEGORY_FILE):
+            metrics.count("bytes_read", metrics.file_size(CATEGORY_FILE))
+            df = pd.read_csv(CATEGORY_FILE)
+            return df[df['Username'] == username].reset_index(drop=True)
+        df = pd.DataFrame(columns=CATEGORY_COLUMNS)
+        df.to_csv(CATEGORY_FILE, index=False)
+        return df
+
+    def _add_categories(self, entries):
+        with self._category_lock, interprocess_lock("categories"):
+            if _file_version(CATEGORY_FILE) != self._category_pairs_stat:
+                if os.path.exists(CATEGORY_FILE):
+                    df = pd.read_csv(CATEGORY_FILE, usecols=['Username', 'CategoryName'], dtype=str)
+                    self._category_pairs = set(zip(df['Username'], df['CategoryName']))
+                else:
+                    self._category_pairs = set()
+                self._category_pairs_stat = _file_version(CATEGORY_FILE)
+            added = []
+            for username, _, category_name in entries:
+                added.append((username, category_name) not in self._category_pairs)
+                self._category_pairs.add((username, category_name))
+            new_categories = pd.DataFrame([entry for entry, new in zip(entries, added) if new], columns=CATEGORY_COLUMNS)
+            if new_categories.empty:
+                return added
+            stale = _stat_version(CATEGORY_FILE) != self._category_stat
+            _append_csv(new_categories, CATEGORY_FILE)
+            self._bump_file_version(CATEGORY_FILE)
+            # Only these users' categories changed, unless the file had also been edited elsewhere
+            self._category_stat = _stat_version(CATEGORY_FILE)
+            self._category_pairs_stat = _file_version(CATEGORY_FILE)
+            self._category_epoch += stale
+            for username in set(new_categories['Username']):
+                self._category_counters[username] = self._category_counters.get(username, 0) + 1
+                if SHARED_STORAGE:
+                    bump_version("categories", shard_key(username))
+            return added
+
+
+class SqliteStorage(Storage):
+    """Embedded SQLite database in WAL mode with indexes on the per-user access paths."""
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            Username TEXT PRIMARY KEY, PasswordHash TEXT, Name TEXT, Mobile TEXT,
+            Email TEXT, Role TEXT, ParentUsername TEXT
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY, Username TEXT NOT NULL, Date TEXT NOT NULL,
+            Type TEXT, Category TEXT, Amount REAL, Note TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (Username, Date);
+        CREATE INDEX IF NOT EXISTS idx_users_parent ON users (ParentUsername);
+        CREATE TABLE IF NOT EXISTS categories (
+            Username TEXT NOT NULL, CategoryType TEXT, CategoryName TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_categories_user_type ON categories (Username, CategoryType);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_categories_user_name ON categories (Username, CategoryName);
+        CREATE TABLE IF NOT EXISTS data_versions (
+            Kind TEXT NOT NULL, Owner TEXT NOT NULL, Version INTEGER NOT NULL, PRIMARY KEY (Kind, Owner)
+        );
+        CREATE TABLE IF NOT EXISTS ledgers (
+            Owner TEXT PRIMARY KEY, Checksum TEXT NOT NULL, Totals TEXT NOT NULL
+        );
+    """
+
+    # SQLite's synchronous levels line up with the journal fsync policy used by the CSV backend
+    SYNCHRONOUS = {"always": "FULL", "interval": "NORMAL", "never": "OFF"}
+
+    def __init__(self, path=SQLITE_FILE):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        with interprocess_lock("startup"): # Only the first replica to start imports an existing CSV install
+            is_new = not os.path.exists(path)
+            with self._conn() as conn:
+                conn.executescript(self.SCHEMA)
+            if is_new:
+                self.import_csv_files()
+
+    def _conn(self):
+        """Returns this thread's connection; Streamlit runs each session's script on its own thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS.get(JOURNAL_FSYNC, 'FULL')}")
+            self._local.conn = conn
+        return conn
+
+    def import_csv_files(self):
+        """One-shot import of an existing CSV install into a fresh database."""
+        if not (os.path.exists(USERS_FILE) or os.path.exists(CATEGORY_FILE) or os.path.exists(DATA_FILE) or os.path.isdir(DATA_DIR)):
+            return
+        source = CsvStorage()
+        transactions = [source._read_transactions(user) for user in _shard_owners()]
+        with self._conn() as conn:
+            if os.path.exists(USERS_FILE):
+                users = source.load_users().reindex(columns=USER_COLUMNS)
+                conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", _rows(users))
+            if os.path.exists(CATEGORY_FILE):
+                categories = pd.read_csv(CATEGORY_FILE).reindex(columns=CATEGORY_COLUMNS)
+                conn.executemany("INSERT OR IGNORE INTO categories VALUES (?, ?, ?)", _rows(categories))
+            for df in transactions:
+                conn.executemany(
+                    "INSERT INTO transactions (Username, Date, Type, Category, Amount, Note) VALUES (?, ?, ?, ?, ?, ?)",
+                    _rows(df.reindex(columns=TRANSACTION_COLUMNS)))
+
+    def data_version(self, kind, owner):
+        row = self._conn().execute("SELECT Version FROM data_versions WHERE Kind = ? AND Owner = ?", (kind, owner)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _bump_version(self, conn, kind, owner):
+        """Bumps owner's version inside the writing transaction, so readers never see new rows with an old version."""
+        conn.execute("INSERT INTO data_versions VALUES (?, ?, 1) "
+                     "ON CONFLICT (Kind, Owner) DO UPDATE SET Version = Version + 1", (kind, owner))
+
+    def load_users(self):
+        return self._counted(pd.read_sql_query("SELECT * FROM users", self._conn()))
+
+    def get_user(self, username):
+        """Primary-key lookup of one user, returned as a dict, or None."""
+        cursor = self._conn().execute("SELECT * FROM users WHERE Username = ?", (username,))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip([col[0] for col in cursor.description], row))
+
+    def sub_users(self, parent_username):
+        rows = self._conn().execute("SELECT Username FROM users WHERE ParentUsername = ?", (parent_username,)).fetchall()
+        return [row[0] for row in rows]
+
+    def save_users(self, df):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", _rows(df.reindex(columns=USER_COLUMNS)))
+
+    def add_users(self, users):
+        with self._conn() as conn:
+            return [conn.execute("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [user.get(col) for col in USER_COLUMNS]).rowcount > 0 for user in users]
+
+    def update_user(self, username, changes):
+        assignments = ", ".join(f"{col} = ?" for col in changes if col in USER_COLUMNS)
+        with self._conn() as conn:
+            cursor = conn.execute(f"UPDATE users SET {assignments} WHERE Username = ?",
+                                  [value for col, value in changes.items() if col in USER_COLUMNS] + [username])
+        return cursor.rowcount > 0
+
+    def _select_transactions(self, effective_username, columns, start, end, types=None):
+        """Builds the SELECT for a scan; both date bounds are answered from the (Username, Date) index."""
+        where, params = ["Username = ?"], [effective_username]
+        if start is not None:
+            where.append("Date >= ?")
+            params.append(start.strftime('%Y-%m-%d'))
+        if end is not None:
+            where.append("Date <= ?")
+            params.append(end.strftime('%Y-%m-%d'))
+        if types is not None:
+            where.append(f"Type IN ({', '.join('?' for _ in types)})")
+            params.extend(types)
+        return f"SELECT {', '.join(columns)} FROM transactions WHERE {' AND '.join(where)} ORDER BY id", params
+
+    def _read_transactions(self, effective_username, columns=None, start=None, end=None):
+        sql, params = self._select_transactions(effective_username, list(columns or TRANSACTION_COLUMNS), start, end)
+        return pd.read_sql_query(sql, self._conn(), params=params)
+
+    def _iter_transactions(self, effective_username, columns, start, end, types, chunk_rows):
+        sql, params = self._select_transactions(effective_username, columns, start, end, types)
+        cursor = self._conn().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield pd.DataFrame(rows, columns=columns)
+
+    def _append_transactions(self, owner, rows):
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO transactions (Username, Date, Type, Category, Amount, Note) VALUES (?, ?, ?, ?, ?, ?)",
+                _rows(rows))
+            self._bump_version(conn, "transactions", owner)
+
+    def _read_ledger(self, owner):
+        row = self._conn().execute("SELECT Checksum, Totals FROM ledgers WHERE Owner = ?", (owner,)).fetchone()
+        return None if row is None else {"Checksum": row[0], "Totals": json.loads(row[1])}
+
+    def _write_ledger(self, owner, totals, checksum):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO ledgers VALUES (?, ?, ?)", (owner, checksum, json.dumps(totals)))
+
+    def _read_categories(self, username):
+        return pd.read_sql_query(
+            "SELECT Username, CategoryType, CategoryName FROM categories WHERE Username = ?",
+            self._conn(), params=(username,))
+
+    def _add_categories(self, entries):
+        with self._conn() as conn:
+            added = [conn.execute("INSERT OR IGNORE INTO categories VALUES (?, ?, ?)", entry).rowcount > 0 for entry in entries]
+            for username in {entry[0] for entry, new in zip(entries, added) if new}:
+                self._bump_version(conn, "categories", username)
+        return added
+
+
+class ParquetStorage(CsvStorage):
+    """Columnar transactions: PARQUET_DIR/<user>/Year=<yyyy>/data.parquet, read through memory maps.
+
+    Users and categories stay in their CSV files. New transactions are appended to a per-user journal
+    and folded into the year files when the process starts, so inserts never rewrite Parquet.
+    """
+
+    name = "parquet"
+
+    def __init__(self):
+        if pa is None:
+            raise RuntimeError("The parquet storage backend needs pyarrow. Install it with: pip install pyarrow")
+        self._fs = pafs.LocalFileSystem(use_mmap=True)
+        super().__init__()
+
+    def startup(self):
+        """Runs the CSV startup, imports existing CSV shards once, then folds every Parquet journal."""
+        super().startup()
+        if not os.path.isdir(PARQUET_DIR):
+            staging_dir = f"{PARQUET_DIR}.importing"
+            for owner in _shard_owners():
+                self._write_years(CsvStorage._read_transactions(self, owner), os.path.join(staging_dir, shard_key(owner)), "import")
+            os.makedirs(staging_dir, exist_ok=True)
+            os.replace(staging_dir, PARQUET_DIR)
+        for journal_file in set(glob.glob(os.path.join(glob.escape(PARQUET_DIR), "*.journal")) +
+                                [path.rsplit(".", 2)[0] for path in glob.glob(os.path.join(glob.escape(PARQUET_DIR), "*.journal.*.ckpt"))]):
+            key = os.path.basename(journal_file)[:-len(".journal")]
+            with interprocess_lock(f"transactions.{key}"):
+                if self._fold_journal(journal_file) and SHARED_STORAGE:
+                    bump_version("transactions", key)
+
+    def _user_dir(self, owner):
+        return os.path.join(PARQUET_DIR, shard_key(owner))
+
+    def _journal_path(self, owner):
+        return f"{self._user_dir(owner)}.journal"
+
+    def _year_files(self, owner):
+        return sorted(glob.glob(os.path.join(glob.escape(self._user_dir(owner)), "Year=*", "data.parquet")))
+
+    def _fold_journal(self, journal_file):
+        """Rewrites the year files touched by a journal, tagging each with the checkpoint it absorbed.
+
+        A crash part-way is finished on the next start: year files already carrying the tag are skipped.
+        Returns True if any rows were moved.
+        """
+        checkpoints = glob.glob(f"{glob.escape(journal_file)}.*.ckpt")
+        for checkpoint_file in checkpoints:
+            self._apply_checkpoint(journal_file, checkpoint_file)
+        if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+            checkpoint_file = f"{journal_file}.{time.time_ns()}.ckpt"
+            os.replace(journal_file, checkpoint_file)
+            self._apply_checkpoint(journal_file, checkpoint_file)
+            return True
+        return bool(checkpoints)
+
+    def _apply_checkpoint(self, journal_file, checkpoint_file):
+        checkpoint_id = checkpoint_file.rsplit(".", 2)[1]
+        user_dir = journal_file[:-len(".journal")]
+        self._write_years(read_journal(checkpoint_file), user_dir, checkpoint_id)
+        os.remove(checkpoint_file)
+
+    def _write_years(self, rows, user_dir, checkpoint_id):
+        """Merges rows into their year files, sorted by date so row-group statistics can prune date ranges.
+
+        Rows without a parseable date go to the Year=__null__ partition rather than being dropped.
+        """
+        rows = apply_transaction_schema(rows)
+        years = rows['Date'].dt.year.astype("Int64")
+        for year, year_rows in rows.groupby(years, dropna=False):
+            path = os.path.join(user_dir, f"Year={PARQUET_NULL_YEAR if pd.isna(year) else year}", "data.parquet")
+            if os.path.exists(path):
+                metadata = pq.read_metadata(path).metadata or {}
+                if metadata.get(b"mykhata_checkpoint") == checkpoint_id.encode():
+                    continue
+                year_rows = pd.concat([self._read_year(path), year_rows], ignore_index=True)
+            table = pa.Table.from_pandas(
+                year_rows.sort_values('Date', kind='stable').reindex(columns=PARQUET_SCHEMA.names),
+                schema=PARQUET_SCHEMA, preserve_index=False)
+            table = table.replace_schema_metadata({"mykhata_checkpoint": checkpoint_id})
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # The dot prefix keeps a half-written file out of dataset discovery
+            temp_path = os.path.join(os.path.dirname(path), ".data.parquet.tmp")
+            pq.write_table(table, temp_path, row_group_size=PARQUET_ROW_GROUP_ROWS)
+            metrics.count("bytes_written", metrics.file_size(temp_path))
+            os.replace(temp_path, path)
+
+    def _read_year(self, path):
+        return pq.read_table(path, memory_map=True).to_pandas(date_as_object=False)
+
+    def data_version(self, kind, owner):
+        if kind == "transactions" and not SHARED_STORAGE: # Shared mode reads the write counter instead of globbing
+            return _stat_version(self._journal_path(owner), *self._year_files(owner))
+        return super().data_version(kind, owner)
+
+    def _dataset(self, effective_username, start, end, types=None):
+        """Opens the user's year files with a predicate covering the date range and types, or returns (None, None)."""
+        user_dir = self._user_dir(effective_username)
+        if not os.path.isdir(user_dir):
+            return None, None
+        partitioning = ds.HivePartitioning.discover(null_fallback=PARQUET_NULL_YEAR)
+        dataset = ds.dataset(user_dir, format="parquet", partitioning=partitioning, filesystem=self._fs)
+        # Year prunes whole files (the null year never matches a bound); Date prunes row groups inside them using their min/max statistics
+        predicate = None
+        if start is not None:
+            predicate = (ds.field("Year") >= start.year) & (ds.field("Date") >= pa.scalar(start.date(), pa.date32()))
+        if end is not None:
+            upper = (ds.field("Year") <= end.year) & (ds.field("Date") <= pa.scalar(end.date(), pa.date32()))
+            predicate = upper if predicate is None else predicate & upper
+        if types is not None:
+            predicate = ds.field("Type").isin(list(types)) if predicate is None else predicate & ds.field("Type").isin(list(types))
+        return dataset, predicate
+
+    def _read_transactions(self, effective_username, columns=None, start=None, end=None):
+        columns = list(columns or TRANSACTION_COLUMNS)
+        stored_columns = [col for col in columns if col in PARQUET_SCHEMA.names]
+        frames = []
+        dataset, predicate = self._dataset(effective_username, start, end)
+        if dataset is not None and stored_columns:
+            table = dataset.to_table(columns=stored_columns, filter=predicate)
+            metrics.count("bytes_read", table.nbytes) # Decoded bytes; pruned row groups are never read
+            frames.append(table.to_pandas(date_as_object=False))
+        journal = read_journal(self._journal_path(effective_username))
+        if not journal.empty:
+            frames.append(journal)
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        df['Username'] = effective_username
+        return df.reindex(columns=columns)
+
+    def _iter_transactions(self, effective_username, columns, start, end, types, chunk_rows):
+        stored_columns = [col for col in columns if col in PARQUET_SCHEMA.names]
+        dataset, predicate = self._dataset(effective_username, start, end, types)
+        if dataset is not None and stored_columns:
+            for batch in dataset.to_batches(columns=stored_columns, filter=predicate, batch_size=chunk_rows):
+                metrics.count("bytes_read", batch.nbytes)
+                yield batch.to_pandas(date_as_object=False).assign(Username=effective_username).reindex(columns=columns)
+        journal = read_journal(self._journal_path(effective_username)).reindex(columns=columns)
+        for offset in range(0, len(journal), chunk_rows):
+            yield journal.iloc[offset:offset + chunk_rows]
+
+    def _append_transactions(self, owner, rows):
+        os.makedirs(PARQUET_DIR, exist_ok=True)
+        if len(rows) == 1:
+            append_journal(rows.iloc[0].to_dict(), self._journal_path(owner))
+        else:
+            append_journal_rows(rows, self._journal_path(owner))
+        if SHARED_STORAGE:
+            bump_version("transactions", shard_key(owner))
+
+    def _read_ledger(self, owner):
+        try:
+            with open(f"{self._user_dir(owner)}.ledger.json", encoding="utf-8") as f:
+                text = f.read()
+            metrics.count("bytes_read", len(text))
+            return json.loads(text)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_ledger(self, owner, totals, checksum):
+        os.makedirs(PARQUET_DIR, exist_ok=True)
+        path = f"{self._user_dir(owner)}.ledger.json"
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            metrics.count("bytes_written", f.write(json.dumps({"Checksum": checksum, "Totals": totals})))
+        os.replace(f"{path}.tmp", path)
+
+
+def _replace_csv(df, path):
+    """Writes a CSV to a temporary file and renames it over path, so readers never see a half-written file."""
+    df.to_csv(f"{path}.tmp", index=False)
+    metrics.count("bytes_written", metrics.file_size(f"{path}.tmp"))
+    os.replace(f"{path}.tmp", path)
+
+def _append_csv(df, path):
+    """Appends rows to a CSV file (creating it with a header if needed) without rewriting what is there."""
+    with open(path, "ab+") as f:
+        start = f.seek(0, os.SEEK_END)
+        if not f.tell():
+            f.write((",".join(df.columns) + "\n").encode())
+        else:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n") # Hand-edited files may lack the final newline
+        f.write(df.to_csv(header=False, index=False, lineterminator="\n").encode())
+        _sync_journal(f)
+        metrics.count("bytes_written", f.tell() - start)
+
+def _rows(df):
+    """Converts a frame to DB-API parameter rows, mapping NaN to NULL."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def _shard_owners():
+    """Lists the effective usernames that have a transaction shard."""
+    owners = set()
+    for data_file in glob.glob(os.path.join(glob.escape(DATA_DIR), "*.csv")):
+        owners.update(pd.read_csv(data_file, usecols=["Username"])["Username"].dropna().unique())
+    return sorted(owners)
+
+BACKENDS = {"csv": CsvStorage, "sqlite": SqliteStorage, "parquet": ParquetStorage}
+
+def open_storage(backend=None):
+    """Creates the configured storage backend."""
+    backend = backend or STORAGE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    if SHARED_STORAGE and fcntl is None:
+        raise RuntimeError("Shared storage mode (MYKHATA_SHARED_STORAGE=1) needs fcntl file locks, which this platform lacks")
+    return BACKENDS[backend]()
+
+
+# --- Write-Behind Queue ---
+# Every session's saves go through one writer thread. Whatever queued up while the previous batch was
+# being written is committed together: one journal append (and fsync) per owner, one rewrite of the
+# users or category file, so month-end bursts cost a few writes instead of one per entry.
+
+WRITE_BATCH_MAX = int(os.environ.get("MYKHATA_WRITE_BATCH_MAX", "1000")) # Most operations committed together
+
+class WriteQueue:
+    """Single background writer in front of a Storage backend.
+
+    submit_* calls return a concurrent.futures.Future at once; it resolves when the write is durable.
+    Readers call wait() before reading, so a session always sees its own writes.
+    """
+
+    def __init__(self, storage, batch_max=WRITE_BATCH_MAX):
+        self.storage = storage
+        self.batch_max = batch_max
+        self._queue = queue.Queue()
+        self._pending = {} # (kind, owner) -> queued or in-flight writes
+        self._pending_changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="mykhata-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close) # Drain whatever is still queued when the server shuts down
+
+    def submit_transaction(self, record):
+        """Queues one transaction record (TRANSACTION_COLUMNS, Date as 'YYYY-MM-DD')."""
+        return self._submit("transactions", record["Username"], record)
+
+    def submit_transactions(self, owner, rows):
+        """Queues a frame of owner's transactions (TRANSACTION_COLUMNS, Date as 'YYYY-MM-DD'), committed in one append."""
+        return self._submit("transactions", owner, rows.copy())
+
+    def submit_category(self, username, category_type, category_name):
+        """Queues a custom category; the future resolves to False if the user already had it."""
+        return self._submit("categories", username, (username, category_type, category_name))
+
+    def submit_user(self, user):
+        """Queues a new user row; the future resolves to False if the username was taken by then."""
+        return self._submit("users", None, user)
+
+    def submit_user_update(self, username, changes):
+        """Queues an update of some fields of one user; the future resolves to False if there is no such user."""
+        return self._submit("users", None, (username, dict(changes)))
+
+    def submit_users(self, df):
+        """Queues a replacement of the whole users table."""
+        return self._submit("users", None, df.copy())
+
+    def wait(self, kind, owner=None, timeout=None):
+        """Blocks until every queued write of owner's rows of kind has been committed. Returns False on timeout."""
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: not self._pending.get((kind, owner)), timeout)
+
+    def close(self):
+        """Commits what is queued and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _submit(self, kind, owner, payload):
+        future = Future()
+        with self._pending_changed:
+            self._pending[(kind, owner)] = self._pending.get((kind, owner), 0) + 1
+        self._queue.put((kind, owner, payload, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [op for op in batch if op is not None]
+            if batch:
+                metrics.begin_run("write", operations=len(batch)) # Each committed batch is logged as its own run
+            try:
+                with metrics.span("commit"):
+                    self._commit(batch)
+            finally:
+                metrics.end_run()
+                with self._pending_changed:
+                    for kind, owner, _, _ in batch:
+                        self._pending[(kind, owner)] -= 1
+                        if not self._pending[(kind, owner)]:
+                            del self._pending[(kind, owner)]
+                    self._pending_changed.notify_all()
+            if stop:
+                return
+
+    def _commit(self, batch):
+        """Writes one batch: a grouped append per owner, then categories, then users in submission order."""
+        transactions = {}
+        for kind, owner, payload, future in batch:
+            if kind == "transactions":
+                transactions.setdefault(owner, []).append((payload, future))
+        for owner, ops in transactions.items():
+            # Single records and submitted frames, kept in submission order
+            parts, records = [], []
+            for payload, _ in ops + [(None, None)]:
+                if isinstance(payload, dict):
+                    records.append(payload)
+                    continue
+                if records:
+                    parts.append(pd.DataFrame(records, columns=TRANSACTION_COLUMNS))
+                    records = []
+                if payload is not None:
+                    parts.append(payload.reindex(columns=TRANSACTION_COLUMNS))
+            rows = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+            self._resolve([future for _, future in ops], lambda: self.storage.append_transactions(owner, rows))
+
+        categories = [(payload, future) for kind, _, payload, future in batch if kind == "categories"]
+        if categories:
+            self._resolve([future for _, future in categories],
+                          lambda: self.storage.add_categories([entry for entry, _ in categories]), many=True)
+
+        # Saves and updates are applied in order, so new users are only grouped up to the next one
+        users = []
+        for kind, _, payload, future in batch + [("users", None, None, None)]:
+            if kind != "users":
+                continue
+            if isinstance(payload, dict):
+                users.append((payload, future))
+                continue
+            if users:
+                self._resolve([future for _, future in users],
+                              lambda: self.storage.add_users([user for user, _ in users]), many=True)
+                users = []
+            if isinstance(payload, tuple):
+                self._resolve([future], lambda: [self.storage.update_user(*payload)], many=True)
+            elif payload is not None:
+                self._resolve([future], lambda: self.storage.save_users(payload))
+
+    @staticmethod
+    def _resolve(futures, write, many=False):
+        """Runs one grouped write and settles its futures: with its per-operation results if many, else True."""
+        try:
+            result = write()
+        except Exception as e:
+            logger.exception("Queued write failed")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, value in zip(futures, result if many else [True] * len(futures)):
+            future.set_result(value)
+
+
+# --- Aggregate Worker ---
+# The save helpers tell the worker which user changed; a small thread pool then recomputes that user's
+# summary figures, category breakdown and period rollup frames off the request thread and publishes them
+# as one snapshot, tagged with the data version it was computed at. Pages use a snapshot only while its
+# version is current, and compute inline when the worker is behind.
+
+AGGREGATE_WORKERS = int(os.environ.get("MYKHATA_AGGREGATE_WORKERS", "2")) # Threads recomputing aggregates
+
+def compute_aggregates(storage, owner):
+    """Everything the pages derive from owner's transactions: summary figures, expense per category and
+    the rollup frame (all types) of each granularity. The frames are shared, so treat them as read-only."""
+    rollups = {granularity: storage.rollup_frame(owner, granularity) for granularity in aggregates.ROLLUP_GRANULARITIES}
+    return {
+        "totals": aggregates.ledger_summary(storage.ledger(owner)),
+        "expense_by_category": aggregates.category_totals(rollups["Y"], "Expense"),
+        "rollups": rollups,
+    }
+
+class AggregateWorker:
+    """Background recomputation of users' aggregates after their transactions change.
+
+    notify() returns at once; changes that arrive while a user's recomputation is still queued join it.
+    published() returns the user's snapshot (see compute_aggregates) only if it matches their current data.
+    """
+
+    def __init__(self, storage, writer, workers=AGGREGATE_WORKERS):
+        self.storage = storage
+        self.writer = writer
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mykhata-aggregates")
+        # Snapshots are published to frame_cache as (storage name, "aggregates", owner), tagged with the
+        # transactions version, so they share its memory cap and idle sweep
+        self._scheduled = set() # Owners with a recomputation queued but not yet started
+        self._running = {} # owner -> recomputations in progress
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def notify(self, owner):
+        """Schedules a recomputation of owner's aggregates, once their queued writes have landed."""
+        with self._lock:
+            if owner in self._scheduled:
+                return
+            self._scheduled.add(owner)
+        self._executor.submit(self._recompute, owner)
+
+    def published(self, owner):
+        """Returns owner's aggregates if they were computed at the current data version, else None.
+
+        On a miss with nothing in progress for owner a recomputation is scheduled, so the user's next view
+        finds them ready.
+        """
+        snapshot = frame_cache.hit((self.storage.name, "aggregates", owner), self.storage.data_version("transactions", owner))
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            busy = owner in self._running
+        if not busy:
+            self.notify(owner)
+        return None
+
+    def stats(self):
+        """Snapshots held and recomputations queued, for the debug panel."""
+        published = sum(1 for key, _ in frame_cache.entries(self.storage.name) if key[1] == "aggregates")
+        with self._lock:
+            return {"published_users": published, "scheduled": len(self._scheduled), "running": sum(self._running.values())}
+
+    def close(self):
+        """Stops the worker; recomputations not yet started are dropped."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _recompute(self, owner):
+        with self._lock:
+            self._scheduled.discard(owner) # Changes from here on schedule another pass
+            self._running[owner] = self._running.get(owner, 0) + 1
+        self.writer.wait("transactions", owner)
+        metrics.begin_run("aggregate", owner=owner) # Each recomputation is logged as its own run
+        try:
+            with metrics.span("recompute"):
+                version = self.storage.data_version("transactions", owner)
+                result = compute_aggregates(self.storage, owner)
+            # A write that landed meanwhile may be half reflected; its own notify() publishes the next snapshot
+            if self.storage.data_version("transactions", owner) == version:
+                frame_cache.put((self.storage.name, "aggregates", owner), version, result)
+        except Exception:
+            logger.exception("Recomputing aggregates for %s failed", owner)
+        finally:
+            metrics.end_run()
+            with self._lock:
+                self._running[owner] -= 1
+                if not self._running[owner]:
+                    del self._running[owner]
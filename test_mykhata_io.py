@@ -0,0 +1,76 @@
+# Statement import parsing: amounts and dates as Indian bank statements write them.
+import io
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+import mykhata_io
+
+COLUMN_MAP = {"Date": "Date", "Type": None, "Category": None, "Amount": "Amount", "Note": None}
+
+@pytest.mark.parametrize("text, expected", [
+    ("Rs.500", 500.0),
+    ("Rs.1,250", 1250.0),
+    ("Rs. 500.00", 500.0),
+    ("INR 2,000", 2000.0),
+    ("₹ 1,234.50", 1234.5),
+    ("1,00,000", 100000.0),
+    ("-250", -250.0),
+    ("Rs.-75", -75.0),
+    ("300 Dr", -300.0),
+    ("300 Cr", 300.0),
+])
+def test_parse_amounts(text, expected):
+    assert mykhata_io.parse_amounts(pd.Series([text], dtype=str)).tolist() == [expected]
+
+def test_parse_amounts_rejects_text_without_a_number():
+    assert mykhata_io.parse_amounts(pd.Series(["n/a", None], dtype=str)).isna().all()
+
+def test_parse_dates_mixes_dayfirst_and_iso():
+    dates = mykhata_io.parse_dates(pd.Series(["05/03/2024", "2024-03-06", "13/03/2024", "7 Mar 2024", "bad"], dtype=str))
+    assert dates.dt.strftime('%Y-%m-%d').tolist()[:4] == ["2024-03-05", "2024-03-06", "2024-03-13", "2024-03-07"]
+    assert pd.isna(dates.iloc[4])
+
+def test_parse_dates_iso_file_is_not_read_dayfirst():
+    dates = mykhata_io.parse_dates(pd.Series(["2024-03-05", "2024-03-06"], dtype=str), dayfirst=True)
+    assert dates.dt.strftime('%Y-%m-%d').tolist() == ["2024-03-05", "2024-03-06"]
+
+def test_normalize_statement_chunk():
+    chunk = pd.DataFrame({"Date": ["05/03/2024", "2024-03-06", "07/03/2024", "08/03/2024"],
+                          "Amount": ["Rs.500", "Rs.1,250 Cr", "₹ 99.50 Dr", "Rs. -"]}, dtype=str)
+    rows, rejected = mykhata_io.normalize_statement_chunk(chunk, COLUMN_MAP)
+    assert rejected == 1
+    assert rows["Date"].tolist() == ["2024-03-05", "2024-03-06", "2024-03-07"]
+    assert rows["Amount"].tolist() == [500.0, 1250.0, 99.5]
+    assert rows["Type"].tolist() == ["Income", "Income", "Expense"]
+    assert rows["Category"].tolist() == ["Other Income", "Other Income", "Other Expense"]
+
+class _Writes:
+    """Records what import_statement queues, committing each write at once."""
+    def __init__(self):
+        self.frames = []
+
+    def submit_transactions(self, effective_username, rows):
+        self.frames.append((effective_username, rows))
+        future = Future()
+        future.set_result(True)
+        return future
+
+def test_import_statement_streams_chunks():
+    source = io.StringIO("Date,Amount\n05/03/2024,Rs.500\n2024-03-06,-Rs.20\n,Rs.1\n07/03/2024,\"INR 1,250.00\"\n")
+    writes = _Writes()
+    result = mykhata_io.import_statement(writes, "User1", source, COLUMN_MAP, chunksize=2)
+    assert result == {"imported": 3, "rejected": 1, "chunks": 2}
+    rows = pd.concat([frame for _, frame in writes.frames])
+    assert rows["Amount"].tolist() == [500.0, 20.0, 1250.0]
+
+def test_import_statement_raises_a_failed_write():
+    class Failing(_Writes):
+        def submit_transactions(self, effective_username, rows):
+            future = Future()
+            future.set_exception(OSError("disk full"))
+            return future
+
+    with pytest.raises(OSError):
+        mykhata_io.import_statement(Failing(), "User1", io.StringIO("Date,Amount\n05/03/2024,Rs.500\n"), COLUMN_MAP)
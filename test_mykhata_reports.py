@@ -0,0 +1,64 @@
+# Report charts: LTTB line thinning and category folding for stacked bars.
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mykhata_reports as reports
+
+def reference_lttb(points, threshold):
+    """Steinarsson's reference implementation, returning the kept indices."""
+    every = (len(points) - 2) / (threshold - 2)
+    a, kept = 0, [0]
+    for i in range(threshold - 2):
+        avg_start, avg_end = int(math.floor((i + 1) * every) + 1), min(int(math.floor((i + 2) * every) + 1), len(points))
+        avg_x = sum(x for x, _ in points[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y for _, y in points[avg_start:avg_end]) / (avg_end - avg_start)
+        max_area, next_a = -1, None
+        for j in range(int(math.floor(i * every) + 1), int(math.floor((i + 1) * every) + 1)):
+            area = abs((points[a][0] - avg_x) * (points[j][1] - points[a][1]) - (points[a][0] - points[j][0]) * (avg_y - points[a][1])) * 0.5
+            if area > max_area:
+                max_area, next_a = area, j
+        kept.append(next_a)
+        a = next_a
+    return kept + [len(points) - 1]
+
+@pytest.mark.parametrize("n, threshold", [(10, 3), (100, 7), (1000, 50), (1234, 500), (5000, 333)])
+def test_lttb_matches_the_reference(n, threshold):
+    rng = np.random.default_rng(n)
+    x = np.cumsum(rng.integers(1, 5, n)).astype(float)
+    y = rng.normal(size=n).cumsum()
+    assert reports.lttb(x, y, threshold).tolist() == reference_lttb(list(zip(x, y)), threshold)
+
+def test_lttb_keeps_short_lines_whole():
+    assert reports.lttb([1, 2, 3], [1, 5, 2], 10).tolist() == [0, 1, 2]
+
+def test_downsample_lines_fits_the_budget_per_series():
+    days = pd.date_range("2024-01-01", periods=400, freq="D")
+    data = pd.DataFrame({"Period": np.tile(days, 2), "Type": ["Income"] * 400 + ["Expense"] * 400,
+                         "Amount": np.arange(800, dtype=float)})
+    thinned = reports.downsample_lines(data, budget=100)
+    assert thinned.groupby("Type").size().to_dict() == {"Expense": 50, "Income": 50}
+    assert thinned.groupby("Type")["Period"].agg(["min", "max"]).eq([days[0], days[-1]]).all().all()
+
+def _bars(periods, categories):
+    return pd.DataFrame([(period, f"C{c:02d}", float(c + 1)) for period in pd.date_range("2024-01-01", periods=periods, freq="MS")
+                         for c in range(categories)], columns=["Period", "Category", "Amount"])
+
+def test_fold_categories_keeps_the_largest_and_sums_the_rest():
+    data = _bars(2, 15) # 30 segments over a budget of 20: 9 categories per period plus "Other"
+    folded = reports.fold_categories(data, budget=20)
+    assert len(folded) == 20
+    assert set(folded["Category"]) == {f"C{c:02d}" for c in range(6, 15)} | {"Other"}
+    assert folded.groupby("Period")["Amount"].sum().tolist() == data.groupby("Period")["Amount"].sum().tolist()
+
+def test_fold_categories_keeps_at_least_bar_min_categories():
+    folded = reports.fold_categories(_bars(12, 20), budget=20)
+    assert folded["Category"].nunique() == reports.BAR_MIN_CATEGORIES + 1
+    assert reports.bar_marks(_bars(12, 20)) == len(folded)
+
+def test_fold_categories_leaves_data_that_fits():
+    data = _bars(3, 9)
+    assert reports.fold_categories(data, budget=10) is data # Folding would only rename the ninth category
+    assert reports.fold_categories(data, budget=27) is data
@@ -0,0 +1,199 @@
+# Storage: the frame cache, journal folds, incrementally kept aggregates, the CSV date index and the write queue.
+import glob
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import mykhata_aggregates as aggregates
+import mykhata_storage as storage
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # Storage paths are relative to the working directory
+    for key, version in storage.frame_cache.entries():
+        storage.frame_cache.invalidate(key, version)
+    return tmp_path
+
+def _rows(*records):
+    return pd.DataFrame([dict(zip(storage.TRANSACTION_COLUMNS, record)) for record in records], columns=storage.TRANSACTION_COLUMNS)
+
+def _days(owner, start, count, amount=10.0):
+    return _rows(*[(owner, day.strftime('%Y-%m-%d'), "Expense", "Food", amount, "")
+                   for day in pd.date_range(start, periods=count, freq="D")])
+
+# --- Frame Cache ---
+
+def test_frame_cache_keeps_a_cached_none():
+    cache = storage.FrameCache(1 << 20)
+    loads = []
+    for _ in range(2):
+        assert cache.get(("csv", "chart", "User1"), lambda: 1, lambda: loads.append(1)) is None
+    assert loads == [1]
+
+def test_write_during_a_load_is_not_appended_twice(workdir, monkeypatch):
+    csv_storage = storage.CsvStorage()
+    csv_storage.append_transactions("User1", _days("User1", "2024-01-01", 3))
+    read_transactions = csv_storage._read_transactions
+    loading, written = threading.Event(), threading.Event()
+    def slow_read(*args, **kwargs):
+        loading.set()
+        written.wait(0.5) # A writer that got past the owner lock would land here, between version read and load
+        return read_transactions(*args, **kwargs)
+    monkeypatch.setattr(csv_storage, "_read_transactions", slow_read)
+    writer = threading.Thread(target=lambda: (loading.wait(), csv_storage.append_transactions("User1", _days("User1", "2024-02-01", 1)), written.set()))
+    writer.start()
+    first = csv_storage.load_transactions("User1")
+    writer.join()
+    assert len(first) == 3 # The write waited for the load, then extended the cached frame
+    assert len(csv_storage.load_transactions("User1")) == 4
+
+def test_extend_drops_a_frame_that_was_not_current():
+    cache = storage.FrameCache(1 << 20)
+    cache.put(("csv", "transactions", "User1"), 1, pd.DataFrame({"Amount": [1.0]}))
+    cache.extend(("csv", "transactions", "User1"), 2, 3, pd.DataFrame({"Amount": [2.0]}))
+    assert cache.entries() == []
+
+# --- Journal Folds ---
+
+def test_csv_checkpoint_is_applied_once_after_a_crash(workdir):
+    data_file, journal_file = "shard.csv", "shard.journal"
+    _days("User1", "2024-01-01", 2).to_csv(data_file, index=False)
+    storage.append_journal_rows(_days("User1", "2024-01-03", 2), journal_file)
+    # A crash after the journal was frozen and half of it appended to the data file
+    checkpoint_file = f"{journal_file}.{os.path.getsize(data_file)}.ckpt"
+    os.replace(journal_file, checkpoint_file)
+    with open(checkpoint_file, encoding="utf-8") as src, open(data_file, "a", encoding="utf-8") as dst:
+        dst.write(src.readline())
+    assert storage.replay_journal(data_file, journal_file)
+    assert pd.read_csv(data_file)["Date"].tolist() == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+    assert not glob.glob(f"{journal_file}.*")
+    assert not storage.replay_journal(data_file, journal_file)
+
+def test_parquet_checkpoint_skips_year_files_it_already_wrote(workdir):
+    pytest.importorskip("pyarrow")
+    parquet = storage.ParquetStorage()
+    parquet.append_transactions("User1", pd.concat([_days("User1", "2023-12-30", 2), _days("User1", "2024-01-01", 2)]))
+    journal_file = parquet._journal_path("User1")
+    checkpoint_file = f"{journal_file}.1.ckpt"
+    os.replace(journal_file, checkpoint_file)
+    # A crash after the 2023 file absorbed the checkpoint, before the 2024 one
+    parquet._write_years(storage.read_journal(checkpoint_file).head(2), parquet._user_dir("User1"), "1")
+    parquet = storage.ParquetStorage()
+    assert sorted(parquet.scan_transactions("User1")["Date"].dt.strftime('%Y-%m-%d')) == ["2023-12-30", "2023-12-31", "2024-01-01", "2024-01-02"]
+    assert not os.path.exists(checkpoint_file)
+
+def test_parquet_fold_keeps_rows_with_unparseable_dates(workdir):
+    pytest.importorskip("pyarrow")
+    parquet = storage.ParquetStorage()
+    parquet.startup()
+    parquet.append_transactions("User1", _rows(("User1", "2024-03-05", "Expense", "Food", 120.0, "lunch"),
+                                               ("User1", "not a date", "Expense", "Travel", 40.0, "bus")))
+    parquet = storage.ParquetStorage()
+    parquet.startup() # Folds the journal into the year files
+    assert (workdir / storage.PARQUET_DIR / storage.shard_key("User1") / f"Year={storage.PARQUET_NULL_YEAR}" / "data.parquet").exists()
+    rows = parquet.scan_transactions("User1")
+    assert sorted(rows["Amount"].tolist()) == [40.0, 120.0]
+    assert rows.loc[rows["Note"] == "bus", "Date"].isna().all()
+    assert parquet.scan_transactions("User1", start="2024-01-01")["Amount"].tolist() == [120.0]
+    assert parquet.ledger("User1")["Expense"] == 160.0
+
+# --- Ledger and Rollup ---
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite", "parquet"])
+def test_appends_move_the_ledger_and_rollup_forward(workdir, monkeypatch, backend):
+    if backend == "parquet":
+        pytest.importorskip("pyarrow")
+    store = storage.open_storage(backend)
+    store.append_transactions("User1", _days("User1", "2024-01-30", 5))
+    store.ledger("User1")
+    store.rollup_frame("User1", "M")
+    def no_rescan(owner, columns):
+        raise AssertionError("history was rescanned")
+    monkeypatch.setattr(store, "_history", no_rescan)
+    store.append_transaction(dict(zip(storage.TRANSACTION_COLUMNS, ("User1", "2024-02-10", "Income", "Salary", 500.0, ""))))
+    store.append_transactions("User1", _days("User1", "2024-03-01", 3, amount=2.5))
+    history = store.scan_transactions("User1")
+    assert store.ledger("User1") == aggregates.ledger_from_frame(history)
+    expected = aggregates.rollup_frame(aggregates.rollup_from_frame(history), "M")
+    key = ["Period", "Type", "Category"]
+    pd.testing.assert_frame_equal(store.rollup_frame("User1", "M").sort_values(key).reset_index(drop=True),
+                                  expected.sort_values(key).reset_index(drop=True))
+
+# --- CSV Date Index ---
+
+def test_csv_range_read_parses_only_the_blocks_it_needs(workdir, monkeypatch):
+    monkeypatch.setattr(storage, "CSV_INDEX_BLOCK_ROWS", 10)
+    os.makedirs(storage.DATA_DIR)
+    data_file, _ = storage.shard_paths("User1")
+    _days("User1", "2024-01-01", 50).to_csv(data_file, index=False)
+    csv_storage = storage.CsvStorage()
+    start, end = pd.Timestamp("2024-01-15"), pd.Timestamp("2024-01-24")
+    index = storage.read_date_index(data_file, storage._index_path("User1"))
+    assert len(index["blocks"]) == 5
+    raw = storage.read_indexed_range(data_file, index, lambda col: True, start, end)
+    assert len(raw) == 20 # Blocks 2 and 3 of 5
+    rows = csv_storage.scan_transactions("User1", start=start, end=end)
+    assert rows["Date"].dt.strftime('%Y-%m-%d').tolist() == [day.strftime('%Y-%m-%d') for day in pd.date_range(start, end)]
+
+def test_csv_date_index_follows_appends_and_rewrites(workdir, monkeypatch):
+    monkeypatch.setattr(storage, "CSV_INDEX_BLOCK_ROWS", 10)
+    os.makedirs(storage.DATA_DIR)
+    data_file, _ = storage.shard_paths("User1")
+    index_file = storage._index_path("User1")
+    _days("User1", "2024-01-01", 20).to_csv(data_file, index=False)
+    storage.read_date_index(data_file, index_file)
+    _days("User1", "2024-01-21", 5).to_csv(data_file, mode="a", header=False, index=False)
+    late = storage.read_indexed_range(data_file, storage.read_date_index(data_file, index_file), lambda col: True, pd.Timestamp("2024-01-21"))
+    assert late["Date"].tolist()[-5:] == [f"2024-01-{day}" for day in range(21, 26)]
+    _days("User1", "2023-06-01", 12).to_csv(data_file, index=False) # Rewritten: the index starts over
+    index = storage.read_date_index(data_file, index_file)
+    assert [block[2:] for block in index["blocks"]] == [["2023-06-01", "2023-06-10"], ["2023-06-11", "2023-06-12"]]
+
+# --- Write Queue ---
+
+class _Recorder:
+    """A storage whose first append blocks until released, so later submissions queue up behind it."""
+    def __init__(self):
+        self.entered, self.release = threading.Event(), threading.Event()
+        self.appends, self.categories = [], []
+
+    def append_transactions(self, owner, rows):
+        self.entered.set()
+        self.release.wait(5)
+        self.appends.append((owner, rows["Amount"].tolist()))
+
+    def add_categories(self, entries):
+        self.categories.append(list(entries))
+        return [True] * len(entries)
+
+def test_write_queue_commits_what_queued_up_together():
+    recorder = _Recorder()
+    writer = storage.WriteQueue(recorder)
+    record = lambda owner, amount: dict(zip(storage.TRANSACTION_COLUMNS, (owner, "2024-01-01", "Expense", "Food", amount, "")))
+    first = writer.submit_transaction(record("User1", 1.0))
+    recorder.entered.wait(5)
+    futures = [writer.submit_transaction(record("User1", 2.0)),
+               writer.submit_transactions("User1", _days("User1", "2024-01-02", 2, amount=3.0)),
+               writer.submit_transaction(record("User2", 4.0)),
+               writer.submit_transaction(record("User1", 5.0)),
+               writer.submit_category("User1", "Expense", "Pets"),
+               writer.submit_category("User2", "Income", "Gifts")]
+    recorder.release.set()
+    assert all(future.result(5) for future in [first] + futures)
+    writer.close()
+    assert recorder.appends == [("User1", [1.0]), ("User1", [2.0, 3.0, 3.0, 5.0]), ("User2", [4.0])]
+    assert recorder.categories == [[("User1", "Expense", "Pets"), ("User2", "Income", "Gifts")]]
+    assert writer.wait("transactions", "User1", timeout=0)
+
+def test_write_queue_fails_every_future_of_a_failed_write():
+    class Failing(_Recorder):
+        def append_transactions(self, owner, rows):
+            raise OSError("disk full")
+    writer = storage.WriteQueue(Failing())
+    futures = [writer.submit_transactions("User1", _days("User1", "2024-01-01", 2)) for _ in range(2)]
+    for future in futures:
+        with pytest.raises(OSError):
+            future.result(5)
+    writer.close()